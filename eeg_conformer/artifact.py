@@ -0,0 +1,78 @@
+# Exported EEGConformer artifacts: layout and a loader that needs only torch or onnxruntime
+import json
+import os
+
+import numpy as np
+
+MODEL_INFO = "model.json"
+PIPELINE_CONFIG = "preprocessing.json"
+MODEL_FILES = {'torchscript': "model.pt", 'onnx': "model.onnx"}
+
+
+def read_info(model_dir):
+    """Metadata written next to an exported model (format, classes, input shape, ...)."""
+    with open(os.path.join(model_dir, MODEL_INFO)) as f:
+        return json.load(f)
+
+
+class ExportedModel:
+    """
+    Inference-only view of an artifact written by export.py.
+
+    TorchScript artifacts are run with torch, ONNX artifacts with
+    onnxruntime; neither needs braindecode or the training code. Inputs are
+    preprocessed (C, T) windows or (N, C, T) batches, preprocessed with the
+    pipeline saved as preprocessing.json in the same directory.
+    """
+
+    def __init__(self, model_dir, threads=1):
+        self.model_dir = model_dir
+        self.info = read_info(model_dir)
+        self.classes = np.asarray(self.info['classes'])
+        self.n_chans = self.info['n_chans']
+        self.n_times = self.info['n_times']
+        path = os.path.join(model_dir, MODEL_FILES[self.info['format']])
+
+        if self.info['format'] == 'torchscript':
+            import torch
+            if threads:
+                torch.set_num_threads(threads)
+            self._torch = torch
+            self._module = torch.jit.load(path, map_location="cpu").eval()
+        else:
+            import onnxruntime as ort
+            options = ort.SessionOptions()
+            if threads:
+                options.intra_op_num_threads = threads
+                options.inter_op_num_threads = 1
+            self._session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+            self._input = self._session.get_inputs()[0].name
+
+    @property
+    def pipeline_config_path(self):
+        return os.path.join(self.model_dir, PIPELINE_CONFIG)
+
+    def logits(self, x):
+        """Raw model outputs, (N, n_classes), for a (C, T) window or an (N, C, T) batch."""
+        x = np.asarray(x, dtype=np.float32)
+        if x.ndim == 2:
+            x = x[None]
+        if x.shape[1:] != (self.n_chans, self.n_times):
+            raise ValueError(f"Expected windows of shape ({self.n_chans}, {self.n_times}), got {x.shape[1:]}")
+        x = np.ascontiguousarray(x)
+        if self.info['format'] == 'torchscript':
+            with self._torch.inference_mode():
+                return self._module(self._torch.from_numpy(x)).float().numpy()
+        return self._session.run(None, {self._input: x})[0]
+
+    def predict(self, x):
+        """
+        Class labels and softmax probabilities.
+
+        Returns:
+            tuple: (labels (N,), probabilities (N, n_classes))
+        """
+        logits = self.logits(x)
+        exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+        probabilities = exp / exp.sum(axis=1, keepdims=True)
+        return self.classes[probabilities.argmax(axis=1)], probabilities
@@ -0,0 +1,220 @@
+# CPU latency, size, memory and accuracy of candidate braindecode models on the preprocessed data
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+# Shared modules from the repository's preprocessing directory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'preprocessing'))
+from export import latency_ms
+from main import evaluate, make_loader, train_epoch
+from parquet_dataset import ParquetEEGDataset, iter_parquet_batches, read_summary, split_rows
+from artifact_cache import make_key
+from checkpoint import source_fingerprint
+from run_report import peak_rss_mb, reset_peak_rss, run_child
+
+# Candidate name -> (braindecode class names, newest first, and constructor settings)
+CANDIDATES = {
+    'EEGNet': (('EEGNet', 'EEGNetv4'), {}),
+    'ShallowFBCSPNet': (('ShallowFBCSPNet',), {'final_conv_length': 'auto'}),
+    'Deep4Net': (('Deep4Net',), {'final_conv_length': 'auto'}),
+    'EEGConformer': (('EEGConformer',), {'final_fc_length': 'auto'}),
+}
+
+
+def build_candidate(name, summary, n_outputs):
+    """Candidate model for the file's input shape, whatever braindecode version is installed."""
+    import braindecode.models as models
+    class_names, kwargs = CANDIDATES[name]
+    cls = next((getattr(models, c) for c in class_names if hasattr(models, c)), None)
+    if cls is None:
+        raise ImportError(f"braindecode has none of {class_names}")
+    return cls(n_chans=summary['n_channels'], n_outputs=n_outputs, n_times=summary['n_times'], **kwargs)
+
+
+def _train_or_load(name, model, data_path, summary, classes, train_rows, checkpoint_path, settings):
+    """Load the model from checkpoint_path if it was trained with the same settings, else train and save it."""
+    key = make_key(source=source_fingerprint(data_path), model=name, settings=settings)
+    if os.path.exists(checkpoint_path):
+        checkpoint = torch.load(checkpoint_path, map_location="cpu", weights_only=False)
+        if checkpoint['key'] == key:
+            model.load_state_dict(checkpoint['model_state'])
+            return {**checkpoint['train'], 'loaded': True}
+
+    torch.manual_seed(settings['seed'])
+    device = torch.device("cpu")
+    train_set = ParquetEEGDataset(data_path, settings['batch_size'], train_rows, classes, shuffle=True,
+                                  seed=settings['seed'], summary=summary)
+    loader = make_loader(train_set, device, settings['workers'])
+    optimizer = torch.optim.AdamW(model.parameters(), lr=settings['lr'], weight_decay=settings['weight_decay'])
+    criterion = torch.nn.CrossEntropyLoss()
+    start = time.perf_counter()
+    for epoch in range(settings['epochs']):
+        train_set.set_epoch(epoch)
+        metrics = train_epoch(model, loader, optimizer, criterion, device)
+        print(f"[{name}] epoch {epoch + 1}: loss {metrics['loss']:.4f}, {metrics['samples_per_s']:.0f} samples/s")
+    train = {'epochs': settings['epochs'], 'seconds': time.perf_counter() - start,
+             'samples_per_s': metrics['samples_per_s'] if settings['epochs'] else None}
+    torch.save({'key': key, 'model_state': model.state_dict(), 'train': train}, checkpoint_path)
+    return {**train, 'loaded': False}
+
+
+def measure_model(model, windows, targets, settings):
+    """
+    Accuracy, latency, size and inference memory of a trained model.
+
+    Args:
+        model (torch.nn.Module): Model to measure
+        windows (np.ndarray): (N, C, T) float32 validation windows
+        targets (np.ndarray): (N,) class indices
+        settings (dict): threads, inference_batch, windows and batches, as in benchmark_models
+
+    Returns:
+        dict: One benchmark result, without the model name and training info
+    """
+    model.eval()
+    torch.set_num_threads(settings['threads'])
+    batch = settings['inference_batch']
+    criterion = torch.nn.CrossEntropyLoss()
+    valid = evaluate(model, [(torch.from_numpy(windows[i:i + batch]), torch.from_numpy(targets[i:i + batch]))
+                             for i in range(0, len(windows), batch)], criterion, torch.device("cpu"))
+
+    def forward(x):
+        with torch.inference_mode():
+            return model(x)
+
+    singles = [torch.from_numpy(w[None]) for w in windows[:settings['windows']]]
+    batches = [torch.from_numpy(windows[i:i + batch]) for i in range(0, len(windows) - batch + 1, batch)]
+    batches = (batches * (1 + settings['batches'] // max(len(batches), 1)))[:settings['batches']]
+    # Peak memory of inference alone: reset the high-water mark after training and loading the data
+    scoped = reset_peak_rss()
+    baseline = peak_rss_mb()
+    single_ms = latency_ms(forward, singles)
+    batch_ms = latency_ms(forward, batches, warmup=2) if batches else None
+    peak = peak_rss_mb()
+
+    return {
+        'class': type(model).__name__,
+        'params': sum(p.numel() for p in model.parameters()),
+        'size_mb': sum(t.numel() * t.element_size() for t in model.state_dict().values()) / (1024 * 1024),
+        'valid_windows': len(windows),
+        'accuracy': valid['accuracy'],
+        'valid_loss': valid['loss'],
+        'threads': settings['threads'],
+        'single_ms': single_ms,
+        'batch_size': batch,
+        'batch_ms': batch_ms,
+        'batch_windows_per_s': batch / batch_ms['p50'] * 1000 if batch_ms else None,
+        'peak_rss_mb': peak,
+        'inference_rss_growth_mb': peak - baseline if scoped else None,
+    }
+
+
+def _benchmark_child(name, data_path, checkpoint_path, settings, queue):
+    """Child process: train or load one candidate, then measure it on the validation rows."""
+    summary = read_summary(data_path)
+    classes = np.asarray(sorted(summary['label_counts']))
+    train_rows, valid_rows = split_rows(summary['n_samples'], settings['valid_fraction'], settings['seed'])
+    model = build_candidate(name, summary, len(classes))
+    train = _train_or_load(name, model, data_path, summary, classes, train_rows, checkpoint_path,
+                           {k: settings[k] for k in ('epochs', 'batch_size', 'lr', 'weight_decay', 'valid_fraction',
+                                                     'seed', 'workers')})
+
+    windows, targets = [], []
+    for x, y in iter_parquet_batches(data_path, summary, settings['inference_batch'], valid_rows, classes):
+        windows.append(x)
+        targets.append(y)
+    queue.put({'model': name, 'train': train,
+               **measure_model(model, np.concatenate(windows), np.concatenate(targets), settings)})
+
+
+def benchmark_models(data_path, models=tuple(CANDIDATES), checkpoint_dir="model_benchmarks", epochs=20,
+                     batch_size=64, lr=0.001, weight_decay=0.01, valid_fraction=0.2, seed=0, workers=2,
+                     threads=1, windows=300, inference_batch=64, batches=20):
+    """
+    Train (or load) every candidate on the same split and measure it, each in
+    a fresh process so peak memory belongs to that model alone.
+
+    Models are trained with the same settings and kept in checkpoint_dir;
+    reruns with unchanged data and settings only measure. Latency is measured
+    with `threads` torch threads, for single windows (the real-time path) and
+    for batches of inference_batch windows.
+
+    Returns:
+        list: One result dict per model
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    settings = {'epochs': epochs, 'batch_size': batch_size, 'lr': lr, 'weight_decay': weight_decay,
+                'valid_fraction': valid_fraction, 'seed': seed, 'workers': workers, 'threads': threads,
+                'windows': windows, 'inference_batch': inference_batch, 'batches': batches}
+    results = []
+    for name in models:
+        print(f"Benchmarking {name}")
+        results.append(run_child(_benchmark_child, (name, data_path, os.path.join(checkpoint_dir, f"{name}.pt"),
+                                                     settings)))
+    return results
+
+
+def recommend(results, budget_ms=100.0, tolerance=0.02):
+    """
+    Fastest model (single-window p95) within tolerance of the best accuracy
+    and within the latency budget, or None if no model qualifies.
+    """
+    best = max(r['accuracy'] for r in results)
+    eligible = [r for r in results if r['accuracy'] >= best - tolerance and r['single_ms']['p95'] <= budget_ms]
+    return min(eligible, key=lambda r: r['single_ms']['p95']) if eligible else None
+
+
+def format_table(results):
+    header = (f"{'model':<16} {'params':>10} {'MB':>7} {'accuracy':>9} {'1-win p50':>10} {'1-win p95':>10} "
+              f"{'batch p50':>10} {'win/s':>8} {'peak RSS':>9} {'infer +MB':>10}")
+    lines = [header, "-" * len(header)]
+    for r in results:
+        batch_p50 = f"{r['batch_ms']['p50']:.1f}" if r['batch_ms'] else "-"
+        rate = f"{r['batch_windows_per_s']:.0f}" if r['batch_windows_per_s'] else "-"
+        growth = f"{r['inference_rss_growth_mb']:.1f}" if r['inference_rss_growth_mb'] is not None else "-"
+        lines.append(f"{r['model']:<16} {r['params']:>10,} {r['size_mb']:>7.2f} {r['accuracy']:>9.3f} "
+                     f"{r['single_ms']['p50']:>10.2f} {r['single_ms']['p95']:>10.2f} {batch_p50:>10} {rate:>8} "
+                     f"{r['peak_rss_mb']:>9.0f} {growth:>10}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare braindecode models for CPU inference on our data")
+    parser.add_argument("data", help="Parquet file written by preprocessing/preprocess_data.py")
+    parser.add_argument("--models", nargs="+", choices=list(CANDIDATES), default=list(CANDIDATES))
+    parser.add_argument("--checkpoint-dir", default="model_benchmarks", help="Where trained candidates are kept")
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=64, help="Training batch size")
+    parser.add_argument("--lr", type=float, default=0.001)
+    parser.add_argument("--weight-decay", type=float, default=0.01)
+    parser.add_argument("--valid-fraction", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=2, help="DataLoader workers for training")
+    parser.add_argument("--threads", type=int, default=1, help="Torch threads for the latency measurements")
+    parser.add_argument("--windows", type=int, default=300, help="Single windows timed per model")
+    parser.add_argument("--inference-batch", type=int, default=64)
+    parser.add_argument("--batches", type=int, default=20, help="Batches timed per model")
+    parser.add_argument("--budget-ms", type=float, default=100.0, help="Single-window p95 latency budget")
+    parser.add_argument("--tolerance", type=float, default=0.02, help="Accuracy a faster model may give up")
+    parser.add_argument("--json", default="model_benchmarks/report.json", help="Where to write the report")
+    args = parser.parse_args()
+
+    results = benchmark_models(args.data, args.models, args.checkpoint_dir, args.epochs, args.batch_size, args.lr,
+                               args.weight_decay, args.valid_fraction, args.seed, args.workers, args.threads,
+                               args.windows, args.inference_batch, args.batches)
+    print(format_table(results))
+    choice = recommend(results, args.budget_ms, args.tolerance)
+    if choice is None:
+        print(f"\nNo model is within {args.tolerance:.0%} of the best accuracy and {args.budget_ms:.0f} ms p95")
+    else:
+        print(f"\nRecommended for the real-time path: {choice['model']} "
+              f"(accuracy {choice['accuracy']:.3f}, single-window p95 {choice['single_ms']['p95']:.2f} ms)")
+    with open(args.json, "w") as f:
+        json.dump({'settings': vars(args), 'results': results,
+                   'recommended': choice['model'] if choice else None}, f, indent=2)
+    print(f"Report written to {args.json}")
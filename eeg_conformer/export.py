@@ -0,0 +1,209 @@
+# Export a trained EEGConformer for CPU serving and compare it against the training model
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+# Shared modules from the repository's preprocessing directory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'preprocessing'))
+from artifact import MODEL_FILES, MODEL_INFO, PIPELINE_CONFIG, ExportedModel
+from main import build_model
+from parquet_dataset import iter_parquet_batches, read_summary, split_rows
+from pipeline import PreprocessingPipeline
+
+FORMATS = tuple(MODEL_FILES)
+
+
+def load_trained(checkpoint_path):
+    """
+    Rebuild the model saved by main.py.
+
+    Returns:
+        tuple: (model in eval mode on the CPU, checkpoint dict)
+    """
+    checkpoint = torch.load(checkpoint_path, map_location="cpu", weights_only=False)
+    shape = {'n_channels': checkpoint['n_chans'], 'n_times': checkpoint['n_times']}
+    model = build_model(shape, len(checkpoint['classes']), checkpoint.get('depth'))
+    model.load_state_dict(checkpoint['model_state'])
+    return model.eval(), checkpoint
+
+
+def quantize_linear(model):
+    """
+    Dynamic int8 quantization of every nn.Linear, which covers the attention
+    query/key/value/output projections and the feed-forward and classifier
+    layers: weights are stored as int8 and activations quantized on the fly.
+    """
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def export_model(checkpoint_path, output_dir, format='torchscript', quantize=False, opset=17):
+    """
+    Write a serving artifact: the model, model.json (classes, input shape,
+    format) and preprocessing.json, the pipeline config the training data was
+    preprocessed with (load it with PreprocessingPipeline.from_file).
+
+    ONNX models are quantized with onnxruntime's dynamic quantization after
+    export, since torch's quantized modules do not export to ONNX.
+
+    Returns:
+        str: output_dir
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unknown format {format!r}; expected one of {FORMATS}")
+    model, checkpoint = load_trained(checkpoint_path)
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, MODEL_FILES[format])
+    example = torch.zeros(1, checkpoint['n_chans'], checkpoint['n_times'])
+
+    if format == 'torchscript':
+        module = quantize_linear(model) if quantize else model
+        with torch.no_grad():
+            traced = torch.jit.trace(module, example)
+        if not quantize:
+            # Folds weights into the graph; quantized packed weights are already constants
+            traced = torch.jit.freeze(traced)
+        torch.jit.save(traced, path)
+    else:
+        fp32_path = path + ".fp32" if quantize else path
+        torch.onnx.export(model, example, fp32_path, input_names=["eeg"], output_names=["logits"],
+                          dynamic_axes={"eeg": {0: "batch"}, "logits": {0: "batch"}}, opset_version=opset)
+        if quantize:
+            try:
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+            except ImportError:
+                raise ImportError("Quantizing ONNX models requires onnxruntime (pip install onnxruntime)")
+            quantize_dynamic(fp32_path, path, weight_type=QuantType.QInt8)
+            os.remove(fp32_path)
+
+    pipeline_config = checkpoint['attrs'].get('pipeline')
+    if pipeline_config is None:
+        raise ValueError(f"{checkpoint_path} was trained on data without a saved pipeline config; "
+                         "rerun preprocess_data.py")
+    PreprocessingPipeline(pipeline_config).save(os.path.join(output_dir, PIPELINE_CONFIG))
+    with open(os.path.join(output_dir, MODEL_INFO), "w") as f:
+        json.dump({
+            'format': format,
+            'quantized': bool(quantize),
+            'classes': checkpoint['classes'],
+            'n_chans': checkpoint['n_chans'],
+            'n_times': checkpoint['n_times'],
+            'sampling_rate': pipeline_config['sampling_rate'],
+            'checkpoint': os.path.abspath(checkpoint_path),
+            'exported': time.time(),
+        }, f, indent=2)
+    print(f"Exported {format}{' (int8)' if quantize else ''} model to {output_dir} "
+          f"({os.path.getsize(path) / (1024 * 1024):.1f} MB)")
+    return output_dir
+
+
+def latency_ms(predict, windows, warmup=10):
+    """Per-window latency percentiles of predict over windows, after a warm-up."""
+    for window in windows[:warmup]:
+        predict(window)
+    times = []
+    for window in windows:
+        start = time.perf_counter()
+        predict(window)
+        times.append((time.perf_counter() - start) * 1000)
+    return {f"p{q}": float(np.percentile(times, q)) for q in (50, 95, 99)}
+
+
+def compare_with_training_model(checkpoint_path, model_dir, data_path, max_windows=500, threads=1):
+    """
+    Per-window latency and validation accuracy of the exported artifact
+    against the fp32 training model, on the validation rows held out by
+    main.py (same seed and fraction) of the training file.
+
+    Returns:
+        dict: Latency percentiles (ms), accuracy and size of both models, and
+        how often their predictions agree
+    """
+    torch.set_num_threads(threads)
+    model, checkpoint = load_trained(checkpoint_path)
+    exported = ExportedModel(model_dir, threads=threads)
+    classes = np.asarray(checkpoint['classes'])
+
+    summary = read_summary(data_path)
+    _, valid_rows = split_rows(summary['n_samples'], checkpoint.get('valid_fraction', 0.2),
+                               checkpoint.get('seed', 0))
+    windows, targets = [], []
+    for x, y in iter_parquet_batches(data_path, summary, 1, valid_rows, classes):
+        windows.append(x[0])
+        targets.append(int(y[0]))
+        if len(windows) >= max_windows:
+            break
+    targets = np.asarray(targets)
+
+    def reference(window):
+        with torch.inference_mode():
+            return model(torch.from_numpy(window[None])).numpy()
+
+    ref_logits = np.concatenate([reference(w) for w in windows])
+    exp_logits = np.concatenate([exported.logits(w) for w in windows])
+    ref_pred = ref_logits.argmax(axis=1)
+    exp_pred = exp_logits.argmax(axis=1)
+    info = exported.info
+    reference_bytes = sum(p.numel() * p.element_size() for p in model.state_dict().values())
+    return {
+        'windows': len(windows),
+        'threads': threads,
+        'reference': {
+            'latency_ms': latency_ms(reference, windows),
+            'accuracy': float(np.mean(ref_pred == targets)),
+            'size_mb': reference_bytes / (1024 * 1024),
+        },
+        'exported': {
+            'format': info['format'],
+            'quantized': info['quantized'],
+            'latency_ms': latency_ms(exported.logits, windows),
+            'accuracy': float(np.mean(exp_pred == targets)),
+            'size_mb': os.path.getsize(os.path.join(model_dir, MODEL_FILES[info['format']])) / (1024 * 1024),
+        },
+        'agreement': float(np.mean(ref_pred == exp_pred)),
+        'max_abs_logit_diff': float(np.abs(ref_logits - exp_logits).max()),
+    }
+
+
+def format_comparison(report, budget_ms):
+    lines = [f"{'model':<28} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'accuracy':>9} {'MB':>7}"]
+    lines.append("-" * len(lines[0]))
+    exported = report['exported']
+    name = f"{exported['format']}{' int8' if exported['quantized'] else ''}"
+    for label, r in (("training model (fp32)", report['reference']), (name, exported)):
+        lat = r['latency_ms']
+        lines.append(f"{label:<28} {lat['p50']:>8.2f} {lat['p95']:>8.2f} {lat['p99']:>8.2f} "
+                     f"{r['accuracy']:>9.3f} {r['size_mb']:>7.2f}")
+    lines.append(f"\n{report['windows']} validation windows, {report['threads']} thread(s): predictions agree on "
+                 f"{report['agreement']:.1%}, max logit difference {report['max_abs_logit_diff']:.3g}")
+    verdict = "within" if exported['latency_ms']['p95'] <= budget_ms else "OVER"
+    lines.append(f"Exported p95 latency {exported['latency_ms']['p95']:.2f} ms is {verdict} the "
+                 f"{budget_ms:.0f} ms per-window budget")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a trained EEGConformer for CPU serving")
+    parser.add_argument("checkpoint", help="Model file written by main.py")
+    parser.add_argument("output_dir", help="Artifact directory (model, model.json, preprocessing.json)")
+    parser.add_argument("--format", choices=FORMATS, default="torchscript")
+    parser.add_argument("--quantize", action="store_true", help="Dynamic int8 quantization of linear layers")
+    parser.add_argument("--opset", type=int, default=17, help="ONNX opset")
+    parser.add_argument("--compare", default=None, metavar="DATA",
+                        help="Preprocessed parquet the model was trained on: compare latency and accuracy")
+    parser.add_argument("--windows", type=int, default=500, help="Validation windows for the comparison")
+    parser.add_argument("--threads", type=int, default=1, help="Inference threads for the comparison")
+    parser.add_argument("--budget-ms", type=float, default=100.0, help="Per-window p95 latency budget")
+    args = parser.parse_args()
+
+    export_model(args.checkpoint, args.output_dir, args.format, args.quantize, args.opset)
+    if args.compare:
+        report = compare_with_training_model(args.checkpoint, args.output_dir, args.compare, args.windows,
+                                             args.threads)
+        print(format_comparison(report, args.budget_ms))
+        with open(os.path.join(args.output_dir, "comparison.json"), "w") as f:
+            json.dump({**report, 'budget_ms': args.budget_ms}, f, indent=2)
@@ -1,43 +1,354 @@
-from braindecode.models import EEGConformer
-import mne
+# Train EEGConformer on a preprocessed parquet file, streaming batches from disk
+import argparse
+import inspect
+import json
+import time
+from contextlib import nullcontext
+
 import numpy as np
 import torch
+from braindecode.models import EEGConformer
+from torch.utils.data import DataLoader
+
+from parquet_dataset import (DEFAULT_BUFFER_SIZE, DEFAULT_CYCLE_LENGTH, ParquetEEGDataset, read_summary,
+                             split_rows)
+
+
+PRECISIONS = ("auto", "fp32", "bf16")
+MEMORY_FORMATS = {"contiguous": torch.contiguous_format, "channels_last": torch.channels_last}
+
+
+def cpu_supports_bf16():
+    """Whether the CPU has native bfloat16 instructions (AVX512-BF16 or AMX), per /proc/cpuinfo."""
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def autocast_dtype(precision, device):
+    """
+    Autocast dtype for a precision setting, or None for full fp32.
+
+    "auto" picks bf16 on hardware that computes it natively and fp32
+    elsewhere, where emulated bf16 is slower than fp32.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}; expected one of {PRECISIONS}")
+    if precision == "auto":
+        native = torch.cuda.is_bf16_supported() if device.type == "cuda" else cpu_supports_bf16()
+        precision = "bf16" if native else "fp32"
+    return torch.bfloat16 if precision == "bf16" else None
+
+
+def configure_threads(intra_op=None, inter_op=None):
+    """
+    Set torch's intra-op (within an operator) and inter-op (between
+    independent operators) thread pools; None keeps the default. Must run
+    before any parallel work, as the inter-op pool cannot be resized later.
+
+    Returns:
+        tuple: (intra-op threads, inter-op threads) in effect
+    """
+    if inter_op:
+        torch.set_num_interop_threads(inter_op)
+    if intra_op:
+        torch.set_num_threads(intra_op)
+    return torch.get_num_threads(), torch.get_num_interop_threads()
+
+
+def _init_loader_worker(_):
+    # Workers only decode parquet; keep them from competing with the training threads
+    torch.set_num_threads(1)
+
+
+def build_model(summary, n_outputs, depth=None):
+    """EEGConformer for the file's input shape, optionally with `depth` transformer layers."""
+    kwargs = {}
+    if depth is not None:
+        # Renamed from att_depth to num_layers in braindecode 1.0
+        name = "num_layers" if "num_layers" in inspect.signature(EEGConformer).parameters else "att_depth"
+        kwargs[name] = depth
+    return EEGConformer(
+        n_chans=summary['n_channels'],
+        n_outputs=n_outputs,
+        n_times=summary['n_times'],
+        final_fc_length="auto",
+        **kwargs,
+    )
+
+
+def make_loader(dataset, device, num_workers=4, prefetch_factor=4):
+    """
+    DataLoader over a batched ParquetEEGDataset.
+
+    Workers decode batches in the background, each keeping prefetch_factor
+    batches ready; on CUDA the batches are placed in pinned memory so the
+    copy to the GPU can overlap with compute.
+    """
+    return DataLoader(
+        dataset,
+        batch_size=None,
+        num_workers=num_workers,
+        pin_memory=device.type == "cuda",
+        prefetch_factor=prefetch_factor if num_workers > 0 else None,
+        worker_init_fn=_init_loader_worker,
+    )
+
+
+def label_modules(model, depth=2):
+    """
+    Mark the forward pass of every submodule down to depth as a
+    "module::<name>" range in profiler traces, so time can be attributed to
+    the conformer blocks. Returns the hook handles.
+    """
+    handles = []
+    for name, module in model.named_modules():
+        if not name or name.count(".") >= depth:
+            continue
+        ranges = []
+
+        def enter(_module, _inputs, name=name, ranges=ranges):
+            ranges.append(torch.profiler.record_function(f"module::{name}"))
+            ranges[-1].__enter__()
+
+        def leave(_module, _inputs, _output, ranges=ranges):
+            ranges.pop().__exit__(None, None, None)
+
+        handles.append(module.register_forward_pre_hook(enter))
+        handles.append(module.register_forward_hook(leave))
+    return handles
+
+
+def make_profiler(trace_dir, steps, device):
+    """Profiler recording `steps` training steps after one skipped and one warm-up step."""
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if device.type == "cuda":
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    return torch.profiler.profile(
+        activities=activities,
+        schedule=torch.profiler.schedule(wait=1, warmup=1, active=steps, repeat=1),
+        on_trace_ready=torch.profiler.tensorboard_trace_handler(trace_dir),
+        record_shapes=True,
+    )
+
+
+def print_profile(profiler, row_limit=20):
+    """Per-module totals followed by the most expensive operators."""
+    events = profiler.key_averages()
+    modules = sorted((e for e in events if e.key.startswith("module::")), key=lambda e: -e.cpu_time_total)
+    if modules:
+        total = sum(e.cpu_time_total for e in modules if e.key.count(".") == 0) or 1
+        print(f"{'module':<40} {'calls':>6} {'CPU ms':>10} {'share':>7}")
+        for e in modules:
+            print(f"{e.key[len('module::'):]:<40} {e.count:>6} {e.cpu_time_total / 1000:>10.1f} "
+                  f"{e.cpu_time_total / total:>7.1%}")
+    print(events.table(sort_by="self_cpu_time_total", row_limit=row_limit))
+
+
+def _autocast(device, dtype):
+    return torch.autocast(device_type=device.type, dtype=dtype) if dtype is not None else nullcontext()
+
+
+def train_epoch(model, loader, optimizer, criterion, device, amp_dtype=None, profiler=None):
+    """
+    One pass over the training loader.
+
+    Args:
+        amp_dtype (torch.dtype): Autocast dtype for the forward pass and loss (None: fp32)
+        profiler (torch.profiler.profile): Stepped after every training step
+
+    Returns:
+        dict: loss, accuracy, samples, seconds, samples_per_s, step_ms (mean and
+        median time of a training step, data loading excluded) and data_wait
+        (fraction of the epoch spent waiting for the next batch)
+    """
+    model.train()
+    total_loss = 0.0
+    correct = 0
+    n_samples = 0
+    wait = 0.0
+    step_times = []
+    start = time.perf_counter()
+    ready = start
+    for x, y in loader:
+        step_start = time.perf_counter()
+        wait += step_start - ready
+        x = x.to(device, non_blocking=True)
+        y = y.to(device, non_blocking=True)
+        optimizer.zero_grad(set_to_none=True)
+        with _autocast(device, amp_dtype):
+            logits = model(x)
+            loss = criterion(logits, y)
+        loss.backward()
+        optimizer.step()
+        total_loss += loss.item() * len(y)
+        correct += (logits.argmax(dim=1) == y).sum().item()
+        n_samples += len(y)
+        if profiler is not None:
+            profiler.step()
+        ready = time.perf_counter()
+        step_times.append(ready - step_start)
+    seconds = time.perf_counter() - start
+    return {
+        'loss': total_loss / max(n_samples, 1),
+        'accuracy': correct / max(n_samples, 1),
+        'samples': n_samples,
+        'seconds': seconds,
+        'samples_per_s': n_samples / seconds if seconds > 0 else 0.0,
+        'step_ms': float(np.mean(step_times) * 1000) if step_times else 0.0,
+        'step_ms_median': float(np.median(step_times) * 1000) if step_times else 0.0,
+        'data_wait': wait / seconds if seconds > 0 else 0.0,
+    }
+
+
+@torch.no_grad()
+def evaluate(model, loader, criterion, device, amp_dtype=None):
+    """Loss and accuracy over a loader."""
+    model.eval()
+    total_loss = 0.0
+    correct = 0
+    n_samples = 0
+    for x, y in loader:
+        x = x.to(device, non_blocking=True)
+        y = y.to(device, non_blocking=True)
+        with _autocast(device, amp_dtype):
+            logits = model(x)
+        total_loss += criterion(logits.float(), y).item() * len(y)
+        correct += (logits.argmax(dim=1) == y).sum().item()
+        n_samples += len(y)
+    return {'loss': total_loss / max(n_samples, 1), 'accuracy': correct / max(n_samples, 1), 'samples': n_samples}
+
+
+def train(data_path, output_path="eeg_conformer.pt", max_epochs=30, batch_size=32, lr=0.001, weight_decay=0.01,
+          valid_fraction=0.2, num_workers=4, prefetch_factor=4, seed=0, device=None,
+          cycle_length=DEFAULT_CYCLE_LENGTH, buffer_size=DEFAULT_BUFFER_SIZE, precision="auto", compile=False,
+          memory_format="contiguous", intra_op_threads=None, inter_op_threads=None, profile_steps=0,
+          trace_dir="profiler_traces", depth=None):
+    """
+    Train EEGConformer on a file written by preprocess_data.py.
+
+    Input shape, classes and sampling rate come from the file metadata; a
+    random valid_fraction of the rows is held out for validation. The model
+    state and everything needed to rebuild it are saved to output_path.
+
+    Args:
+        precision (str): "bf16" autocast, "fp32", or "auto" (bf16 where the hardware supports it)
+        compile (bool): Run the model through torch.compile
+        memory_format (str): "contiguous" or "channels_last" for the model's 4D conv weights
+        intra_op_threads, inter_op_threads (int): torch thread pool sizes (default: torch's)
+        profile_steps (int): Record this many steps of the first epoch with the torch
+            profiler, write the trace to trace_dir and print per-module times
+        depth (int): Transformer layers (default: braindecode's)
+
+    Returns:
+        list: Per-epoch train and validation metrics
+    """
+    intra_op, inter_op = configure_threads(intra_op_threads, inter_op_threads)
+    torch.manual_seed(seed)
+    device = torch.device(device or ("cuda" if torch.cuda.is_available() else "cpu"))
+    amp_dtype = autocast_dtype(precision, device)
+    summary = read_summary(data_path)
+    classes = np.asarray(sorted(summary['label_counts']))
+    train_rows, valid_rows = split_rows(summary['n_samples'], valid_fraction, seed)
+    print(f"{data_path}: {summary['n_samples']} samples of {summary['n_channels']} x {summary['n_times']}, "
+          f"{len(classes)} classes {summary['label_counts']}")
+    print(f"Training on {device} with {intra_op} intra-op / {inter_op} inter-op threads, "
+          f"{'bf16 autocast' if amp_dtype is not None else 'fp32'}, {memory_format}"
+          f"{', compiled' if compile else ''}, {num_workers} loader workers")
+
+    train_set = ParquetEEGDataset(data_path, batch_size, train_rows, classes, shuffle=True, seed=seed,
+                                  summary=summary, cycle_length=cycle_length, buffer_size=buffer_size)
+    valid_set = ParquetEEGDataset(data_path, batch_size, valid_rows, classes, summary=summary)
+    train_loader = make_loader(train_set, device, num_workers, prefetch_factor)
+    valid_loader = make_loader(valid_set, device, num_workers, prefetch_factor)
+
+    model = build_model(summary, len(classes), depth).to(device, memory_format=MEMORY_FORMATS[memory_format])
+    optimizer = torch.optim.AdamW(model.parameters(), lr=lr, weight_decay=weight_decay)
+    criterion = torch.nn.CrossEntropyLoss()
+    # Profiling labels go on before compiling so they are part of the traced graph
+    hooks = label_modules(model) if profile_steps else []
+    step_model = torch.compile(model) if compile else model
+
+    history = []
+    for epoch in range(max_epochs):
+        train_set.set_epoch(epoch)
+        profiler = make_profiler(trace_dir, profile_steps, device) if profile_steps and epoch == 0 else None
+        with profiler if profiler is not None else nullcontext():
+            metrics = train_epoch(step_model, train_loader, optimizer, criterion, device, amp_dtype, profiler)
+        if profiler is not None:
+            print_profile(profiler)
+            print(f"Profiler trace written to {trace_dir}")
+            for handle in hooks:
+                handle.remove()
+        valid = (evaluate(step_model, valid_loader, criterion, device, amp_dtype)
+                 if valid_set.n_samples else None)
+        history.append({'epoch': epoch + 1, 'train': metrics, 'valid': valid})
+        line = (f"epoch {epoch + 1:3d}  train loss {metrics['loss']:.4f} acc {metrics['accuracy']:.3f}  "
+                f"{metrics['samples_per_s']:.0f} samples/s, step {metrics['step_ms']:.1f} ms "
+                f"(median {metrics['step_ms_median']:.1f}), {metrics['data_wait']:.0%} waiting for data")
+        if valid is not None:
+            line += f"  valid loss {valid['loss']:.4f} acc {valid['accuracy']:.3f}"
+        print(line)
+
+    torch.save({
+        'model_state': model.state_dict(),
+        'n_chans': summary['n_channels'],
+        'n_times': summary['n_times'],
+        'depth': depth,
+        'classes': classes.tolist(),
+        'attrs': summary['attrs'],
+        'seed': seed,
+        'valid_fraction': valid_fraction,
+        'history': history,
+    }, output_path)
+    print(f"Model saved to {output_path}")
+    return history
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train EEGConformer on preprocessed parquet data")
+    parser.add_argument("data", help="Parquet file written by preprocessing/preprocess_data.py")
+    parser.add_argument("--output", default="eeg_conformer.pt")
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--lr", type=float, default=0.001)
+    parser.add_argument("--weight-decay", type=float, default=0.01)
+    parser.add_argument("--valid-fraction", type=float, default=0.2)
+    parser.add_argument("--workers", type=int, default=4, help="DataLoader worker processes")
+    parser.add_argument("--prefetch", type=int, default=4, help="Batches each worker keeps ready")
+    parser.add_argument("--cycle-length", type=int, default=DEFAULT_CYCLE_LENGTH,
+                        help="Row groups each worker interleaves when shuffling")
+    parser.add_argument("--buffer-size", type=int, default=DEFAULT_BUFFER_SIZE,
+                        help="Rows mixed before shuffled batches are cut")
+    parser.add_argument("--depth", type=int, default=None, help="Transformer layers (default: braindecode's)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--device", default=None, help="Default: cuda if available, else cpu")
+    parser.add_argument("--precision", choices=PRECISIONS, default="auto",
+                        help="bf16 autocast, fp32, or bf16 only where the hardware supports it")
+    parser.add_argument("--compile", action="store_true", help="Compile the model with torch.compile")
+    parser.add_argument("--memory-format", choices=sorted(MEMORY_FORMATS), default="contiguous")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Intra-op threads (default: torch's; leave cores free for loader workers)")
+    parser.add_argument("--interop-threads", type=int, default=None, help="Inter-op threads")
+    parser.add_argument("--profile-steps", type=int, default=0,
+                        help="Profile this many training steps of the first epoch")
+    parser.add_argument("--trace-dir", default="profiler_traces", help="Where to write the profiler trace")
+    parser.add_argument("--history", default=None, help="Also write per-epoch metrics to this JSON file")
+    args = parser.parse_args()
 
-from skorch.dataset import ValidSplit
-from braindecode import EEGClassifier
-
-N_CHANNELS = 4
-N_OUTPUTS = 5
-N_TIMES = 1024
-
-
-# Create sample data
-info = mne.create_info(ch_names=["C3", "C4", "C5", "Cz"], sfreq=256.0, ch_types="eeg")
-X = np.random.randn(
-    100, N_CHANNELS, N_TIMES
-)  # 100 epochs, 4 channels, 4 seconds (@256Hz)
-epochs = mne.EpochsArray(X, info=info)
-y = np.random.randint(0, N_OUTPUTS, size=100)  # 5 classes
-
-# Initialize model with hyperparameters
-model = EEGClassifier(
-    module=EEGConformer,
-    module__n_chans=N_CHANNELS,
-    module__n_outputs=N_OUTPUTS,
-    module__n_times=N_TIMES,
-    module__final_fc_length="auto",
-    # Training hyperparameters
-    max_epochs=30,
-    batch_size=32,
-    optimizer=torch.optim.AdamW,
-    optimizer__lr=0.001,
-    optimizer__weight_decay=0.01,
-    # Use 20% of training data as validation set
-    train_split=ValidSplit(0.2),
-    # Enable GPU if available
-    device="cuda" if torch.cuda.is_available() else "cpu",
-    # Progress tracking
-    iterator_train__shuffle=True,
-    verbose=1,
-)
-model.fit(epochs, y)
\ No newline at end of file
+    on_cpu = args.device == "cpu" or (args.device is None and not torch.cuda.is_available())
+    if on_cpu and args.threads is None and torch.get_num_threads() > args.workers > 0:
+        print(f"Note: {args.workers} loader workers share the CPU with {torch.get_num_threads()} training "
+              f"threads; consider --threads {torch.get_num_threads() - args.workers}")
+    history = train(args.data, args.output, args.epochs, args.batch_size, args.lr, args.weight_decay,
+                    args.valid_fraction, args.workers, args.prefetch, args.seed, args.device,
+                    args.cycle_length, args.buffer_size, precision=args.precision, compile=args.compile,
+                    memory_format=args.memory_format, intra_op_threads=args.threads,
+                    inter_op_threads=args.interop_threads, profile_steps=args.profile_steps,
+                    trace_dir=args.trace_dir, depth=args.depth)
+    if args.history:
+        with open(args.history, "w") as f:
+            json.dump(history, f, indent=2)
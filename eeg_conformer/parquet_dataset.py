@@ -0,0 +1,215 @@
+# Lazy, batched reading of preprocessed parquet files for PyTorch training
+import os
+import sys
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'preprocessing'))
+from dtype_policy import resolve_dtype
+from tensor_parquet import TENSOR_COLUMN, from_tensor_table, is_tensor_table, tensor_metadata
+
+try:
+    import torch
+    from torch.utils.data import IterableDataset, get_worker_info
+except ImportError:  # torch is only needed for ParquetEEGDataset
+    torch = None
+    IterableDataset = object
+    get_worker_info = lambda: None
+
+# Rows decoded per read from one row group
+DEFAULT_BLOCK_SIZE = 64
+# Row groups read at the same time (by each worker) when shuffling
+DEFAULT_CYCLE_LENGTH = 16
+# Rows mixed before shuffled batches are cut
+DEFAULT_BUFFER_SIZE = 2048
+
+
+def read_summary(path):
+    """
+    Shape, dtype, attributes, label counts and row groups of a preprocessed
+    parquet file, without reading any EEG data.
+
+    Label counts come from the row group statistics when every row group holds
+    a single label (as written by preprocess_data.py); otherwise only the label
+    column is read.
+
+    Returns:
+        dict: n_samples, n_channels, n_times, dtype, attrs, label_counts
+        ({label: count}) and row_groups ([(first row, rows)])
+    """
+    pf = pq.ParquetFile(path)
+    if not is_tensor_table(pf.schema_arrow):
+        raise ValueError(f"{path} is not a preprocessed tensor-column parquet file (see preprocess_data.py)")
+    meta = tensor_metadata(pf.schema_arrow)
+    label_column = pf.metadata.schema.names.index('label')
+
+    label_counts = {}
+    row_groups = []
+    start = 0
+    for i in range(pf.num_row_groups):
+        group = pf.metadata.row_group(i)
+        stats = group.column(label_column).statistics
+        if stats is not None and stats.has_min_max and stats.min == stats.max:
+            label_counts[stats.min] = label_counts.get(stats.min, 0) + group.num_rows
+        else:
+            labels, counts = np.unique(pf.read_row_group(i, columns=['label']).column('label').to_numpy(),
+                                       return_counts=True)
+            for label, count in zip(labels.tolist(), counts.tolist()):
+                label_counts[label] = label_counts.get(label, 0) + count
+        row_groups.append((start, group.num_rows))
+        start += group.num_rows
+
+    n_channels, n_times = meta['shape']
+    return {
+        'n_samples': pf.metadata.num_rows,
+        'n_channels': n_channels,
+        'n_times': n_times,
+        'dtype': meta['dtype'],
+        'attrs': meta['attrs'],
+        'label_counts': dict(sorted(label_counts.items())),
+        'row_groups': row_groups,
+    }
+
+
+def split_rows(n_samples, valid_fraction=0.2, seed=0):
+    """
+    Random train/validation split of the rows of a file.
+
+    Returns:
+        tuple: (train mask, validation mask), boolean arrays of shape (n_samples,)
+    """
+    valid = np.random.default_rng(seed).random(n_samples) < valid_fraction
+    return ~valid, valid
+
+
+def iter_parquet_batches(path, summary, batch_size, rows=None, classes=None, shuffle=False, seed=0,
+                         worker=0, n_workers=1, dtype=None, block_size=DEFAULT_BLOCK_SIZE,
+                         cycle_length=DEFAULT_CYCLE_LENGTH, buffer_size=DEFAULT_BUFFER_SIZE):
+    """
+    Yield (data, class index) numpy batches of one worker's share of a file.
+
+    Row groups are dealt out to workers round-robin and read block_size rows
+    at a time, so memory does not depend on the row group size. When shuffling,
+    the row group order is permuted with seed, cycle_length groups are read
+    at once, blocks are drawn from them at random and mixed in a buffer of
+    buffer_size rows before being cut into batches; label-sorted files
+    therefore still give batches with many classes. Without shuffling, rows
+    come in file order.
+
+    Args:
+        summary (dict): read_summary(path)
+        rows (np.ndarray): Boolean mask of the rows to use (default: all)
+        classes (np.ndarray): Sorted labels; labels are returned as indices into it
+        worker, n_workers (int): This worker and the number of workers sharing the file
+    """
+    dtype = resolve_dtype(dtype)
+    classes = np.asarray(sorted(summary['label_counts']) if classes is None else classes)
+    rng = np.random.default_rng(seed)
+    groups = [i for i, (start, n) in enumerate(summary['row_groups'])
+              if rows is None or rows[start:start + n].any()]
+    if shuffle:
+        groups = [groups[i] for i in rng.permutation(len(groups))]
+    groups = groups[worker::n_workers]
+    pf = pq.ParquetFile(path, buffer_size=1 << 20)
+
+    def blocks(group):
+        offset = summary['row_groups'][group][0]
+        for batch in pf.iter_batches(batch_size=block_size, row_groups=[group], columns=['label', TENSOR_COLUMN]):
+            table = pa.Table.from_batches([batch]).replace_schema_metadata(pf.schema_arrow.metadata)
+            data, labels = from_tensor_table(table)
+            if rows is not None:
+                keep = rows[offset:offset + len(labels)]
+                data, labels = data[keep], labels[keep]
+            offset += batch.num_rows
+            yield data, labels
+
+    pending = iter(groups)
+    readers = [blocks(group) for group in (next(pending, None) for _ in range(cycle_length if shuffle else 1))
+               if group is not None]
+    buffer = []
+    n_buffered = 0
+    while readers:
+        i = rng.integers(len(readers)) if shuffle else 0
+        try:
+            data, labels = next(readers[i])
+        except StopIteration:
+            group = next(pending, None)
+            if group is None:
+                readers.pop(i)
+            else:
+                readers[i] = blocks(group)
+            continue
+        buffer.append((data, labels))
+        n_buffered += len(labels)
+        if n_buffered >= (buffer_size if shuffle else batch_size):
+            data, labels, buffer, n_buffered = _cut_batches(buffer, batch_size, shuffle, rng)
+            yield from _batches(data, labels, batch_size, classes, dtype)
+    if n_buffered:
+        data, labels, _, _ = _cut_batches(buffer, 1, shuffle, rng)
+        yield from _batches(data, labels, batch_size, classes, dtype)
+
+
+def _batches(data, labels, batch_size, classes, dtype):
+    for start in range(0, len(labels), batch_size):
+        yield (np.asarray(data[start:start + batch_size], dtype=dtype),
+               np.searchsorted(classes, labels[start:start + batch_size]))
+
+
+def _cut_batches(buffer, batch_size, shuffle, rng):
+    """Split buffered blocks into full batches (shuffled if asked) and the leftover rows."""
+    data = np.concatenate([d for d, _ in buffer])
+    labels = np.concatenate([l for _, l in buffer])
+    if shuffle:
+        order = rng.permutation(len(labels))
+        data, labels = data[order], labels[order]
+    n_full = len(labels) - len(labels) % batch_size
+    leftover = [(data[n_full:], labels[n_full:])] if n_full < len(labels) else []
+    return data[:n_full], labels[:n_full], leftover, len(labels) - n_full
+
+
+class ParquetEEGDataset(IterableDataset):
+    """
+    PyTorch IterableDataset of (data, class index) batches read lazily from a
+    parquet file written by preprocess_data.py.
+
+    Each item is a whole batch, so use DataLoader(dataset, batch_size=None).
+    DataLoader workers each read their own row groups (see
+    iter_parquet_batches); nothing is loaded up front besides the file
+    metadata. Call set_epoch() before every epoch to reshuffle.
+    """
+
+    def __init__(self, path, batch_size=64, rows=None, classes=None, shuffle=False, seed=0, dtype=None,
+                 summary=None, block_size=DEFAULT_BLOCK_SIZE, cycle_length=DEFAULT_CYCLE_LENGTH,
+                 buffer_size=DEFAULT_BUFFER_SIZE):
+        if torch is None:
+            raise ImportError("ParquetEEGDataset requires torch")
+        self.path = path
+        self.summary = read_summary(path) if summary is None else summary
+        self.batch_size = batch_size
+        self.rows = rows
+        self.classes = np.asarray(sorted(self.summary['label_counts']) if classes is None else classes)
+        self.shuffle = shuffle
+        self.seed = seed
+        self.dtype = resolve_dtype(dtype)
+        self.block_size = block_size
+        self.cycle_length = cycle_length
+        self.buffer_size = buffer_size
+        self.epoch = 0
+
+    @property
+    def n_samples(self):
+        return self.summary['n_samples'] if self.rows is None else int(np.count_nonzero(self.rows))
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        info = get_worker_info()
+        worker, n_workers = (0, 1) if info is None else (info.id, info.num_workers)
+        batches = iter_parquet_batches(self.path, self.summary, self.batch_size, self.rows, self.classes,
+                                       self.shuffle, self.seed + self.epoch, worker, n_workers, self.dtype,
+                                       self.block_size, self.cycle_length, self.buffer_size)
+        for data, labels in batches:
+            yield torch.from_numpy(data), torch.from_numpy(labels)
@@ -0,0 +1,272 @@
+# Parallel hyperparameter sweep for EEGConformer with median pruning and a JSONL results file
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+# Shared modules from the repository's preprocessing directory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'preprocessing'))
+from main import PRECISIONS, autocast_dtype, build_model, evaluate, train_epoch
+from parquet_dataset import read_summary, split_rows
+from artifact_cache import make_key
+from checkpoint import source_fingerprint
+from tensor_store import EEGTensorDataset, is_store, parquet_to_store
+
+# Hyperparameters a trial can set, with the CLI defaults
+SEARCH_SPACE = {
+    'lr': [1e-3, 3e-4],
+    'weight_decay': [0.01, 0.1],
+    'batch_size': [32, 64],
+    'depth': [2, 4, 6],
+}
+
+
+def shared_store(data_path, sweep_dir):
+    """
+    Memory-mapped TensorStore copy of a parquet file, converted once per
+    input version and shared read-only by every trial process (the OS keeps
+    one copy of its pages for all of them).
+    """
+    store_dir = os.path.join(sweep_dir, "data_" + make_key(source=source_fingerprint(data_path))[:16])
+    if not is_store(store_dir):
+        partial = store_dir + ".partial"
+        shutil.rmtree(partial, ignore_errors=True)
+        parquet_to_store(data_path, partial)
+        os.replace(partial, store_dir)
+    return store_dir
+
+
+def trial_grid(space, n_trials=None, seed=0):
+    """All combinations of the search space, or a random sample of n_trials of them."""
+    names = sorted(space)
+    grid = [dict(zip(names, values)) for values in itertools.product(*(space[n] for n in names))]
+    if n_trials is not None and n_trials < len(grid):
+        keep = np.random.default_rng(seed).choice(len(grid), n_trials, replace=False)
+        grid = [grid[i] for i in sorted(keep)]
+    return grid
+
+
+def sweep_settings_key(data_path, max_epochs, seed, valid_fraction, precision):
+    """Key of everything besides the hyperparameters that changes what a trial computes."""
+    return make_key(source=source_fingerprint(data_path), max_epochs=max_epochs, seed=seed,
+                    valid_fraction=valid_fraction, precision=precision)
+
+
+def trial_id(params, settings_key):
+    return make_key(params=params, settings=settings_key)[:12]
+
+
+def rank_results(records):
+    """Trial records, best validation accuracy first and failed trials (no accuracy) last."""
+    return sorted(records, key=lambda r: (r['best_valid_accuracy'] is None,
+                                          -r['best_valid_accuracy'] if r['best_valid_accuracy'] is not None else 0))
+
+
+def should_prune(curves, trial, epoch, warmup_epochs=2, min_trials=4):
+    """
+    Median pruning: after warmup_epochs, stop a trial whose best validation
+    accuracy so far is below the median of the other trials' best accuracy
+    after the same number of epochs.
+
+    Args:
+        curves (Mapping): trial id -> validation accuracy per epoch, for all trials
+        epoch (int): Epochs the trial has completed
+    """
+    if epoch < warmup_epochs:
+        return False
+    others = [max(curve[:epoch]) for other, curve in curves.items() if other != trial and len(curve) >= epoch]
+    if len(others) < min_trials:
+        return False
+    return max(curves[trial][:epoch]) < np.median(others)
+
+
+def _collate(batch, classes):
+    x = torch.stack([sample for sample, _ in batch])
+    y = torch.from_numpy(np.searchsorted(classes, [label for _, label in batch]))
+    return x, y
+
+
+def _init_trial_worker(threads):
+    """Process pool initializer: give each trial its own small share of the cores."""
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+
+
+def run_trial(params, settings_key, store_dir, summary, train_idx, valid_idx, classes, max_epochs, curves, seed=0,
+              precision="auto", warmup_epochs=2, min_trials=4):
+    """
+    Train one configuration, reporting validation accuracy to the shared
+    curves after every epoch and stopping early when should_prune says so.
+
+    Returns:
+        dict: Trial record for the results file
+    """
+    tid = trial_id(params, settings_key)
+    torch.manual_seed(seed)
+    device = torch.device("cpu")
+    amp_dtype = autocast_dtype(precision, device)
+    collate = lambda batch: _collate(batch, classes)
+    train_loader = DataLoader(EEGTensorDataset(store_dir, train_idx), batch_size=params['batch_size'],
+                              shuffle=True, collate_fn=collate)
+    valid_loader = DataLoader(EEGTensorDataset(store_dir, valid_idx), batch_size=256, collate_fn=collate)
+
+    model = build_model(summary, len(classes), params['depth']).to(device)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=params['lr'], weight_decay=params['weight_decay'])
+    criterion = torch.nn.CrossEntropyLoss()
+
+    start = time.perf_counter()
+    history = []
+    status = 'complete'
+    for epoch in range(1, max_epochs + 1):
+        metrics = train_epoch(model, train_loader, optimizer, criterion, device, amp_dtype)
+        valid = evaluate(model, valid_loader, criterion, device, amp_dtype)
+        history.append({'epoch': epoch, 'train_loss': metrics['loss'], 'samples_per_s': metrics['samples_per_s'],
+                        'valid_loss': valid['loss'], 'valid_accuracy': valid['accuracy']})
+        # Reassign so the manager propagates the change to the other processes
+        curves[tid] = [h['valid_accuracy'] for h in history]
+        if epoch < max_epochs and should_prune(curves, tid, epoch, warmup_epochs, min_trials):
+            status = 'pruned'
+            break
+
+    accuracies = [h['valid_accuracy'] for h in history]
+    best = int(np.argmax(accuracies))
+    return {
+        'trial': tid,
+        'settings': settings_key,
+        'params': params,
+        'status': status,
+        'epochs': len(history),
+        'best_valid_accuracy': accuracies[best],
+        'best_epoch': best + 1,
+        'seconds': time.perf_counter() - start,
+        'history': history,
+    }
+
+
+def read_results(path):
+    """Trial records already in a results file, by trial id."""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return {r['trial']: r for r in records}
+
+
+def sweep(data_path, space=SEARCH_SPACE, sweep_dir="sweeps", results_file=None, n_trials=None, parallel=None,
+          threads_per_trial=None, max_epochs=20, valid_fraction=0.2, seed=0, precision="auto",
+          warmup_epochs=2, min_trials=4):
+    """
+    Run a grid (or random sample) of EEGConformer configurations in parallel.
+
+    Trials run in a process pool of `parallel` processes, each limited to
+    threads_per_trial torch threads, since several small trials use a
+    multi-core node better than one trial with many threads. All trials
+    read the same memory-mapped copy of the data and the same train/validation
+    split. Every finished trial is appended to results_file (JSON lines);
+    trials already there (unless they failed) are skipped, so an
+    interrupted sweep resumes. Records only count when they were made from
+    the same data, epochs, seed, split and precision; others are ignored,
+    also for pruning.
+
+    Returns:
+        list: All trial records, best validation accuracy first
+    """
+    os.makedirs(sweep_dir, exist_ok=True)
+    results_file = results_file or os.path.join(sweep_dir, "results.jsonl")
+    n_cores = os.cpu_count() or 1
+    parallel = parallel or max(1, n_cores // (threads_per_trial or 2))
+    threads_per_trial = threads_per_trial or max(1, n_cores // parallel)
+
+    summary = read_summary(data_path)
+    classes = np.asarray(sorted(summary['label_counts']))
+    train_rows, valid_rows = split_rows(summary['n_samples'], valid_fraction, seed)
+    store_dir = shared_store(data_path, sweep_dir)
+
+    settings_key = sweep_settings_key(data_path, max_epochs, seed, valid_fraction, precision)
+    done = {tid: r for tid, r in read_results(results_file).items() if r.get('settings') == settings_key}
+    grid = [params for params in trial_grid(space, n_trials, seed)
+            if done.get(trial_id(params, settings_key), {}).get('status', 'failed') == 'failed']
+    print(f"{len(grid)} trials to run ({len(done)} already in {results_file}), {parallel} at a time "
+          f"with {threads_per_trial} threads each")
+
+    start = time.perf_counter()
+    trial_seconds = 0.0
+    with multiprocessing.get_context("spawn").Manager() as manager:
+        curves = manager.dict({tid: [h['valid_accuracy'] for h in r['history']] for tid, r in done.items()})
+        with ProcessPoolExecutor(max_workers=parallel, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_trial_worker, initargs=(threads_per_trial,)) as pool:
+            futures = {pool.submit(run_trial, params, settings_key, store_dir, summary, np.flatnonzero(train_rows),
+                                   np.flatnonzero(valid_rows), classes, max_epochs, curves, seed, precision,
+                                   warmup_epochs, min_trials): params for params in grid}
+            for future in as_completed(futures):
+                try:
+                    record = future.result()
+                except Exception as e:
+                    params = futures[future]
+                    print(f"Trial {params} failed with error: {e}")
+                    record = {'trial': trial_id(params, settings_key), 'settings': settings_key, 'params': params,
+                              'status': 'failed', 'error': repr(e), 'epochs': 0, 'best_valid_accuracy': None,
+                              'history': []}
+                with open(results_file, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+                done[record['trial']] = record
+                trial_seconds += record.get('seconds', 0.0)
+                if record['status'] != 'failed':
+                    print(f"[{len(done)}] {record['status']:<8} {record['params']}  best valid acc "
+                          f"{record['best_valid_accuracy']:.3f} after {record['epochs']} epochs "
+                          f"({record['seconds']:.0f} s)")
+
+    wall = time.perf_counter() - start
+    if grid:
+        print(f"Sweep took {wall:.0f} s for {trial_seconds:.0f} s of trial time "
+              f"({trial_seconds / wall if wall > 0 else 0:.1f}x sequential)")
+    return rank_results(done.values())
+
+
+def format_results(records, top=10):
+    header = f"{'trial':<12} {'status':<9} {'lr':>8} {'wd':>6} {'batch':>6} {'depth':>6} {'epochs':>7} {'acc':>7}"
+    lines = [header, "-" * len(header)]
+    for r in records[:top]:
+        p = r['params']
+        acc = f"{r['best_valid_accuracy']:.3f}" if r['best_valid_accuracy'] is not None else "-"
+        lines.append(f"{r['trial']:<12} {r['status']:<9} {p['lr']:>8.0e} {p['weight_decay']:>6g} "
+                     f"{p['batch_size']:>6} {p['depth']:>6} {r['epochs']:>7} {acc:>7}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel EEGConformer hyperparameter sweep")
+    parser.add_argument("data", help="Parquet file written by preprocessing/preprocess_data.py")
+    parser.add_argument("--sweep-dir", default="sweeps", help="Shared data copy and default results location")
+    parser.add_argument("--results", default=None, help="JSONL results file (default: <sweep-dir>/results.jsonl)")
+    parser.add_argument("--lr", type=float, nargs="+", default=SEARCH_SPACE['lr'])
+    parser.add_argument("--weight-decay", type=float, nargs="+", default=SEARCH_SPACE['weight_decay'])
+    parser.add_argument("--batch-size", type=int, nargs="+", default=SEARCH_SPACE['batch_size'])
+    parser.add_argument("--depth", type=int, nargs="+", default=SEARCH_SPACE['depth'])
+    parser.add_argument("--trials", type=int, default=None, help="Random sample of the grid (default: all of it)")
+    parser.add_argument("--parallel", type=int, default=None, help="Concurrent trials (default: cores / threads)")
+    parser.add_argument("--threads", type=int, default=None, help="Torch threads per trial")
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--valid-fraction", type=float, default=0.2)
+    parser.add_argument("--warmup-epochs", type=int, default=2, help="Epochs before a trial can be pruned")
+    parser.add_argument("--min-trials", type=int, default=4, help="Trials to compare against before pruning")
+    parser.add_argument("--precision", choices=PRECISIONS, default="auto")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    space = {'lr': args.lr, 'weight_decay': args.weight_decay, 'batch_size': args.batch_size, 'depth': args.depth}
+    records = sweep(args.data, space, args.sweep_dir, args.results, args.trials, args.parallel, args.threads,
+                    args.epochs, args.valid_fraction, args.seed, args.precision, args.warmup_epochs,
+                    args.min_trials)
+    print(format_results(records))
@@ -0,0 +1,194 @@
+# Content-addressed on-disk cache for pipeline artifacts
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+MANIFEST_NAME = "manifest.json"
+FINGERPRINTS_NAME = "fingerprints.json"
+
+
+def make_key(**parts):
+    """
+    Build a cache key from JSON-serializable parts (fingerprints, parameters).
+
+    Returns:
+        str: Hex digest that changes whenever any part changes
+    """
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def copy_file(src, dst):
+    """
+    Copy a cached file to dst (replacing dst) through a temporary file.
+
+    Cached files are copied, never hard-linked: a later in-place write to dst
+    (np.memmap, open(..., "r+b")) would otherwise rewrite the cache entry too.
+    """
+    tmp = f"{dst}.tmp-{uuid.uuid4().hex}"
+    try:
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _write_json(path, obj):
+    """Write JSON through a temporary file, so a crash never leaves a truncated file at path."""
+    tmp = f"{path}.tmp-{uuid.uuid4().hex}"
+    try:
+        with open(tmp, "w") as f:
+            json.dump(obj, f, indent=2)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _read_memo(path):
+    """Fingerprint memo at path; a missing or unreadable memo is empty and gets rebuilt."""
+    try:
+        with open(path) as f:
+            memo = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return memo if isinstance(memo, dict) else {}
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+class ArtifactCache:
+    """
+    Directory of cached artifacts, one sub-directory per key.
+
+    Each entry holds whatever files the producer wrote plus a manifest.json
+    describing how it was built. Entries are published with an atomic rename,
+    so a crashed run never leaves a half-written entry behind. When the total
+    size exceeds max_bytes, the least recently used entries are evicted.
+    """
+
+    def __init__(self, root=".cache", max_bytes=20 * 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def entry_dir(self, key):
+        return os.path.join(self.root, key)
+
+    def file_fingerprint(self, path, block_size=16 * 1024 * 1024):
+        """
+        Content hash of a file, memoized on (path, size, mtime) so unchanged
+        files are only read once.
+        """
+        stat = os.stat(path)
+        memo_path = os.path.join(self.root, FINGERPRINTS_NAME)
+        memo = _read_memo(memo_path)
+
+        memo_key = os.path.abspath(path)
+        entry = memo.get(memo_key)
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry['digest']
+
+        digest = hashlib.blake2b(digest_size=20)
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                digest.update(block)
+        memo[memo_key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'digest': digest.hexdigest()}
+        _write_json(memo_path, memo)
+        return memo[memo_key]['digest']
+
+    def lookup(self, key):
+        """
+        Return the manifest of a cached entry (and mark it as recently used),
+        or None on a miss.
+        """
+        manifest_path = os.path.join(self.entry_dir(key), MANIFEST_NAME)
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        manifest['last_used'] = time.time()
+        _write_json(manifest_path, manifest)
+        return manifest
+
+    def staging_dir(self):
+        """Fresh directory for a producer to write a new entry into."""
+        path = os.path.join(self.root, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(path)
+        return path
+
+    def commit(self, key, staging_dir, info=None):
+        """
+        Publish a staging directory as the entry for key and evict old entries.
+
+        Args:
+            key (str): Cache key from make_key
+            staging_dir (str): Directory returned by staging_dir()
+            info (dict): Extra JSON-serializable fields for the manifest
+
+        Returns:
+            dict: The manifest written for the entry
+        """
+        now = time.time()
+        manifest = dict(info or {})
+        manifest.update({
+            'key': key,
+            'created': now,
+            'last_used': now,
+            'size_bytes': _dir_size(staging_dir),
+        })
+        with open(os.path.join(staging_dir, MANIFEST_NAME), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+        target = self.entry_dir(key)
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        os.rename(staging_dir, target)
+        self.evict(keep=key)
+        return manifest
+
+    def discard(self, staging_dir):
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def entries(self):
+        """Manifests of all committed entries."""
+        manifests = []
+        for name in os.listdir(self.root):
+            manifest_path = os.path.join(self.root, name, MANIFEST_NAME)
+            if name.startswith(".") or not os.path.exists(manifest_path):
+                continue
+            with open(manifest_path) as f:
+                manifests.append(json.load(f))
+        return manifests
+
+    def evict(self, keep=None):
+        """
+        Delete least recently used entries until the cache fits in max_bytes.
+
+        Returns:
+            list: Keys of the evicted entries
+        """
+        entries = sorted(self.entries(), key=lambda m: m['last_used'])
+        total = sum(m['size_bytes'] for m in entries)
+        evicted = []
+        for manifest in entries:
+            if total <= self.max_bytes:
+                break
+            if manifest['key'] == keep:
+                continue
+            shutil.rmtree(self.entry_dir(manifest['key']), ignore_errors=True)
+            total -= manifest['size_bytes']
+            evicted.append(manifest['key'])
+        if evicted:
+            print(f"Evicted {len(evicted)} cached artifacts to stay under {self.max_bytes / 1024 ** 3:.1f} GB")
+        return evicted
@@ -0,0 +1,203 @@
+# Cheap vectorized screening that decides which epochs need an ICA fit at all
+import argparse
+import json
+import time
+
+import numpy as np
+
+from numpy_ica import EOG_BAND, ica_clean_batch
+
+FEATURES = ('peak', 'variance', 'low_power')
+
+
+def ica_can_remove(n_components, threshold):
+    """
+    Whether EOG scoring can flag any component at all.
+
+    find_bads_eog z-scores the n_components correlation scores with their
+    population std, and no value of n numbers lies more than sqrt(n - 1)
+    standard deviations from their mean (Samuelson's inequality). Below
+    that threshold nothing is ever removed, whatever the data.
+    """
+    return threshold < np.sqrt(max(n_components - 1, 0))
+
+
+def screening_features(data, sampling_rate, eog_picks, band=EOG_BAND):
+    """
+    Frontal-channel features of every epoch, in one vectorized pass.
+
+    Args:
+        data (np.ndarray): (N, C, T) band-passed epochs
+        eog_picks (list): Indices of the frontal (FP1/FP2) channels
+        band (tuple): Low-frequency band in Hz where blinks and eye movements live
+
+    Returns:
+        dict: 'peak' (largest absolute deviation from the mean), 'variance' and
+        'low_power' (mean power in band), each (N,) and the maximum over the
+        frontal channels
+    """
+    x = np.asarray(data[:, eog_picks], dtype=np.float64)
+    x = x - x.mean(axis=-1, keepdims=True)
+    n_times = x.shape[-1]
+    spectrum = np.fft.rfft(x, axis=-1)
+    freqs = np.fft.rfftfreq(n_times, 1.0 / sampling_rate)
+    in_band = (freqs >= band[0]) & (freqs <= band[1])
+    # Parseval: mean square of the band-limited signal (one-sided spectrum, so doubled)
+    low_power = 2 * (np.abs(spectrum[..., in_band]) ** 2).sum(axis=-1) / n_times ** 2
+    return {
+        'peak': np.abs(x).max(axis=-1).max(axis=-1),
+        'variance': x.var(axis=-1).max(axis=-1),
+        'low_power': low_power.max(axis=-1),
+    }
+
+
+def screen_epochs(data, sampling_rate, eog_picks, n_components=3, threshold=3.0, thresholds=None):
+    """
+    Decide which epochs go through ICA.
+
+    With settings where ICA cannot remove anything (see ica_can_remove) no
+    epoch needs it. Otherwise, with feature thresholds, only epochs where at
+    least one frontal feature reaches its threshold need it; without them,
+    every epoch does.
+
+    Args:
+        thresholds (dict): Optional minimum 'peak', 'variance' and/or 'low_power'
+
+    Returns:
+        np.ndarray: (N,) bool mask of epochs that need ICA
+    """
+    if not ica_can_remove(n_components, threshold):
+        return np.zeros(len(data), dtype=bool)
+    if not thresholds:
+        return np.ones(len(data), dtype=bool)
+    unknown = sorted(set(thresholds) - set(FEATURES))
+    if unknown:
+        raise ValueError(f"Unknown screening features {unknown}; expected {FEATURES}")
+    features = screening_features(data, sampling_rate, eog_picks)
+    needs = np.zeros(len(data), dtype=bool)
+    for name, limit in thresholds.items():
+        needs |= features[name] >= limit
+    return needs
+
+
+def clean_screened(clean, data, needs_ica):
+    """
+    Run clean(indices) -> (cleaned epochs, removed counts) on the epochs that
+    need ICA; the others are returned unchanged with nothing removed, exactly
+    as ICA returns epochs without EOG components.
+
+    Returns:
+        tuple: (cleaned data, per-epoch number of removed components)
+    """
+    cleaned = np.array(data, copy=True)
+    n_removed = np.zeros(len(data), dtype=np.int64)
+    idx = np.flatnonzero(needs_ica)
+    if len(idx):
+        cleaned[idx], n_removed[idx] = clean(idx)
+    return cleaned, n_removed
+
+
+def calibrate_thresholds(features, flagged, margin=0.8):
+    """
+    Thresholds that send every epoch ICA flagged on a validation set to ICA.
+
+    Each threshold is margin times the smallest value of its feature among
+    the flagged epochs.
+
+    Returns:
+        dict: Thresholds per feature, or None when no epoch was flagged
+    """
+    if not np.any(flagged):
+        return None
+    return {name: float(margin * values[flagged].min()) for name, values in features.items()}
+
+
+def validate_screening(data, sampling_rate, eog_picks, n_components=3, lowcut_ica=1.0, random_state=42,
+                       threshold=3.0, thresholds=None, calibrate=False, margin=0.8, chunk_size=512):
+    """
+    Compare screening against full ICA on a validation set.
+
+    Full ICA runs on every epoch to find the epochs it actually cleans. With
+    calibrate, thresholds are derived from those epochs first (so recall on
+    this set is 1 by construction; check it on a held-out set).
+
+    Returns:
+        dict: epochs, epochs cleaned by full ICA, the thresholds used, epochs
+        sent to ICA, skip_rate, missed (cleaned by full ICA but skipped),
+        recall, decision agreement, max abs output difference and the time of
+        both runs
+    """
+    data = np.asarray(data)
+
+    def run_ica(batch):
+        out = np.empty_like(batch)
+        n_removed = np.zeros(len(batch), dtype=np.int64)
+        for start in range(0, len(batch), chunk_size):
+            cleaned, excluded = ica_clean_batch(batch[start:start + chunk_size], sampling_rate, eog_picks,
+                                                n_components, lowcut_ica, random_state, threshold)
+            out[start:start + chunk_size] = cleaned
+            n_removed[start:start + chunk_size] = excluded.sum(axis=1)
+        return out, n_removed
+
+    begin = time.perf_counter()
+    full, full_removed = run_ica(data)
+    full_time = time.perf_counter() - begin
+    flagged = full_removed > 0
+
+    if calibrate and ica_can_remove(n_components, threshold):
+        thresholds = calibrate_thresholds(screening_features(data, sampling_rate, eog_picks), flagged, margin)
+
+    begin = time.perf_counter()
+    needs = screen_epochs(data, sampling_rate, eog_picks, n_components, threshold, thresholds)
+    screened, _ = clean_screened(lambda idx: run_ica(data[idx]), data, needs)
+    screened_time = time.perf_counter() - begin
+
+    missed = flagged & ~needs
+    return {
+        'epochs': len(data),
+        'ica_can_remove': bool(ica_can_remove(n_components, threshold)),
+        'full_ica_cleaned': int(flagged.sum()),
+        'thresholds': thresholds,
+        'sent_to_ica': int(needs.sum()),
+        'skip_rate': float(1 - needs.mean()) if len(data) else 0.0,
+        'missed': int(missed.sum()),
+        'recall': float(1 - missed.sum() / flagged.sum()) if flagged.any() else 1.0,
+        'agreement': float(np.mean(needs == flagged)) if len(data) else 1.0,
+        'max_abs_diff': float(np.abs(screened - full).max()) if len(data) else 0.0,
+        'full_seconds': full_time,
+        'screened_seconds': screened_time,
+        'speedup': full_time / screened_time if screened_time > 0 else float('inf'),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate artifact screening against full ICA")
+    parser.add_argument("input", help="Tensor store directory or parquet file with raw epochs")
+    parser.add_argument("--config", help="JSON pipeline config (default: the training settings)")
+    parser.add_argument("--epochs", type=int, default=1000, help="Validation epochs")
+    parser.add_argument("--threshold", type=float, default=None, help="Override the EOG z-score threshold")
+    parser.add_argument("--peak", type=float, default=None)
+    parser.add_argument("--variance", type=float, default=None)
+    parser.add_argument("--low-power", type=float, default=None)
+    parser.add_argument("--calibrate", action="store_true",
+                        help="Derive thresholds from the epochs full ICA cleans")
+    parser.add_argument("--margin", type=float, default=0.8)
+    args = parser.parse_args()
+
+    from pipeline import PreprocessingPipeline
+    from tensor_store import open_dataset
+
+    overrides = {} if args.threshold is None else {'eog_threshold': args.threshold}
+    pipeline = (PreprocessingPipeline.from_file(args.config, **overrides) if args.config
+                else PreprocessingPipeline(**overrides))
+    c = pipeline.config
+    thresholds = {name: value for name, value in
+                  (('peak', args.peak), ('variance', args.variance), ('low_power', args.low_power))
+                  if value is not None} or c['screen_thresholds']
+
+    dataset, _ = open_dataset(args.input)
+    validation = pipeline.filter(np.asarray(dataset[:args.epochs]))
+    report = validate_screening(validation, c['sampling_rate'], pipeline.eog_picks, c['n_components'],
+                                c['lowcut_ica'], c['random_state'], c['eog_threshold'], thresholds,
+                                args.calibrate, args.margin)
+    print(json.dumps(report, indent=2))
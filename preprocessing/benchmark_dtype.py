@@ -0,0 +1,113 @@
+# Compare memory use and throughput of the preprocessing pipeline in float64 and float32
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmark_storage import load_input
+from run_report import peak_rss_mb, run_child
+
+DTYPES = ["float64", "float32"]
+
+
+def _dtype_trial(dtype, input_path, max_samples, workdir, queue):
+    """Child process: run load, filter, ICA and write in one dtype, report times and peak RSS."""
+    from convert_parquet_to_np import convert_parquet_to_np
+    from pipeline import PreprocessingPipeline
+    from tensor_parquet import write_tensor_parquet
+
+    # Imports dominate the absolute RSS, so growth above this baseline is reported too
+    baseline = peak_rss_mb()
+    timings = {}
+    start = time.perf_counter()
+    dataset, labels = load_input(input_path, max_samples)
+    dataset = dataset.astype(dtype, copy=False)
+    timings['load'] = time.perf_counter() - start
+
+    pipeline = PreprocessingPipeline(dtype=dtype)
+    start = time.perf_counter()
+    filtered = pipeline.filter_dataset(dataset)
+    timings['filter'] = time.perf_counter() - start
+    start = time.perf_counter()
+    cleaned = pipeline.clean_dataset(filtered, n_workers=1)
+    timings['ica'] = time.perf_counter() - start
+
+    output_path = os.path.join(workdir, f"{dtype}.parquet")
+    start = time.perf_counter()
+    write_tensor_parquet(output_path, cleaned, labels, compression='snappy')
+    timings['write'] = time.perf_counter() - start
+    start = time.perf_counter()
+    reread, _ = convert_parquet_to_np(output_path, dtype=dtype)
+    timings['read'] = time.perf_counter() - start
+
+    np.save(os.path.join(workdir, f"{dtype}.npy"), cleaned)
+    queue.put({
+        'dtype': dtype,
+        'samples': len(dataset),
+        'dataset_mb': dataset.nbytes / (1024 * 1024),
+        'file_mb': os.path.getsize(output_path) / (1024 * 1024),
+        'seconds': timings,
+        'samples_per_s': {step: len(dataset) / s if s > 0 else float('inf') for step, s in timings.items()},
+        'peak_rss_mb': peak_rss_mb(),
+        'rss_growth_mb': peak_rss_mb() - baseline,
+        'output_dtypes': sorted({a.dtype.name for a in (dataset, filtered, cleaned, reread)}),
+    })
+    os.remove(output_path)
+
+
+def compare_dtypes(input_path, max_samples=None, dtypes=DTYPES, workdir=None):
+    """
+    Run the training pipeline once per dtype, each in a fresh process.
+
+    Returns:
+        dict: per-dtype results and, when both are run, the largest absolute
+            difference of the float32 output from the float64 output
+    """
+    workdir = workdir or tempfile.mkdtemp(prefix="dtype_bench_")
+    results = [run_child(_dtype_trial, (dtype, input_path, max_samples, workdir)) for dtype in dtypes]
+    report = {'results': results}
+    if {"float64", "float32"} <= set(dtypes):
+        reference = np.load(os.path.join(workdir, "float64.npy"), mmap_mode='r')
+        reduced = np.load(os.path.join(workdir, "float32.npy"), mmap_mode='r')
+        report['max_abs_diff'] = float(np.abs(reference - reduced).max())
+        report['max_abs_value'] = float(np.abs(reference).max())
+    for dtype in dtypes:
+        os.remove(os.path.join(workdir, f"{dtype}.npy"))
+    return report
+
+
+def format_table(results):
+    steps = list(results[0]['seconds'])
+    header = f"{'dtype':<8} {'data MB':>9} {'file MB':>9} {'peak RSS MB':>12} {'RSS growth':>11} " + " ".join(
+        f"{step + ' /s':>12}" for step in steps)
+    lines = [header, "-" * len(header)]
+    for r in results:
+        lines.append(f"{r['dtype']:<8} {r['dataset_mb']:>9.1f} {r['file_mb']:>9.1f} {r['peak_rss_mb']:>12.1f} "
+                     f"{r['rss_growth_mb']:>11.1f} "
+                     + " ".join(f"{r['samples_per_s'][step]:>12.0f}" for step in steps))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory and throughput of the preprocessing pipeline per dtype")
+    parser.add_argument("input", help="Parquet file, tensor store directory, .npy or .pkl dataset")
+    parser.add_argument("--max-samples", type=int, default=2000)
+    parser.add_argument("--dtypes", nargs="+", choices=DTYPES, default=DTYPES)
+    parser.add_argument("--workdir", default=None, help="Where to write trial files (defaults to the temp dir)")
+    parser.add_argument("--json", default=None, help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    report = compare_dtypes(args.input, args.max_samples, args.dtypes, args.workdir)
+    print(format_table(report['results']))
+    for r in report['results']:
+        if r['output_dtypes'] != [r['dtype']]:
+            print(f"WARNING: {r['dtype']} run produced {r['output_dtypes']} arrays")
+    if 'max_abs_diff' in report:
+        print(f"\nfloat32 vs float64 output: max abs diff {report['max_abs_diff']:.3g} "
+              f"(max abs value {report['max_abs_value']:.3g})")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,215 @@
+# Benchmark parquet storage settings for the EEG dataset: size, encode/decode
+# throughput and peak memory across codecs, levels, row groups and layouts.
+#
+# Example:
+#   python benchmark_storage.py --codecs zstd:1,9,22 lz4 snappy --layouts blob delta tensor wide \
+#       --row-group-sizes 1000 10000 --json storage_benchmark.json
+import argparse
+import itertools
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import delta_codec
+import tensor_parquet
+from convert_parquet_to_np import load_binary_blobs
+from convert_pkl_to_parquet import blob_table, load_source, write_parquet
+from run_report import peak_rss_mb, reset_peak_rss, run_child
+
+LAYOUTS = ["blob", "delta", "tensor", "wide"]
+
+
+def wide_table(dataset, labels):
+    """One float column per channel and timestep (the legacy preprocess_data.py layout)."""
+    n_samples, n_channels, n_times = dataset.shape
+    flat = np.asarray(dataset).reshape(n_samples, -1)
+    columns = {'label': pa.array(np.asarray(labels))}
+    for ch_idx in range(n_channels):
+        for ts_idx in range(n_times):
+            columns[f'ch{ch_idx}_ts{ts_idx}'] = pa.array(flat[:, ch_idx * n_times + ts_idx])
+    return pa.table(columns)
+
+
+def encode_table(dataset, labels, layout):
+    if layout == "blob":
+        return blob_table(dataset, labels)
+    if layout == "delta":
+        return delta_codec.to_arrow_table(dataset, labels)
+    if layout == "tensor":
+        return tensor_parquet.to_tensor_table(dataset, labels)
+    if layout == "wide":
+        return wide_table(dataset, labels)
+    raise ValueError(f"Unknown layout: {layout}")
+
+
+def decode_table(table, layout):
+    if layout == "blob":
+        return load_binary_blobs(table)
+    if layout == "delta":
+        return delta_codec.from_arrow_table(table)
+    if layout == "tensor":
+        return tensor_parquet.from_tensor_table(table)
+    dataset, labels, _ = tensor_parquet.from_wide_table(table)
+    return dataset, labels
+
+
+def load_input(path, max_samples=None):
+    if path.endswith(".parquet"):
+        from convert_parquet_to_np import convert_parquet_to_np
+        dataset, labels = convert_parquet_to_np(path)
+    else:
+        dataset, labels, _ = load_source(path)
+    if max_samples:
+        dataset, labels = dataset[:max_samples], labels[:max_samples]
+    return np.ascontiguousarray(dataset), np.asarray(labels)
+
+
+def _encode_trial(config, input_path, max_samples, output_path, queue):
+    """Child process: build and write one file, report time and peak RSS before and after."""
+    dataset, labels = load_input(input_path, max_samples)
+    # Start the high-water mark after the load (Linux), so only encoding raises it
+    reset_peak_rss()
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    table = encode_table(dataset, labels, config['layout'])
+    write_parquet(table, output_path, config['compression'], config['compression_level'],
+                  config['row_group_size'], config['use_dictionary'], config['use_byte_stream_split'])
+    elapsed = time.perf_counter() - start
+    queue.put({'seconds': elapsed, 'raw_bytes': dataset.nbytes,
+               'peak_rss_mb': peak_rss_mb(), 'baseline_rss_mb': baseline})
+
+
+def _decode_trial(config, output_path, queue):
+    """Child process: read one file back to numpy, report time and peak RSS before and after."""
+    reset_peak_rss()
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    table = pq.read_table(output_path)
+    dataset, _ = decode_table(table, config['layout'])
+    elapsed = time.perf_counter() - start
+    queue.put({'seconds': elapsed, 'peak_rss_mb': peak_rss_mb(), 'baseline_rss_mb': baseline,
+               'shape': list(dataset.shape)})
+
+
+def run_trial(config, input_path, max_samples, repeats, workdir):
+    """Encode and decode one configuration, returning a result row."""
+    output_path = os.path.join(workdir, "trial.parquet")
+    encodes = [run_child(_encode_trial, (config, input_path, max_samples, output_path))
+               for _ in range(repeats)]
+    size = os.path.getsize(output_path)
+    decodes = [run_child(_decode_trial, (config, output_path)) for _ in range(repeats)]
+    os.remove(output_path)
+
+    raw_mb = encodes[0]['raw_bytes'] / (1024 * 1024)
+    encode_s = statistics.median(r['seconds'] for r in encodes)
+    decode_s = statistics.median(r['seconds'] for r in decodes)
+    return dict(config, **{
+        'size_mb': size / (1024 * 1024),
+        'ratio': encodes[0]['raw_bytes'] / size,
+        'encode_mb_s': raw_mb / encode_s,
+        'decode_mb_s': raw_mb / decode_s,
+        # Memory the step itself added over its baseline (for encoding, taken after the load)
+        'encode_rss_mb': max(r['peak_rss_mb'] - r['baseline_rss_mb'] for r in encodes),
+        'decode_rss_mb': max(r['peak_rss_mb'] - r['baseline_rss_mb'] for r in decodes),
+        'encode_peak_rss_mb': max(r['peak_rss_mb'] for r in encodes),
+        'decode_peak_rss_mb': max(r['peak_rss_mb'] for r in decodes),
+        'shape': decodes[0]['shape'],
+    })
+
+
+def parse_codecs(specs):
+    """Turn ['zstd:1,9', 'snappy'] into [('zstd', 1), ('zstd', 9), ('snappy', None)]."""
+    codecs = []
+    for spec in specs:
+        name, _, levels = spec.partition(":")
+        if levels:
+            codecs.extend((name, int(level)) for level in levels.split(","))
+        else:
+            codecs.append((name, None))
+    return codecs
+
+
+def sweep(args):
+    configs = []
+    for (codec, level), row_group_size, use_dictionary, use_bss, layout in itertools.product(
+            parse_codecs(args.codecs), args.row_group_sizes, args.dictionary, args.byte_stream_split,
+            args.layouts):
+        if use_bss and (use_dictionary or layout == "blob"):
+            # Dictionary-encoded columns ignore byte-stream split, so this would repeat the dictionary
+            # trial; blob columns are binary, which byte-stream split does not support
+            continue
+        configs.append({
+            'layout': layout,
+            'compression': codec,
+            'compression_level': level,
+            'row_group_size': row_group_size,
+            'use_dictionary': use_dictionary,
+            'use_byte_stream_split': use_bss,
+        })
+
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        for i, config in enumerate(configs):
+            print(f"[{i + 1}/{len(configs)}] {config}", flush=True)
+            try:
+                results.append(run_trial(config, args.input, args.max_samples, args.repeats, workdir))
+            except Exception as e:
+                print(f"  Error: {e}")
+                results.append(dict(config, error=str(e)))
+    return results
+
+
+def format_table(results):
+    header = (f"{'layout':<6} {'codec':<8} {'lvl':>4} {'rows/rg':>8} {'dict':>5} {'bss':>5} "
+              f"{'MB':>9} {'ratio':>6} {'enc MB/s':>9} {'dec MB/s':>9} {'enc +MB':>8} {'dec +MB':>8}")
+    lines = [header, "-" * len(header)]
+    for r in results:
+        prefix = (f"{r['layout']:<6} {r['compression']:<8} {str(r['compression_level'] or '-'):>4} "
+                  f"{r['row_group_size']:>8} {str(r['use_dictionary']):>5} {str(r['use_byte_stream_split']):>5} ")
+        if 'error' in r:
+            lines.append(prefix + f"error: {r['error']}")
+        else:
+            lines.append(prefix + f"{r['size_mb']:>9.2f} {r['ratio']:>6.2f} {r['encode_mb_s']:>9.1f} "
+                                  f"{r['decode_mb_s']:>9.1f} {r['encode_rss_mb']:>8.0f} "
+                                  f"{r['decode_rss_mb']:>8.0f}")
+    return "\n".join(lines)
+
+
+def _bool_list(values):
+    return [v.lower() in ("1", "true", "yes", "on") for v in values]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark parquet storage settings for the EEG dataset")
+    parser.add_argument("--input", default="eeg_dataset",
+                        help="eeg_dataset/ directory, .npy, .pkl or .parquet file to benchmark with")
+    parser.add_argument("--max-samples", type=int, default=None,
+                        help="Only use the first N samples (keeps runs short and reproducible)")
+    parser.add_argument("--codecs", nargs="+", default=["zstd:1,9,22", "gzip:9", "brotli:11", "lz4", "snappy"],
+                        help="codec[:level,level...] entries")
+    parser.add_argument("--row-group-sizes", nargs="+", type=int, default=[10000])
+    parser.add_argument("--dictionary", nargs="+", default=["true"], help="true/false values to sweep")
+    parser.add_argument("--byte-stream-split", nargs="+", default=["false"],
+                        help="true/false values to sweep; only used without dictionary, on non-blob layouts")
+    parser.add_argument("--layouts", nargs="+", choices=LAYOUTS, default=["blob", "delta", "tensor"])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--workdir", default=None, help="Where to write trial files (defaults to the temp dir)")
+    parser.add_argument("--json", default=None, help="Also write the results to this JSON file")
+    args = parser.parse_args()
+    args.dictionary = _bool_list(args.dictionary)
+    args.byte_stream_split = _bool_list(args.byte_stream_split)
+
+    results = sweep(args)
+    print()
+    print(format_table(results))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({'input': args.input, 'max_samples': args.max_samples, 'results': results}, f, indent=2)
+        print(f"\nResults saved to {args.json}")
@@ -0,0 +1,131 @@
+# Chunk checkpoints that let long preprocessing runs resume after a failure
+import json
+import os
+import shutil
+import time
+
+import pyarrow.parquet as pq
+from tqdm import tqdm
+
+from artifact_cache import make_key
+
+MANIFEST_NAME = "manifest.json"
+CHECKPOINT_VERSION = 1
+
+
+def source_fingerprint(path):
+    """Cheap identity of an input file: path, size and modification time."""
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _write_json(path, obj):
+    """Write JSON atomically, so a crash never leaves a half-written file."""
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp, path)
+
+
+class ChunkCheckpoint:
+    """
+    Directory of finished output chunks plus a manifest of the sample ranges
+    they cover and the parameters they were computed with.
+
+    Each chunk is saved as its own parquet file as soon as it is done, and the
+    manifest is rewritten after every chunk, so a run that dies at any point
+    keeps everything finished before it. A restarted run with the same key
+    (input fingerprint and parameters) skips the finished ranges; a run with a
+    different key starts over. assemble() concatenates the chunks into the
+    final file without recomputing anything.
+    """
+
+    def __init__(self, directory, params):
+        self.directory = directory
+        self.key = make_key(params=params, version=CHECKPOINT_VERSION)
+        os.makedirs(directory, exist_ok=True)
+        self.manifest_path = os.path.join(directory, MANIFEST_NAME)
+
+        manifest = None
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        if manifest is not None and manifest['key'] != self.key:
+            print(f"Checkpoint in {directory} was made with different parameters "
+                  f"({len(manifest['chunks'])} chunks), starting over")
+            self.clear()
+            os.makedirs(directory, exist_ok=True)
+            manifest = None
+        if manifest is None:
+            manifest = {'key': self.key, 'params': params, 'created': time.time(), 'chunks': []}
+            _write_json(self.manifest_path, manifest)
+        elif manifest['chunks']:
+            print(f"Resuming from checkpoint in {directory}: {self.rows_done(manifest)} samples in "
+                  f"{len(manifest['chunks'])} chunks already done")
+        self.manifest = manifest
+        self._done = {(c['start'], c['stop']) for c in manifest['chunks']}
+
+    @staticmethod
+    def rows_done(manifest):
+        return sum(c['stop'] - c['start'] for c in manifest['chunks'])
+
+    @property
+    def chunks(self):
+        """Finished chunks in sample order."""
+        return sorted(self.manifest['chunks'], key=lambda c: c['start'])
+
+    def is_done(self, start, stop):
+        return (start, stop) in self._done
+
+    def load(self, chunk):
+        """Table saved for one entry of chunks."""
+        return pq.read_table(os.path.join(self.directory, chunk['file']))
+
+    def save(self, start, stop, table, **stats):
+        """
+        Save the finished rows [start, stop) and record them in the manifest.
+
+        Args:
+            table (pa.Table): Output rows of the chunk
+            stats: JSON-serializable per-chunk statistics kept in the manifest
+        """
+        name = f"chunk_{start:010d}_{stop:010d}.parquet"
+        path = os.path.join(self.directory, name)
+        pq.write_table(table, path + ".tmp", compression='snappy')
+        os.replace(path + ".tmp", path)
+        self.manifest['chunks'].append({'start': start, 'stop': stop, 'file': name, **stats})
+        self._done.add((start, stop))
+        _write_json(self.manifest_path, self.manifest)
+
+    def assemble(self, output_path, n_rows, compression='snappy'):
+        """
+        Concatenate the chunks, one at a time, into output_path.
+
+        Raises:
+            ValueError: If the chunks do not cover [0, n_rows) exactly
+        """
+        chunks = self.chunks
+        position = 0
+        for chunk in chunks:
+            if chunk['start'] != position:
+                raise ValueError(f"Checkpoint is missing samples [{position}, {chunk['start']})")
+            position = chunk['stop']
+        if position != n_rows:
+            raise ValueError(f"Checkpoint covers {position} of {n_rows} samples")
+
+        partial = output_path + ".partial"
+        writer = None
+        try:
+            for chunk in tqdm(chunks, desc="Assembling chunks", unit="chunks"):
+                table = self.load(chunk)
+                if writer is None:
+                    writer = pq.ParquetWriter(partial, table.schema, compression=compression,
+                                              write_statistics=True)
+                writer.write_table(table, row_group_size=table.num_rows)
+        finally:
+            if writer is not None:
+                writer.close()
+        os.replace(partial, output_path)
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
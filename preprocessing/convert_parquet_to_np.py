@@ -4,23 +4,122 @@ import pandas as pd
 import numpy as np
 import os
 import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.parquet as pq
 from tqdm import tqdm
 
+import delta_codec
+import label_partition
+import tensor_parquet
+from dtype_policy import resolve_dtype
 
-def convert_parquet_to_np(parquet_file):
+
+def _blob_chunk_view(chunk, row_bytes, dtype, shape):
+    """
+    View one chunk of a binary column as an (n, *shape) array without copying.
+
+    Returns None when the chunk has nulls or rows of different sizes.
+    """
+    if chunk.null_count:
+        return None
+    offset_type = np.int64 if pa.types.is_large_binary(chunk.type) else np.int32
+    _, offsets_buf, data_buf = chunk.buffers()
+    offsets = np.frombuffer(offsets_buf, dtype=offset_type)[chunk.offset:chunk.offset + len(chunk) + 1]
+    if len(chunk) and not np.all(np.diff(offsets) == row_bytes):
+        return None
+    if len(chunk) == 0:
+        return np.empty((0,) + shape, dtype=dtype)
+    values = np.frombuffer(data_buf, dtype=np.uint8, count=row_bytes * len(chunk), offset=int(offsets[0]))
+    return values.view(dtype).reshape((len(chunk),) + shape)
+
+
+def load_binary_blobs(table):
+    """
+    Bulk-load the binary blob format straight from the Arrow data buffers.
+
+    When every row has the same dtype and shape, each column chunk is viewed
+    as one contiguous (n, C, T) array with no per-row Python work. A single
+    chunk is returned as a zero-copy read-only view; several chunks are joined
+    with one concatenate.
+
+    Args:
+        table (pa.Table): Table with data, shape_0, shape_1, dtype and label columns
+
+    Returns:
+        tuple: (dataset, labels), or None if the rows are ragged
+    """
+    dtypes = pc.unique(table.column('dtype')).to_pylist()
+    shape_0 = pc.min_max(table.column('shape_0')).as_py()
+    shape_1 = pc.min_max(table.column('shape_1')).as_py()
+    if len(dtypes) != 1 or shape_0['min'] != shape_0['max'] or shape_1['min'] != shape_1['max']:
+        return None
+
+    dtype = np.dtype(dtypes[0])
+    shape = (shape_0['min'], shape_1['min'])
+    row_bytes = dtype.itemsize * shape[0] * shape[1]
+
+    views = []
+    for chunk in table.column('data').chunks:
+        view = _blob_chunk_view(chunk, row_bytes, dtype, shape)
+        if view is None:
+            return None
+        views.append(view)
+
+    if len(views) == 1:
+        dataset = views[0]
+    elif views:
+        dataset = np.concatenate(views)
+    else:
+        dataset = np.empty((0,) + shape, dtype=dtype)
+    labels = table.column('label').to_numpy()
+    return dataset, labels
+
+
+def convert_parquet_to_np(parquet_file, labels=None, columns=None, dtype=None):
     """
     Convert a parquet file back to numpy arrays (dataset and labels).
-    Automatically detects whether the file uses binary blob or delta encoding format.
+    Automatically detects whether the file uses binary blob, integer delta codec,
+    tensor column, legacy wide or legacy string delta encoding format.
     
     Args:
         parquet_file (str): Path to the parquet file
+        labels (list): Only load samples with these labels; row groups that
+            cannot contain them are skipped using their statistics
+        columns (list): Only read these columns (must include the data columns
+            of the file's format)
+        dtype: Dtype of the returned dataset (default: the dtype policy)
         
     Returns:
         tuple: (dataset, labels) as numpy arrays
     """
-    # Read the parquet file
-    table = pq.read_table(parquet_file)
+    # Read the parquet file (row groups are read in parallel)
+    table = label_partition.read_table(parquet_file, labels=labels, columns=columns)
+    dataset, labels = _decode_table(table)
+    return dataset.astype(resolve_dtype(dtype), copy=False), labels
+
+
+def _decode_table(table):
+    """Decode a table in any supported format to (dataset, labels) in the file's precision."""
+    if delta_codec.is_delta_table(table.schema):
+        print("Detected integer delta codec format")
+        return delta_codec.from_arrow_table(table)
+
+    if tensor_parquet.is_tensor_table(table.schema):
+        print("Detected tensor column format")
+        return tensor_parquet.from_tensor_table(table)
+
+    if 'ch0_ts0' in table.column_names:
+        print("Detected legacy wide format")
+        dataset, labels, _ = tensor_parquet.from_wide_table(table)
+        return dataset, labels
+
+    if 'data' in table.column_names:
+        loaded = load_binary_blobs(table)
+        if loaded is not None:
+            print("Detected binary blob format")
+            return loaded
+        print("Detected ragged binary blob format, falling back to per-row decoding")
+
     df = table.to_pandas()
     
     # Check which format was used (binary or delta)
@@ -35,8 +134,8 @@ def convert_parquet_to_np(parquet_file):
         dataset = np.array(dataset)
         labels = df['label'].values
     else:
-        # Delta encoding format
-        print("Detected delta encoding format")
+        # Legacy comma-separated delta encoding format
+        print("Detected legacy delta encoding format")
         # Determine the shape from the column names
         ch_count = sum(1 for col in df.columns if col.startswith('ch') and col.endswith('_start'))
         
@@ -64,7 +163,14 @@ def convert_parquet_to_np(parquet_file):
     return dataset, labels
 
 if __name__ == "__main__":
-    dataset, labels = convert_parquet_to_np("processed_parquet_delta.parquet")
+    from run_report import RunReport
+
+    parquet_file = "processed_parquet_delta.parquet"
+    report = RunReport("convert_parquet_to_np", params={'parquet_file': parquet_file})
+    with report.stage('decode', bytes_read=os.path.getsize(parquet_file)) as record:
+        dataset, labels = convert_parquet_to_np(parquet_file)
+        record.update(samples=len(dataset), bytes_written=dataset.nbytes)
+    report.save()
     print(dataset.shape)
     print(labels.shape)
     print(dataset[0])
@@ -1,226 +1,193 @@
-print("Starting conversion...")
-
+import argparse
 import pickle
-import pandas as pd
 import numpy as np
 import os
 import pyarrow as pa
 import pyarrow.parquet as pq
-from tqdm import tqdm
 
-# Load the pickle file
-print("Loading pickle file...")
-with open("eeg_dataset.pkl", 'rb') as f:
-    data = pickle.load(f)
+import delta_codec
+from dtype_policy import resolve_dtype
+from label_partition import write_in_order, write_label_sorted
+from run_report import add_report_arguments, report_from_args
+
+# Storage settings for eeg_dataset.parquet. Pick these with benchmark_storage.py,
+# which compares size and read/write speed across codecs, levels and layouts.
+LAYOUT = "blob"
+COMPRESSION = "zstd"
+COMPRESSION_LEVEL = 22
+ROW_GROUP_SIZE = 10000
+USE_DICTIONARY = True
 
-# Extract dataset and labels
-dataset = data['dataset']
-labels = data['labels']
 
-def convert_parquet_to_np(parquet_file):
+def load_source(source="eeg_dataset", pkl_file="eeg_dataset.pkl"):
     """
-    Convert a parquet file back to numpy arrays (dataset and labels).
-    Automatically detects whether the file uses binary blob or delta encoding format.
-    
+    Open the dataset written by dataset_loading.py.
+
+    A tensor store directory or .npy file is memory-mapped, so converting it
+    only ever holds one batch in memory. A pickle has to be loaded whole and
+    is only kept as a fallback for old datasets.
+
     Args:
-        parquet_file (str): Path to the parquet file
-        
+        source (str): Tensor store directory, .npy data file or .pkl file
+        pkl_file (str): Pickle to fall back to when source does not exist
+
     Returns:
-        tuple: (dataset, labels) as numpy arrays
+        tuple: (dataset, labels, source_file)
     """
-    # Read the parquet file
-    table = pq.read_table(parquet_file)
-    df = table.to_pandas()
-    
-    # Check which format was used (binary or delta)
-    if 'data' in df.columns:
-        # Binary blob format
-        print("Detected binary blob format")
-        dataset = []
-        for i in range(len(df)):
-            sample = np.frombuffer(df['data'][i], dtype=np.dtype(df['dtype'][i])).reshape(
-                df['shape_0'][i], df['shape_1'][i])
-            dataset.append(sample)
-        dataset = np.array(dataset)
-        labels = df['label'].values
+    if os.path.isdir(source) and os.path.exists(os.path.join(source, "data.npy")):
+        print(f"Loading {source}/ arrays...")
+        source_file = os.path.join(source, "data.npy")
+        labels_file = os.path.join(source, "labels.npy")
+    elif source.endswith(".npy") and os.path.exists(source):
+        source_file = source
+        labels_file = source[:-len(".npy")] + "_labels.npy"
+        if os.path.basename(source) == "data.npy":
+            labels_file = os.path.join(os.path.dirname(source), "labels.npy")
     else:
-        # Delta encoding format
-        print("Detected delta encoding format")
-        # Determine the shape from the column names
-        ch_count = sum(1 for col in df.columns if col.startswith('ch') and col.endswith('_start'))
-        
-        dataset = []
-        for i in tqdm(range(len(df)), desc="Reconstructing samples"):
-            # Get the shape of the first sample's deltas to determine time dimension
-            first_deltas = df.loc[i, 'ch0_deltas'].split(',')
-            time_dim = len(first_deltas) + 1  # +1 because deltas are differences
-            
-            sample = np.zeros((ch_count, time_dim))
-            for ch_idx in range(ch_count):
-                # Get starting value
-                start = df.loc[i, f'ch{ch_idx}_start']
-                # Get deltas and convert back to array
-                deltas = np.array([float(x) for x in df.loc[i, f'ch{ch_idx}_deltas'].split(',')])
-                # Reconstruct the channel data
-                channel_data = np.zeros(len(deltas) + 1)
-                channel_data[0] = start
-                channel_data[1:] = start + np.cumsum(deltas)
-                sample[ch_idx, :] = channel_data
-            dataset.append(sample)
-        dataset = np.array(dataset)
-        labels = df['label'].values
-    
-    return dataset, labels
-
-print(f"Dataset shape: {dataset.shape}")
-print(f"Labels shape: {labels.shape}")
-
-# APPROACH 1: Store as binary blobs with high compression
-print("Converting to optimized format...")
-
-# Create arrays for our data
-serialized_data = []
-for sample in tqdm(dataset, desc="Serializing samples"):
-    # Store as binary data
-    serialized_data.append(sample.tobytes())
-
-# Create a PyArrow table with binary data
-table = pa.table({
-    'data': pa.array(serialized_data, type=pa.binary()),
-    'shape_0': pa.array([sample.shape[0] for sample in dataset]),
-    'shape_1': pa.array([sample.shape[1] for sample in dataset]),
-    'dtype': pa.array([str(dataset.dtype)] * len(dataset)),
-    'label': pa.array(labels)
-})
-
-# Try different compression algorithms
-print("\nTesting compression algorithms...")
-best_file = None
-best_size = float('inf')
-
-# Test file paths
-test_files = {
-    "zstd_high": ("eeg_dataset_zstd.parquet", "zstd", 22),
-    "gzip_high": ("eeg_dataset_gzip.parquet", "gzip", 9),
-    "brotli_high": ("eeg_dataset_brotli.parquet", "brotli", 11)
-}
-
-for name, (file_path, algorithm, level) in test_files.items():
-    try:
-        print(f"  Testing {name}...")
-        pq.write_table(
-            table, 
-            file_path,
-            compression=algorithm,
-            compression_level=level,
-            row_group_size=min(len(dataset), 10000),  # Larger row groups
-            use_dictionary=True
-        )
-        
-        size = os.path.getsize(file_path) / (1024 * 1024)
-        print(f"  {name}: {size:.2f} MB")
-        
-        if size < best_size:
-            best_size = size
-            best_file = file_path
-    except Exception as e:
-        print(f"  Error with {name}: {e}")
-
-# APPROACH 2: Try delta encoding for time series
-print("\nTrying delta encoding approach...")
-
-# Create a dataframe with delta-encoded values
-delta_df = pd.DataFrame()
-delta_df['label'] = labels
-
-for i in tqdm(range(len(dataset)), desc="Delta encoding"):
-    sample = dataset[i]
-    
-    # For each channel, store the first value and then differences
-    for ch_idx in range(sample.shape[0]):
-        channel_data = sample[ch_idx]
-        
-        # Store first value
-        delta_df.loc[i, f'ch{ch_idx}_start'] = channel_data[0]
-        
-        # Store differences (delta encoding)
-        diffs = np.diff(channel_data)
-        
-        # Quantize differences to reduce unique values (improves compression)
-        # Round to 3 decimal places
-        diffs = np.round(diffs, 3)
-        
-        # Store as comma-separated string (more compressible than separate columns)
-        delta_df.loc[i, f'ch{ch_idx}_deltas'] = ','.join(map(str, diffs))
-
-# Save delta-encoded version
-delta_file = "eeg_dataset_delta.parquet"
-delta_df.to_parquet(delta_file, compression='zstd', compression_level=22)
-delta_size = os.path.getsize(delta_file) / (1024 * 1024)
-print(f"  Delta encoding: {delta_size:.2f} MB")
-
-if delta_size < best_size:
-    best_size = delta_size
-    best_file = delta_file
-
-# Select the best file and rename it
-if best_file and best_file != "eeg_dataset.parquet":
-    os.rename(best_file, "eeg_dataset.parquet")
-    print(f"\nBest compression achieved with {best_file}")
-else:
-    print("\nNo improvement found")
-
-# Clean up test files
-for file_path, _, _ in test_files.values():
-    if os.path.exists(file_path) and file_path != best_file:
-        os.remove(file_path)
-
-if delta_file != best_file and os.path.exists(delta_file):
-    os.remove(delta_file)
-
-# Print file size comparison
-pickle_size = os.path.getsize("eeg_dataset.pkl") / (1024 * 1024)  # MB
-parquet_size = os.path.getsize("eeg_dataset.parquet") / (1024 * 1024)  # MB
-reduction = (1 - parquet_size/pickle_size) * 100
-
-print(f"\nFile size comparison:")
-print(f"Pickle file: {pickle_size:.2f} MB")
-print(f"Parquet file: {parquet_size:.2f} MB")
-print(f"Size reduction: {reduction:.2f}%")
-
-# Provide loading instructions
-print("\nTo load the compressed data:")
-if best_file == delta_file:
-    print("""
-# For delta-encoded format:
-df = pd.read_parquet('eeg_dataset.parquet')
-dataset = []
-for i in range(len(df)):
-    sample = np.zeros((4, 612))  # Adjust shape as needed
-    for ch_idx in range(4):
-        # Get starting value
-        start = df.loc[i, f'ch{ch_idx}_start']
-        # Get deltas and convert back to array
-        deltas = np.array([float(x) for x in df.loc[i, f'ch{ch_idx}_deltas'].split(',')])
-        # Reconstruct the channel data
-        channel_data = np.zeros(len(deltas) + 1)
-        channel_data[0] = start
-        channel_data[1:] = start + np.cumsum(deltas)
-        sample[ch_idx, :len(channel_data)] = channel_data
-    dataset.append(sample)
-dataset = np.array(dataset)
-labels = df['label'].values
+        source_file = source if source.endswith(".pkl") else pkl_file
+        print(f"Loading pickle file {source_file} (not streamable, loaded whole)...")
+        with open(source_file, 'rb') as f:
+            data = pickle.load(f)
+
+        # Extract dataset and labels
+        return data['dataset'], data['labels'], source_file
+
+    dataset = np.load(source_file, mmap_mode='r', allow_pickle=False)
+    labels = np.load(labels_file, allow_pickle=False)
+    return dataset, labels, source_file
+
+
+def blob_table(dataset, labels):
+    """
+    Build the binary blob table: one row per sample holding its raw bytes.
+
+    The binary column is assembled directly from the dataset buffer with
+    evenly spaced offsets, so no per-sample bytes objects are created.
+
+    Args:
+        dataset (np.ndarray): Array of shape (N, C, T)
+        labels (np.ndarray): Array of shape (N,)
+
+    Returns:
+        pa.Table: Table with data, shape_0, shape_1, dtype and label columns
+    """
+    dataset = np.ascontiguousarray(dataset)
+    n_samples = len(dataset)
+    row_bytes = dataset[0].nbytes if n_samples else 0
+
+    # Offsets are int32 for binary; switch to large_binary past 2 GB
+    large = dataset.nbytes > np.iinfo(np.int32).max
+    offsets = np.arange(n_samples + 1, dtype=np.int64 if large else np.int32) * row_bytes
+    data = pa.Array.from_buffers(
+        pa.large_binary() if large else pa.binary(),
+        n_samples,
+        [None, pa.py_buffer(offsets), pa.py_buffer(dataset.reshape(-1).view(np.uint8))],
+    )
+
+    return pa.table({
+        'data': data,
+        'shape_0': pa.array(np.full(n_samples, dataset.shape[1], dtype=np.int64)),
+        'shape_1': pa.array(np.full(n_samples, dataset.shape[2], dtype=np.int64)),
+        'dtype': pa.array([str(dataset.dtype)] * n_samples),
+        'label': pa.array(np.asarray(labels))
+    })
+
+
+def build_table(dataset, labels, layout=LAYOUT, scale=delta_codec.DEFAULT_SCALE, dtype=None):
+    """
+    Build the Arrow table for a storage layout ('blob' or 'delta').
+
+    Blobs hold the raw bytes of dtype (default: the dtype policy); the delta
+    layout stores integers and records no float dtype.
+    """
+    if layout == "blob":
+        return blob_table(np.asarray(dataset).astype(resolve_dtype(dtype), copy=False), labels)
+    if layout == "delta":
+        return delta_codec.to_arrow_table(dataset, labels, scale=scale)
+    raise ValueError(f"Unknown layout: {layout}")
+
+
+def write_parquet(table, path, compression=COMPRESSION, compression_level=COMPRESSION_LEVEL,
+                  row_group_size=ROW_GROUP_SIZE, use_dictionary=USE_DICTIONARY,
+                  use_byte_stream_split=False):
+    """Write a table with the given parquet storage settings."""
+    pq.write_table(
+        table,
+        path,
+        compression=compression,
+        compression_level=compression_level,
+        row_group_size=min(max(table.num_rows, 1), row_group_size),
+        use_dictionary=use_dictionary,
+        use_byte_stream_split=use_byte_stream_split,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the ingested EEG dataset to parquet")
+    parser.add_argument("--input", default="eeg_dataset",
+                        help="Tensor store directory, .npy data file or .pkl file")
+    parser.add_argument("--output", default="eeg_dataset.parquet")
+    parser.add_argument("--layout", choices=["blob", "delta"], default=LAYOUT)
+    parser.add_argument("--compression", default=COMPRESSION)
+    parser.add_argument("--compression-level", type=int, default=COMPRESSION_LEVEL)
+    parser.add_argument("--batch-size", type=int, default=ROW_GROUP_SIZE,
+                        help="Samples per batch and row group; bounds peak memory")
+    parser.add_argument("--keep-order", action="store_true",
+                        help="Keep the input order instead of sorting by label (strictly sequential reads)")
+    parser.add_argument("--dtype", default=None, help="Blob layout data dtype (default: the dtype policy)")
+    add_report_arguments(parser)
+    args = parser.parse_args()
+    report = report_from_args("convert_pkl_to_parquet", args, vars(args))
+
+    print("Starting conversion...")
+    with report.stage('load') as record:
+        dataset, labels, source_file = load_source(args.input)
+        record.update(samples=len(dataset), bytes_read=dataset.nbytes)
+
+    print(f"Dataset shape: {dataset.shape}")
+    print(f"Labels shape: {labels.shape}")
+
+    # Batches are built and written one row group at a time. Unless --keep-order
+    # is given, rows are sorted by label, one label per row group, so
+    # label-filtered reads can skip row groups using their statistics
+    print(f"Converting to {args.layout} layout ({args.compression} level {args.compression_level})...")
+    # Largest |x| seen so far, tracked one batch at a time so the input is never read whole
+    max_abs = 0.0
+
+    def build_batch(batch, batch_labels):
+        global max_abs
+        if batch.size:
+            max_abs = max(max_abs, float(np.abs(batch).max()))
+        return build_table(batch, batch_labels, args.layout, dtype=args.dtype)
+
+    write = write_in_order if args.keep_order else write_label_sorted
+    with report.stage('convert', samples=len(dataset), bytes_read=dataset.nbytes) as record:
+        stats = write(args.output, dataset, labels, build_batch,
+                      row_group_size=args.batch_size, compression=args.compression,
+                      compression_level=args.compression_level, use_dictionary=USE_DICTIONARY)
+        record['bytes_written'] = os.path.getsize(args.output)
+    report.save()
+    print(f"Wrote {stats['samples']} samples ({stats['input_mb']:.2f} MB) in {stats['seconds']:.2f} s "
+          f"({stats['mb_per_s']:.1f} MB/s)")
+    if args.layout == "delta":
+        print(f"Max round-trip error: {delta_codec.max_abs_error(delta_codec.DEFAULT_SCALE, max_abs)}")
+
+    # Print file size comparison
+    source_size = os.path.getsize(source_file) / (1024 * 1024)  # MB
+    parquet_size = os.path.getsize(args.output) / (1024 * 1024)  # MB
+    reduction = (1 - parquet_size/source_size) * 100
+
+    print(f"\nFile size comparison:")
+    print(f"Source file: {source_size:.2f} MB")
+    print(f"Parquet file: {parquet_size:.2f} MB")
+    print(f"Size reduction: {reduction:.2f}%")
+
+    # Provide loading instructions
+    print("\nTo load the compressed data:")
+    print(f"""
+from convert_parquet_to_np import convert_parquet_to_np
+dataset, labels = convert_parquet_to_np('{args.output}')
+
+# Or only the samples of some digits:
+dataset, labels = convert_parquet_to_np('{args.output}', labels=[3, 7])
 """)
-else:
-    print("""
-# For binary format:
-table = pq.read_table('eeg_dataset.parquet')
-df = table.to_pandas()
-dataset = []
-for i in range(len(df)):
-    sample = np.frombuffer(df['data'][i], dtype=np.dtype(df['dtype'][i])).reshape(
-        df['shape_0'][i], df['shape_1'][i])
-    dataset.append(sample)
-dataset = np.array(dataset)
-labels = df['label'].values
-""")
\ No newline at end of file
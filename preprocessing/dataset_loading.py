@@ -1,132 +1,477 @@
 import requests
 import gdown  # You'll need to install this: pip install gdown
 import os.path  # Add this import for file existence check
+import time
+import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np  # Add numpy for statistical operations
+from tqdm import tqdm
+
+from artifact_cache import MANIFEST_NAME, ArtifactCache, copy_file, make_key
+from dtype_policy import resolve_dtype
+from run_report import RunReport
+from tensor_store import TensorStore
 
 # Your file ID
 file_id = '1AnnW4R9-pzEUcl8V0LucvfeJ2CUOf5KI'
 
-# Option 1: Using gdown (recommended for Google Drive files)
-output_file = "downloaded_file.txt"
-
-# Only download if the file doesn't already exist
-if not os.path.exists(output_file):
-    gdown.download(f"https://drive.google.com/uc?id={file_id}", output_file, quiet=False)
-    print(f"File downloaded to {output_file}")
-else:
-    print(f"File {output_file} already exists, skipping download")
-
-# Read the file
-with open(output_file, "r") as file:
-    data = file.read()
-
-    # Define the expected channel order
-    channel_order = ["TP9", "FP1", "FP2", "TP10"]
-    
-    # Create dataset directly in a single pass
-    # We'll use a dictionary to track the current sample for each code and channel
-    current_samples = {}  # {code: {channel: [values]}}
-    dataset = []
-    labels = []
-    
-    # Import tqdm for progress tracking and pickle for saving
-    from tqdm import tqdm
-    import pickle
-    
-    # Process all lines and build dataset directly
-    for i, line in enumerate(tqdm(data.strip().split('\n'), desc="Processing data")):
+# Define the expected channel order
+channel_order = ["TP9", "FP1", "FP2", "TP10"]
+
+# Bytes of the raw dump handed to each parser worker
+CHUNK_SIZE = 64 * 1024 * 1024
+
+# Bump when the parsing/pairing logic changes so cached datasets are rebuilt
+INGEST_VERSION = 3
+
+
+def download_dataset(output_file="downloaded_file.txt"):
+    """
+    Download the MindBigData dump from Google Drive unless it is already on disk.
+
+    Args:
+        output_file (str): Path to save the raw text dump
+    """
+    # Option 1: Using gdown (recommended for Google Drive files)
+    # Only download if the file doesn't already exist
+    if not os.path.exists(output_file):
+        gdown.download(f"https://drive.google.com/uc?id={file_id}", output_file, quiet=False)
+        print(f"File downloaded to {output_file}")
+    else:
+        print(f"File {output_file} already exists, skipping download")
+
+
+def chunk_boundaries(path, chunk_size=CHUNK_SIZE):
+    """
+    Split a text file into byte ranges that start and end on line boundaries.
+
+    Args:
+        path (str): Path to the text file
+        chunk_size (int): Approximate number of bytes per range
+
+    Returns:
+        list: (start, end) byte offsets covering the whole file
+    """
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as f:
+        pos = chunk_size
+        while pos < size:
+            f.seek(pos)
+            f.readline()  # Move to the start of the next line
+            pos = f.tell()
+            if pos >= size:
+                break
+            bounds.append(pos)
+            pos += chunk_size
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _value_counts(value_fields):
+    """Number of comma-separated values in each field, without parsing them."""
+    return np.array([s.count(',') + 1 for s in value_fields], dtype=np.int64)
+
+
+def _parse_values(value_fields, lengths):
+    """
+    Parse a list of comma-separated value strings in one vectorized call.
+
+    Falls back to parsing line by line when the joined parse fails. A line
+    that does not parse is written as lengths[i] zeros, so every line keeps
+    the place the scan pass gave it.
+
+    Returns:
+        tuple: (flat float64 values, mask of lines that parsed)
+    """
+    ok = np.ones(len(value_fields), dtype=bool)
+    if not value_fields:
+        return np.zeros(0), ok
+
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", DeprecationWarning)
+            flat = np.fromstring(','.join(value_fields), dtype=np.float64, sep=',')
+        if flat.size == lengths.sum():
+            return flat, ok
+    except (ValueError, DeprecationWarning):
+        pass
+
+    # Slow path: at least one line has bad values
+    parsed = []
+    for i, s in enumerate(value_fields):
+        try:
+            values = np.array(s.split(','), dtype=np.float64)
+        except ValueError:
+            values = None
+        if values is None or values.size != lengths[i]:
+            ok[i] = False
+            values = np.zeros(lengths[i])
+        parsed.append(values)
+    return np.concatenate(parsed), ok
+
+
+def _normalize_events(flat, lengths):
+    """
+    Z-score every event in place, grouping events of equal length so each
+    group is normalized with one 2D mean/std call.
+    """
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    for length in np.unique(lengths):
+        idx = np.flatnonzero(lengths == length)
+        gather = offsets[idx][:, None] + np.arange(length)
+        rows = flat[gather]
+        mean = rows.mean(axis=1, keepdims=True)
+        std = rows.std(axis=1, keepdims=True)
+        flat[gather] = (rows - mean) / std
+    return flat
+
+
+def parse_chunk(args):
+    """
+    Parse one byte range of the MindBigData dump.
+
+    Args:
+        args (tuple): (path, start, end, channel_order, device, normalize, with_values)
+
+    Without with_values only the header fields are parsed and each event is
+    sized by counting its commas, so the scan pass never parses floats.
+
+    Returns:
+        dict: codes, channels, lengths and (if with_values) the flat values
+        (z-scored per event when normalize is set) of every kept event in file order, the number of lines
+        skipped for a bad code and (with values) the number of events whose values failed to parse and
+        were written as zeros
+    """
+    path, start, end, channels_wanted, device, normalize, with_values = args
+    channel_index = {ch: i for i, ch in enumerate(channels_wanted)}
+
+    with open(path, "rb") as f:
+        f.seek(start)
+        text = f.read(end - start).decode("utf-8")
+
+    codes = []
+    channels = []
+    value_fields = []
+    n_failed = 0
+    for line in text.split('\n'):
         fields = line.split('\t')
         if len(fields) < 7:  # Skip malformed lines
             continue
-            
-        device = fields[2]
-        if device != "MU":  # Only process MUSE data
+        if fields[2] != device:  # Only process data from the chosen device
             continue
-            
-        channel = fields[3]
-        if channel not in channel_order:
+        ch_idx = channel_index.get(fields[3])
+        if ch_idx is None:
             continue  # Skip channels we don't want
-            
-        code = int(fields[4])  # The digit being thought/seen
-        raw_values = fields[6].split(',')
-        
-        # Convert values to float
         try:
-            values = [float(val.strip()) for val in raw_values]
-            
-            # Calculate mean and standard deviation for this array
-            array_mean = np.mean(values)
-            array_std = np.std(values)
-            #print(f"Array stats - Mean: {array_mean:.4f}, Std: {array_std:.4f}")
-            
-            # Normalize values
-            normalized_values = [(v - array_mean) / array_std for v in values]
-            
-            # Initialize code entry if needed
-            if code not in current_samples:
-                current_samples[code] = {ch: [] for ch in channel_order}
-            
-            # Add values to the current sample for this channel
-            current_samples[code][channel].append(normalized_values)
-            
-            # Check if we have data for all channels
-            all_channels_have_data = all(len(current_samples[code][ch]) > 0 for ch in channel_order)
-            
-            if all_channels_have_data:
-                # Find minimum length across all channels
-                min_length = min(len(current_samples[code][ch][0]) for ch in channel_order)
-                
-                if min_length > 0:
-                    # Create a sample with shape (n_channels, n_timesteps)
-                    sample = np.zeros((len(channel_order), min_length))
-                    
-                    # Fill in data for each channel
-                    for ch_idx, ch in enumerate(channel_order):
-                        sample[ch_idx, :min_length] = current_samples[code][ch][0][:min_length]
-                    
-                    # Add to dataset
-                    dataset.append(sample)
-                    labels.append(code)
-                    
-                    # Remove the used data
-                    for ch in channel_order:
-                        current_samples[code][ch].pop(0)
-            
+            code = int(fields[4])  # The digit being thought/seen
         except ValueError:
-            print(f"Warning: Could not parse values in a line. Skipping.")
-    
-    # Convert to numpy arrays
-    # First, find the maximum length across all samples
-    max_length = 0
-    for sample in dataset:
-        for channel in sample:
-            max_length = max(max_length, len(channel))
-    
-    # Create a padded dataset with consistent dimensions
-    padded_dataset = []
-    for sample in dataset:
-        # Create a zero-padded sample
-        padded_sample = np.zeros((len(channel_order), max_length))
-        for ch_idx, channel_data in enumerate(sample):
-            # Copy the data (will be truncated if longer than max_length)
-            padded_sample[ch_idx, :len(channel_data)] = channel_data[:max_length]
-        padded_dataset.append(padded_sample)
-    
-    # Now convert to numpy array
-    dataset = np.array(padded_dataset)  # Shape: (batch_size, n_channels, n_timesteps)
-    labels = np.array(labels)    # Shape: (batch_size,)
-    
+            n_failed += 1
+            continue
+        codes.append(code)
+        channels.append(ch_idx)
+        value_fields.append(fields[6])
+
+    # Event sizes come from the comma count; values are only parsed when they are kept
+    lengths = _value_counts(value_fields)
+    result = {
+        'codes': np.array(codes, dtype=np.int64),
+        'channels': np.array(channels, dtype=np.int64),
+        'lengths': lengths,
+        'n_failed': n_failed,
+    }
+    if with_values:
+        flat, ok = _parse_values(value_fields, lengths)
+        if normalize:
+            flat = _normalize_events(flat, lengths)
+        if not ok.all():
+            # Unparseable events stay zero, like padding
+            offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+            for i in np.flatnonzero(~ok):
+                flat[offsets[i]:offsets[i] + lengths[i]] = 0.0
+        result['values'] = flat
+        result['n_bad_values'] = int((~ok).sum())
+    return result
+
+
+def pair_channel_events(codes, channels, n_channels):
+    """
+    Group channel events into multi-channel samples.
+
+    The k-th event of every channel for a given code belongs to the k-th sample
+    of that code. A sample is emitted once its last channel arrives, so samples
+    are ordered by the position of their latest event.
+
+    Args:
+        codes (np.ndarray): Code of every event, in file order
+        channels (np.ndarray): Channel index of every event, in file order
+        n_channels (int): Number of channels per sample
+
+    Returns:
+        tuple: (event_table, labels) where event_table[i, ch] is the index of
+        the event providing channel ch of sample i
+    """
+    n_events = len(codes)
+    if n_events == 0:
+        return np.zeros((0, n_channels), dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    # Rank of each event among earlier events with the same (code, channel)
+    key = codes * n_channels + channels
+    order = np.argsort(key, kind='stable')
+    sorted_key = key[order]
+    group_start = np.flatnonzero(np.r_[True, sorted_key[1:] != sorted_key[:-1]])
+    group_sizes = np.diff(np.r_[group_start, n_events])
+    rank = np.empty(n_events, dtype=np.int64)
+    rank[order] = np.arange(n_events) - np.repeat(group_start, group_sizes)
+
+    # One row per (code, rank), one column per channel
+    sample_keys, sample_idx = np.unique(np.stack([codes, rank], axis=1), axis=0, return_inverse=True)
+    sample_idx = sample_idx.reshape(-1)
+    event_table = np.full((len(sample_keys), n_channels), -1, dtype=np.int64)
+    event_table[sample_idx, channels] = np.arange(n_events)
+
+    complete = (event_table >= 0).all(axis=1)
+    event_table = event_table[complete]
+    labels = sample_keys[complete, 0]
+
+    emitted = np.argsort(event_table.max(axis=1), kind='stable')
+    return event_table[emitted], labels[emitted]
+
+
+def _imap_bounded(pool, fn, tasks, max_in_flight):
+    """
+    Like pool.map, but keeps at most max_in_flight tasks submitted so finished
+    chunks never pile up in memory faster than the caller consumes them.
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.submit(fn, task))
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _parse_chunks(path, bounds, channels_wanted, device, normalize, with_values, n_workers, desc):
+    """Yield parse_chunk results for every byte range, in file order."""
+    n_workers = n_workers or os.cpu_count() or 1
+    tasks = [(path, start, end, list(channels_wanted), device, normalize, with_values)
+             for start, end in bounds]
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        for result in tqdm(_imap_bounded(pool, parse_chunk, tasks, 2 * n_workers),
+                           total=len(tasks), desc=desc):
+            yield result
+
+
+def scan_events(path, channels_wanted=channel_order, device="MU",
+                chunk_size=CHUNK_SIZE, n_workers=None):
+    """
+    First pass over the raw dump: collect per-event metadata without keeping
+    any signal values, and work out the final dataset layout.
+
+    Args:
+        path (str): Path to the MindBigData text dump
+        channels_wanted (list): Channel names to keep, in output order
+        device (str): Device code to keep (MU = Muse)
+        chunk_size (int): Approximate bytes per worker task
+        n_workers (int): Number of worker processes (defaults to all cores)
+
+    Returns:
+        dict: chunk bounds, per-chunk event counts, the event table and labels
+        from pair_channel_events, per-sample lengths and the padded length
+    """
+    bounds = chunk_boundaries(path, chunk_size)
+
+    codes, channels, lengths, chunk_events = [], [], [], []
+    n_failed = 0
+    for result in _parse_chunks(path, bounds, channels_wanted, device, False, False, n_workers, "Scanning data"):
+        codes.append(result['codes'])
+        channels.append(result['channels'])
+        lengths.append(result['lengths'])
+        chunk_events.append(len(result['codes']))
+        n_failed += result['n_failed']
+
+    if n_failed:
+        print(f"Warning: Could not parse the code in {n_failed} lines. Skipping.")
+
+    codes = np.concatenate(codes) if codes else np.zeros(0, dtype=np.int64)
+    channels = np.concatenate(channels) if channels else np.zeros(0, dtype=np.int64)
+    lengths = np.concatenate(lengths) if lengths else np.zeros(0, dtype=np.int64)
+
+    event_table, labels = pair_channel_events(codes, channels, len(channels_wanted))
+    sample_lengths = lengths[event_table].min(axis=1) if len(event_table) else np.zeros(0, dtype=np.int64)
+    max_length = int(sample_lengths.max()) if len(sample_lengths) else 0
+
+    return {
+        'bounds': bounds,
+        'chunk_events': np.array(chunk_events, dtype=np.int64),
+        'n_events': len(codes),
+        'event_table': event_table,
+        'labels': labels,
+        'sample_lengths': sample_lengths,
+        'max_length': max_length,
+    }
+
+
+def write_dataset(path, output_dir="eeg_dataset", channels_wanted=channel_order, device="MU",
+                  normalize=True, chunk_size=CHUNK_SIZE, n_workers=None, dtype=None):
+    """
+    Build the (batch_size, n_channels, n_timesteps) dataset from the raw dump
+    straight into a preallocated memory-mapped TensorStore.
+
+    Each sample is cut to the shortest of its channels and the whole dataset is
+    zero-padded to the longest sample. Only the chunks currently being parsed
+    are held in memory, so the dump can be larger than RAM.
+
+    Args:
+        path (str): Path to the MindBigData text dump
+        output_dir (str): TensorStore directory to create
+        normalize (bool): Z-score every channel event before pairing
+        dtype: Stored data dtype (default: the dtype policy); values are
+            parsed in float64 and rounded once when written
+
+    Returns:
+        tuple: (dataset, labels) with dataset opened read-only as a memmap
+    """
+    plan = scan_events(path, channels_wanted, device, chunk_size, n_workers)
+    event_table = plan['event_table']
+    n_samples = len(event_table)
+    n_channels = len(channels_wanted)
+
+    # Map every event to the sample slot it fills (-1 if it is never paired)
+    event_sample = np.full(plan['n_events'], -1, dtype=np.int64)
+    event_channel = np.zeros(plan['n_events'], dtype=np.int64)
+    event_sample[event_table] = np.arange(n_samples)[:, None]
+    event_channel[event_table] = np.arange(n_channels)[None, :]
+    chunk_start = np.concatenate(([0], np.cumsum(plan['chunk_events'])))
+
+    store = TensorStore.create(
+        output_dir, n_samples, n_channels, plan['max_length'], dtype=resolve_dtype(dtype),
+        channel_names=channels_wanted, arrays={'sample_length': np.int64},
+        attrs={'source': os.path.abspath(path), 'device': device, 'normalize': normalize})
+    dataset = store.data
+
+    chunks = _parse_chunks(path, plan['bounds'], channels_wanted, device, normalize, True, n_workers,
+                           "Writing data")
+    n_bad_values = 0
+    for chunk_idx, result in enumerate(chunks):
+        n_bad_values += result['n_bad_values']
+        first = chunk_start[chunk_idx]
+        samples = event_sample[first:chunk_start[chunk_idx + 1]]
+        used = np.flatnonzero(samples >= 0)
+        if len(used) == 0:
+            continue
+        offsets = np.concatenate(([0], np.cumsum(result['lengths'])[:-1]))
+        copy_lengths = plan['sample_lengths'][samples[used]]
+        for length in np.unique(copy_lengths):
+            group = used[copy_lengths == length]
+            rows = result['values'][offsets[group][:, None] + np.arange(length)]
+            dataset[samples[group], event_channel[first + group], :length] = rows
+
+    if n_bad_values:
+        print(f"Warning: Could not parse values in {n_bad_values} lines. Written as zeros.")
+    store.labels[:] = plan['labels']
+    store.meta['sample_length'][:] = plan['sample_lengths']
+    store.flush()
+    del store, dataset
+
+    return load_dataset(output_dir)
+
+
+def load_dataset(output_dir="eeg_dataset", mmap_mode='r'):
+    """
+    Load a dataset written by write_dataset without unpickling anything.
+
+    Args:
+        output_dir (str): TensorStore directory
+        mmap_mode (str): Passed to np.load; None reads the data into memory
+
+    Returns:
+        tuple: (dataset, labels) as numpy arrays
+    """
+    store = TensorStore(output_dir, mode=mmap_mode)
+    return store.data, np.asarray(store.labels)
+
+
+def cached_write_dataset(path, output_dir="eeg_dataset", channels_wanted=channel_order, device="MU",
+                         normalize=True, cache_dir=".ingest_cache", max_cache_bytes=20 * 1024 ** 3,
+                         chunk_size=CHUNK_SIZE, n_workers=None, dtype=None):
+    """
+    write_dataset with a content-addressed cache in front of it.
+
+    The cache key combines a content hash of the raw dump with the parse
+    settings, so the dump is only re-parsed when the file or the settings
+    change. The cached TensorStore files are copied into output_dir, so
+    later writes there leave the cache entry intact.
+
+    Args:
+        cache_dir (str): Directory holding cached datasets
+        max_cache_bytes (int): Oldest entries are evicted beyond this size
+
+    Returns:
+        tuple: (dataset, labels) loaded from output_dir
+    """
+    cache = ArtifactCache(cache_dir, max_cache_bytes)
+    params = {
+        'channel_order': list(channels_wanted),
+        'device': device,
+        'normalize': normalize,
+        'dtype': resolve_dtype(dtype).name,
+        'ingest_version': INGEST_VERSION,
+    }
+    source_digest = cache.file_fingerprint(path)
+    key = make_key(source=source_digest, **params)
+
+    manifest = cache.lookup(key)
+    if manifest is not None:
+        built = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(manifest['created']))
+        print(f"Reusing cached dataset {key[:12]} (built {built} from {manifest['source']}, "
+              f"{manifest['n_samples']} samples, shape {tuple(manifest['shape'])}, params {manifest['params']})")
+    else:
+        print(f"No cached dataset for {path} with params {params}, parsing...")
+        staging = cache.staging_dir()
+        try:
+            dataset, labels = write_dataset(path, staging, channels_wanted, device, normalize,
+                                            chunk_size, n_workers, dtype)
+            info = {
+                'source': os.path.abspath(path),
+                'source_digest': source_digest,
+                'params': params,
+                'n_samples': int(dataset.shape[0]),
+                'shape': list(dataset.shape),
+            }
+            del dataset, labels
+            cache.commit(key, staging, info)
+        except BaseException:
+            cache.discard(staging)
+            raise
+
+    os.makedirs(output_dir, exist_ok=True)
+    for name in os.listdir(cache.entry_dir(key)):
+        if name != MANIFEST_NAME:
+            copy_file(os.path.join(cache.entry_dir(key), name), os.path.join(output_dir, name))
+    return load_dataset(output_dir)
+
+
+if __name__ == "__main__":
+    output_file = "downloaded_file.txt"
+    report = RunReport("dataset_loading", params={'source': output_file, 'output_dir': "eeg_dataset"})
+    with report.stage('download'):
+        download_dataset(output_file)
+
+    with report.stage('ingest', bytes_read=os.path.getsize(output_file)) as record:
+        dataset, labels = cached_write_dataset(output_file, "eeg_dataset")
+        record.update(samples=len(dataset), bytes_written=dataset.nbytes)
+    report.save()
+
     print(f"\nDataset created with shape: {dataset.shape}")
     print(f"Labels shape: {labels.shape}")
     print(f"Unique labels: {np.unique(labels)}")
-    
-    # Save dataset and labels to pickle file
-    output_pkl = "eeg_dataset.pkl"
-    with open(output_pkl, 'wb') as f:
-        pickle.dump({'dataset': dataset, 'labels': labels}, f)
-    print(f"Dataset saved to {output_pkl}")
-    
-print(data[:500])
+    print("Dataset saved to the eeg_dataset/ tensor store")
+
+    with open(output_file, "r") as file:
+        print(file.read(500))
 
 # Option 2: If gdown doesn't work, you can try using a shareable link
 # 1. Go to Google Drive, right-click your file
@@ -134,4 +479,4 @@ print(data[:500])
 # 3. Copy the link and use it like this:
 # shared_link = "YOUR_SHARED_LINK_HERE"
 # output = "downloaded_file.txt"
-# gdown.download(shared_link, output, quiet=False)
\ No newline at end of file
+# gdown.download(shared_link, output, quiet=False)
@@ -0,0 +1,27 @@
+# Floating point dtype used for EEG arrays from ingestion through storage and preprocessing
+import os
+
+import numpy as np
+
+# float32 keeps ~7 significant digits, far more than the resolution of the
+# recorded signals, at half the memory, disk and bandwidth of float64.
+# Set EEG_DTYPE=float64 to run the whole pipeline in double precision.
+DEFAULT_DTYPE = np.dtype(os.environ.get("EEG_DTYPE", "float32"))
+
+
+def resolve_dtype(dtype=None):
+    """The policy dtype, unless a specific dtype is requested."""
+    return DEFAULT_DTYPE if dtype is None else np.dtype(dtype)
+
+
+def check_dtype(array, dtype, stage):
+    """
+    Fail loudly when a stage hands back a different dtype than the policy,
+    e.g. a float64 array silently produced from float32 input.
+
+    Returns:
+        The array, unchanged
+    """
+    if np.dtype(array.dtype) != np.dtype(dtype):
+        raise TypeError(f"{stage} produced {array.dtype} data, expected {np.dtype(dtype)} (dtype policy)")
+    return array
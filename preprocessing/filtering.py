@@ -0,0 +1,96 @@
+# Batched band-pass filtering of (N, C, T) EEG datasets
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import signal
+from tqdm import tqdm
+
+# Target working set per chunk. sosfiltfilt keeps a few padded temporaries of
+# the chunk alive, so this keeps each chunk's work inside a typical L2/L3 cache.
+CHUNK_BYTES = 4 * 1024 * 1024
+
+
+def design_bandpass_sos(lowcut, highcut, fs, order=5, ftype='butter', rs=40):
+    """
+    Design a Butterworth (or Chebyshev type II) band-pass filter in
+    second-order sections.
+
+    SOS form is numerically stable at the orders and low cutoffs we use, where
+    the (b, a) polynomial form loses precision.
+
+    Args:
+        ftype (str): 'butter' or 'cheby2'
+        rs (float): Stop-band attenuation in dB for 'cheby2'
+
+    Returns:
+        np.ndarray: (n_sections, 6) SOS coefficients
+    """
+    nyq = 0.5 * fs
+    band = [lowcut / nyq, highcut / nyq]
+    if ftype == 'butter':
+        return signal.butter(order, band, btype='band', output='sos')
+    if ftype == 'cheby2':
+        return signal.cheby2(order, rs, band, btype='band', output='sos')
+    raise ValueError(f"Unknown filter type {ftype!r}; expected 'butter' or 'cheby2'")
+
+
+def filtfilt_padlen(sos):
+    """Padding length matching signal.filtfilt on the equivalent (b, a) filter."""
+    return 3 * (2 * len(sos) + 1)
+
+
+def auto_chunk_size(n_channels, n_times, itemsize=8, chunk_bytes=CHUNK_BYTES):
+    """Number of samples per chunk so one chunk is about chunk_bytes."""
+    return max(1, chunk_bytes // (n_channels * n_times * itemsize))
+
+
+def bandpass_filter_dataset(dataset, sos, chunk_size=None, n_threads=1, out=None, desc="Filtering"):
+    """
+    Zero-phase filter a whole dataset along its time axis.
+
+    The dataset is processed in (chunk, C, T) blocks, each filtered with one
+    sosfiltfilt call. With n_threads > 1, blocks are filtered concurrently
+    (scipy releases the GIL inside the filter loop). Each block is filtered in
+    float64 and stored in the output dtype, so float32 data is only rounded
+    once instead of accumulating error through the filter recursion.
+
+    Args:
+        dataset (np.ndarray): Array of shape (N, C, T), may be memory-mapped
+        sos (np.ndarray): Filter from design_bandpass_sos
+        chunk_size (int): Samples per block (default: auto_chunk_size)
+        n_threads (int): Number of blocks filtered concurrently
+        out (np.ndarray): Optional output array of the same shape (default: dataset's dtype)
+        desc (str): Progress bar label
+
+    Returns:
+        np.ndarray: The filtered dataset
+    """
+    n_samples, n_channels, n_times = dataset.shape
+    if out is None:
+        out = np.empty(dataset.shape, dtype=dataset.dtype)
+    if chunk_size is None:
+        chunk_size = auto_chunk_size(n_channels, n_times, np.result_type(dataset.dtype, sos.dtype).itemsize)
+    padlen = min(filtfilt_padlen(sos), n_times - 1)
+
+    def filter_chunk(start):
+        stop = min(start + chunk_size, n_samples)
+        out[start:stop] = signal.sosfiltfilt(sos, dataset[start:stop], axis=-1, padlen=padlen)
+        return stop - start
+
+    starts = range(0, n_samples, chunk_size)
+    begin = time.perf_counter()
+    with tqdm(total=n_samples, desc=desc, unit="samples") as progress:
+        if n_threads > 1:
+            with ThreadPoolExecutor(max_workers=n_threads) as pool:
+                for done in pool.map(filter_chunk, starts):
+                    progress.update(done)
+        else:
+            for start in starts:
+                progress.update(filter_chunk(start))
+    elapsed = time.perf_counter() - begin
+
+    rate = n_samples / elapsed if elapsed > 0 else float('inf')
+    print(f"Filtered {n_samples} samples in {elapsed:.2f} s ({rate:.0f} samples/s, "
+          f"chunk size {chunk_size}, {n_threads} thread(s))")
+    return out
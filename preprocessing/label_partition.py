@@ -0,0 +1,165 @@
+# Batched, label-sorted parquet writing and label-filtered, multithreaded reading
+import time
+
+import numpy as np
+import pyarrow.parquet as pq
+from tqdm import tqdm
+
+DEFAULT_ROW_GROUP_SIZE = 4096
+
+
+def label_row_groups(labels, row_group_size=DEFAULT_ROW_GROUP_SIZE):
+    """
+    Split sample indices into row groups sorted by label, with no row group
+    holding more than one label.
+
+    Args:
+        labels (np.ndarray): Label of every sample
+        row_group_size (int): Maximum rows per row group
+
+    Returns:
+        list: Index arrays, one per row group, in write order
+    """
+    labels = np.asarray(labels)
+    order = np.argsort(labels, kind='stable')
+    sorted_labels = labels[order]
+    bounds = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1], True])
+
+    groups = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        for chunk_start in range(start, end, row_group_size):
+            groups.append(order[chunk_start:min(chunk_start + row_group_size, end)])
+    return groups
+
+
+def write_batched(path, dataset, labels, build_table, batches, compression='zstd', compression_level=None,
+                  desc="Writing row groups", **writer_options):
+    """
+    Stream a dataset to parquet, one row group per batch of sample indices.
+
+    Only one batch is materialized at a time, so peak memory is set by the
+    batch size and not by the dataset size when dataset is memory-mapped.
+    Progress shows samples written and input throughput.
+
+    Args:
+        path (str): Output parquet file
+        dataset (np.ndarray): Array of shape (N, C, T)
+        labels (np.ndarray): Array of shape (N,)
+        build_table (callable): (dataset, labels) -> pa.Table for one row group
+        batches (list): Index arrays (or slices), one per row group, in write order
+        compression, compression_level: Parquet codec settings
+        writer_options: Extra pq.ParquetWriter options (use_dictionary, ...)
+
+    Returns:
+        dict: samples, input_mb, seconds and mb_per_s for the whole write
+    """
+    labels = np.asarray(labels)
+    writer = None
+    n_written = 0
+    bytes_in = 0
+    start = time.perf_counter()
+    try:
+        with tqdm(total=len(labels), desc=desc, unit="samples") as progress:
+            for idx in batches:
+                if not isinstance(idx, slice):
+                    # Sorted indices keep reads from a memmap sequential
+                    idx = np.sort(idx)
+                batch = np.asarray(dataset[idx])
+                table = build_table(batch, labels[idx])
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema, compression=compression,
+                                              compression_level=compression_level, write_statistics=True,
+                                              **writer_options)
+                writer.write_table(table, row_group_size=len(batch))
+                n_written += len(batch)
+                bytes_in += batch.nbytes
+                progress.update(len(batch))
+                progress.set_postfix(MB_s=f"{bytes_in / (1024 * 1024) / (time.perf_counter() - start):.1f}")
+        if writer is None:
+            # Empty dataset: still write a valid file with the right schema
+            table = build_table(np.asarray(dataset[:0]), labels[:0])
+            writer = pq.ParquetWriter(path, table.schema, compression=compression,
+                                      compression_level=compression_level, **writer_options)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    seconds = time.perf_counter() - start
+    input_mb = bytes_in / (1024 * 1024)
+    return {'samples': n_written, 'input_mb': input_mb, 'seconds': seconds,
+            'mb_per_s': input_mb / seconds if seconds > 0 else 0.0}
+
+
+def write_label_sorted(path, dataset, labels, build_table, row_group_size=DEFAULT_ROW_GROUP_SIZE,
+                       compression='zstd', compression_level=None, **writer_options):
+    """
+    Write a dataset sorted by label, one label per row group, with column
+    statistics so readers can skip row groups by label.
+
+    Args:
+        row_group_size (int): Maximum rows per row group (and per batch in memory)
+
+    See write_batched for the other arguments.
+    """
+    return write_batched(path, dataset, labels, build_table, label_row_groups(labels, row_group_size),
+                         compression=compression, compression_level=compression_level, **writer_options)
+
+
+def write_in_order(path, dataset, labels, build_table, row_group_size=DEFAULT_ROW_GROUP_SIZE,
+                   compression='zstd', compression_level=None, **writer_options):
+    """
+    Like write_label_sorted, but keep the input order and read the input
+    strictly sequentially.
+    """
+    batches = [slice(start, min(start + row_group_size, len(labels)))
+               for start in range(0, len(labels), row_group_size)]
+    return write_batched(path, dataset, labels, build_table, batches,
+                         compression=compression, compression_level=compression_level, **writer_options)
+
+
+def read_table(path, labels=None, columns=None, use_threads=True):
+    """
+    Read a parquet file, keeping only the given labels and columns.
+
+    The label filter is pushed down to the parquet reader, which skips row
+    groups whose label statistics cannot match, and the remaining row groups
+    are read in parallel on pyarrow's thread pool.
+
+    Args:
+        path (str): Parquet file or directory of parquet files
+        labels (list): Labels to keep (None keeps every row)
+        columns (list): Columns to read (None reads all); 'label' is always kept
+        use_threads (bool): Read row groups in parallel
+
+    Returns:
+        pa.Table: The matching rows, with the file's schema metadata
+    """
+    filters = None
+    if labels is not None:
+        filters = [('label', 'in', [int(label) for label in labels])]
+    if columns is not None and 'label' not in columns:
+        columns = ['label'] + list(columns)
+    return pq.read_table(path, columns=columns, filters=filters, use_threads=use_threads, pre_buffer=True)
+
+
+def row_groups_read(path, labels):
+    """
+    Number of row groups a label filter has to read, out of the total, based
+    on the label column statistics.
+
+    Returns:
+        tuple: (row groups read, total row groups)
+    """
+    metadata = pq.ParquetFile(path).metadata
+    label_idx = next(i for i in range(metadata.num_columns)
+                     if metadata.schema.column(i).path == 'label')
+    wanted = set(int(label) for label in labels)
+    read = 0
+    for rg in range(metadata.num_row_groups):
+        stats = metadata.row_group(rg).column(label_idx).statistics
+        if stats is None or not stats.has_min_max:
+            read += 1
+        elif any(stats.min <= label <= stats.max for label in wanted):
+            read += 1
+    return read, metadata.num_row_groups
@@ -0,0 +1,313 @@
+# Batched NumPy FastICA and EOG component removal, mirroring MNE's ICA pipeline
+import numpy as np
+from scipy import fft, linalg, signal
+
+# MNE's filter length factors (transition bandwidths per window) for FIR design
+HAMMING_LENGTH_FACTOR = 3.3
+
+# find_bads_eog defaults: band used to score sources against the EOG channels
+EOG_BAND = (1.0, 10.0)
+EOG_TRANS_BANDWIDTH = 0.5
+EOG_FILTER_SECONDS = 10
+
+
+def highpass_taps(sfreq, l_freq, filter_length=None):
+    """
+    Zero-phase FIR high-pass taps, as designed by MNE's raw.filter(l_freq, None)
+    with fir_design='firwin' and the default Hamming window.
+
+    Args:
+        sfreq (float): Sampling rate in Hz
+        l_freq (float): High-pass cutoff in Hz
+        filter_length (int): Taps (None uses MNE's 'auto' length)
+
+    Returns:
+        np.ndarray: Odd-length filter taps
+    """
+    l_trans = min(max(0.25 * l_freq, 2.0), l_freq)
+    if filter_length is None:
+        filter_length = int(np.ceil(HAMMING_LENGTH_FACTOR / l_trans * sfreq))
+    filter_length += (filter_length - 1) % 2
+
+    # All-pass minus a low-pass centred on the transition band
+    transition = l_trans / sfreq
+    n_lowpass = int(round(HAMMING_LENGTH_FACTOR / transition))
+    n_lowpass += 1 - n_lowpass % 2
+    if n_lowpass > filter_length:
+        raise ValueError(f"filter_length {filter_length} is too short for a {l_freq} Hz high-pass "
+                         f"(needs {n_lowpass} taps)")
+    taps = np.zeros(filter_length)
+    taps[filter_length // 2] = 1.0
+    offset = (filter_length - n_lowpass) // 2
+    taps[offset:filter_length - offset] -= signal.firwin(
+        n_lowpass, l_freq - l_trans / 2, window='hamming', pass_zero=True, fs=sfreq)
+    return taps
+
+
+def eog_band_taps(sfreq, l_freq=EOG_BAND[0], h_freq=EOG_BAND[1]):
+    """FIR band-pass taps MNE uses when scoring sources in find_bads_eog."""
+    n_taps = int(np.ceil(EOG_FILTER_SECONDS * sfreq))
+    n_taps = 2 ** int(np.ceil(np.log2(n_taps)))
+    freq = np.array([0, l_freq - EOG_TRANS_BANDWIDTH, l_freq, h_freq, h_freq + EOG_TRANS_BANDWIDTH, sfreq / 2])
+    # Normalized to Nyquist before the design, as MNE does
+    return signal.firwin2(n_taps, freq / (sfreq / 2.0), [0, 0, 1, 1, 0, 0], window='hann')
+
+
+def _reflect_limited_pad(x, n_pad):
+    """Point-reflect n_pad samples at both ends of the last axis, zero-filling past one period."""
+    if n_pad == 0:
+        return x
+    n_reflect = min(n_pad, x.shape[-1] - 1)
+    zeros = np.zeros(x.shape[:-1] + (n_pad - n_reflect,), dtype=x.dtype)
+    left = 2 * x[..., :1] - x[..., n_reflect:0:-1]
+    right = 2 * x[..., -1:] - x[..., -2:-n_reflect - 2:-1]
+    return np.concatenate([zeros, left, x, right, zeros], axis=-1)
+
+
+def _overlap_add_length(n_x, n_taps):
+    """FFT block length MNE's overlap-add filter picks for n_x padded samples."""
+    min_fft = 2 * n_taps - 1
+    if n_x < min_fft:
+        return fft.next_fast_len(min_fft, real=True)
+    lengths = 2 ** np.arange(np.ceil(np.log2(min_fft)), np.ceil(np.log2(n_x)) + 1, dtype=int)
+    # Multiplications per block times blocks, plus MNE's penalty on long FFTs
+    cost = np.ceil(n_x / (lengths - n_taps + 1).astype(np.float64)) * lengths * (np.log2(lengths) + 1)
+    cost += 4e-5 * lengths * n_x
+    return int(lengths[np.argmin(cost)])
+
+
+def fir_filter(x, taps, double=False):
+    """
+    Zero-phase FIR filtering along the last axis of any stack of signals.
+
+    Matches MNE's overlap-add filter (reflect_limited padding, FFT block
+    length, delay compensation) block for block, so the output rounds exactly
+    like MNE's, but filters every row of the stack in each FFT call.
+
+    Args:
+        x (np.ndarray): Array of shape (..., T)
+        taps (np.ndarray): Linear-phase FIR taps
+        double (bool): Filter forwards and backwards (MNE's 'zero-double' phase)
+
+    Returns:
+        np.ndarray: Filtered array of the same shape
+    """
+    n_times = x.shape[-1]
+    n_edge = max(min(len(taps), n_times) - 1, 0)
+    if double:
+        taps = np.convolve(taps, taps[::-1])
+    padded = _reflect_limited_pad(x, n_edge)
+    n_x = padded.shape[-1]
+    n_fft = _overlap_add_length(n_x, len(taps))
+    taps_fft = fft.rfft(taps, n_fft)
+    n_block = n_fft - len(taps) + 1
+    shift = (len(taps) - 1) // 2 + n_edge
+    filtered = np.zeros_like(padded)
+    for start in range(0, n_x, n_block):
+        block = fft.rfft(padded[..., start:start + n_block], n_fft, axis=-1)
+        block *= taps_fft
+        block = fft.irfft(block, n_fft, axis=-1)
+        begin, end = max(0, start - shift), min(start - shift + n_fft, n_x)
+        offset = max(0, shift - start)
+        filtered[..., begin:end] += block[..., offset:offset + end - begin]
+    return filtered[..., :n_times]
+
+
+def _sym_decorrelation(W):
+    """
+    W <- (W W^T)^(-1/2) W for a stack of square matrices.
+
+    Rounds exactly like sklearn: scipy's eigh matrix by matrix (numpy's
+    batched eigh rounds differently) and the product grouped as multi_dot
+    groups it. On epochs that converge slowly, rounding differences grow into
+    a different FastICA solution.
+    """
+    WWt = W @ W.transpose(0, 2, 1)
+    s = np.empty(WWt.shape[:2])
+    u = np.empty_like(WWt)
+    for i, m in enumerate(WWt):
+        s[i], u[i] = linalg.eigh(m)
+    s = np.clip(s, np.finfo(W.dtype).tiny, None)
+    return (u * (1.0 / np.sqrt(s))[:, None, :]) @ (u.transpose(0, 2, 1) @ W)
+
+
+def fastica(X, w_init, max_iter=1000, tol=1e-4):
+    """
+    Parallel FastICA (logcosh contrast) on a batch of whitened signals.
+
+    Same fixed-point iteration as sklearn's FastICA(whiten=False), run for all
+    epochs at once; each epoch stops updating when it converges, so results
+    match running the epochs one at a time.
+
+    Args:
+        X (np.ndarray): Whitened data of shape (B, n, T)
+        w_init (np.ndarray): Initial unmixing matrices of shape (B, n, n)
+        max_iter (int): Maximum iterations per epoch
+        tol (float): Convergence tolerance
+
+    Returns:
+        tuple: (unmixing matrices (B, n, n), iterations per epoch (B,))
+    """
+    n_times = X.shape[-1]
+    W = _sym_decorrelation(w_init)
+    n_iter = np.zeros(len(X), dtype=np.int64)
+    active = np.arange(len(X))
+    X_active, XT_active = X, X.transpose(0, 2, 1)
+    for iteration in range(max_iter):
+        W_active = W[active]
+        gwtx = np.tanh(W_active @ X_active)
+        g_wtx = (1 - gwtx ** 2).mean(axis=-1)
+        W1 = _sym_decorrelation(gwtx @ XT_active / n_times - g_wtx[:, :, None] * W_active)
+        lim = np.abs(np.abs(np.einsum('bij,bij->bi', W1, W_active)) - 1).max(axis=-1)
+        W[active] = W1
+        n_iter[active] = iteration + 1
+        converged = lim < tol
+        if converged.all():
+            break
+        if converged.any():
+            active = active[~converged]
+            X_active = X[active]
+            XT_active = X_active.transpose(0, 2, 1)
+    return W, n_iter
+
+
+def find_outliers(scores, threshold=3.0, max_iter=2):
+    """
+    Iterated z-score outlier detection along the last axis, as in MNE's
+    find_bads_eog (measure='zscore').
+
+    Returns:
+        np.ndarray: Boolean outlier mask of the same shape as scores
+    """
+    mask = np.zeros(scores.shape, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(max_iter):
+            keep = ~mask
+            count = keep.sum(axis=-1, keepdims=True)
+            mean = np.where(keep, scores, 0).sum(axis=-1, keepdims=True) / count
+            std = np.sqrt(np.where(keep, (scores - mean) ** 2, 0).sum(axis=-1, keepdims=True) / count)
+            local_bad = keep & (np.abs(scores - mean) / std > threshold)
+            if not local_bad.any():
+                break
+            mask |= local_bad
+    return mask
+
+
+def _pearson_rows(sources, targets):
+    """Pearson correlation of every source with every target: (B, n, T), (B, E, T) -> (B, E, n)."""
+    sources = sources - sources.mean(axis=-1, keepdims=True)
+    targets = targets - targets.mean(axis=-1, keepdims=True)
+    cov = targets @ sources.transpose(0, 2, 1)
+    norms = np.sqrt((targets ** 2).sum(-1))[:, :, None] * np.sqrt((sources ** 2).sum(-1))[:, None, :]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return cov / norms
+
+
+def _initial_unmixing(seeds, n_components):
+    """FastICA starting matrices, drawn like sklearn does from each epoch's seed."""
+    cache = {}
+    for seed in np.unique(seeds):
+        cache[seed] = np.random.RandomState(seed).normal(size=(n_components, n_components))
+    return np.stack([cache[seed] for seed in seeds])
+
+
+def ica_clean_batch(data, sampling_rate, eog_picks, n_components=3, lowcut_ica=1.0, random_state=42,
+                    threshold=3.0, filter_length=None, max_iter=1000, tol=1e-4, highpass=None, eog_band=None):
+    """
+    Remove EOG-correlated ICA components from a batch of epochs.
+
+    Per epoch this reproduces MNE's ica_clean_epoch: high-pass the epoch,
+    standardize it, reduce it by PCA, fit FastICA, correlate the sources with
+    the band-passed EOG channels, z-score the correlations, and project the
+    outlying components out of the unfiltered epoch. Every step but the small
+    per-epoch SVDs runs on the whole (B, C, T) stack at once, with MNE's
+    operations in MNE's order so the results round like MNE's.
+
+    Args:
+        data (np.ndarray): Epochs of shape (B, C, T)
+        sampling_rate (float): Sampling rate in Hz
+        eog_picks (list): Indices of the channels used as EOG references
+        n_components (int): Number of ICA components
+        lowcut_ica (float): High-pass cutoff applied before fitting ICA
+        random_state (int or np.ndarray): FastICA seed, or one seed per epoch
+        threshold (float): z-score above which a component is removed
+        filter_length (int): High-pass taps (None uses MNE's 'auto' length)
+        max_iter, tol: FastICA convergence settings
+        highpass, eog_band (np.ndarray): Precomputed highpass_taps / eog_band_taps
+            for this sampling rate, so callers cleaning many batches design them once
+
+    Returns:
+        tuple: (cleaned epochs with data's dtype, (B, n_components) bool mask of removed components)
+    """
+    x = np.asarray(data, dtype=np.float64)
+    n_epochs, n_channels, n_times = x.shape
+    if n_components > n_channels:
+        raise ValueError(f"n_components={n_components} exceeds the {n_channels} channels")
+    seeds = np.broadcast_to(np.asarray(random_state, dtype=np.int64), (n_epochs,))
+
+    # 1 Hz high-pass copy used to fit and score ICA
+    if highpass is None:
+        highpass = highpass_taps(sampling_rate, lowcut_ica, filter_length)
+    x_hp = fir_filter(x, highpass)
+
+    # Standardize with one scale per epoch (all channels are EEG) and run PCA. MNE's reductions and
+    # SVD are repeated epoch by epoch, in its order and with scipy's LAPACK driver: FastICA amplifies
+    # rounding differences in its input on epochs that converge slowly
+    pre_whitener = np.array([np.std(epoch) for epoch in x_hp])[:, None, None]
+    valid = (pre_whitener[:, 0, 0] > 0) & np.isfinite(pre_whitener[:, 0, 0])
+    pre_whitener[~valid] = 1.0
+    whitened = x_hp / pre_whitener
+    n_pca = min(n_channels, n_times)
+    pca_mean = np.empty((n_epochs, n_channels, 1))
+    U = np.empty((n_epochs, n_times, n_pca))
+    S = np.empty((n_epochs, n_pca))
+    Vt = np.empty((n_epochs, n_pca, n_channels))
+    for i, epoch in enumerate(whitened):
+        samples = epoch.T.copy()
+        pca_mean[i, :, 0] = samples.mean(axis=0)
+        samples -= pca_mean[i, :, 0]
+        U[i], S[i], Vt[i] = linalg.svd(samples, full_matrices=False)
+    centered = whitened - pca_mean
+    # Deterministic signs: largest |U| entry of each column is positive
+    signs = np.sign(np.take_along_axis(U, np.abs(U).argmax(axis=1)[:, None, :], axis=1))
+    U *= signs
+    Vt *= signs.transpose(0, 2, 1)
+    explained_variance = S ** 2 / (n_times - 1)
+
+    # FastICA on the first n_components whitened PCA scores
+    pca_scores = U[:, :, :n_components].transpose(0, 2, 1) * np.sqrt(n_times - 1)
+    W, _ = fastica(pca_scores, _initial_unmixing(seeds, n_components), max_iter, tol)
+    unmixing = W / np.sqrt(explained_variance[:, None, :n_components])
+
+    # Order components by explained variance, as ICA.fit does
+    sources = unmixing @ (Vt[:, :n_components] @ centered)
+    variance = (np.linalg.pinv(unmixing) ** 2).sum(axis=1) * (sources ** 2).sum(axis=-1)
+    order = variance.argsort(axis=-1)[:, ::-1]
+    unmixing = np.take_along_axis(unmixing, order[:, :, None], axis=1)
+    sources = np.take_along_axis(sources, order[:, :, None], axis=1)
+
+    # Score sources against each EOG channel, both band-passed to 1-10 Hz
+    if eog_band is None:
+        eog_band = eog_band_taps(sampling_rate)
+    scores = _pearson_rows(fir_filter(sources, eog_band, double=True),
+                           fir_filter(x_hp[:, eog_picks], eog_band, double=True))
+    excluded = find_outliers(scores, threshold).any(axis=1)
+    excluded &= valid[:, None]
+
+    # Epochs without EOG components are returned unchanged
+    cleaned = np.array(data, copy=True)
+    dirty = np.flatnonzero(excluded.any(axis=1))
+    if len(dirty):
+        eye = np.broadcast_to(np.eye(n_channels), (len(dirty), n_channels, n_channels))
+        full_unmixing = eye.copy()
+        full_unmixing[:, :n_components, :n_components] = unmixing[dirty]
+        full_mixing = eye.copy()
+        full_mixing[:, :n_components, :n_components] = np.linalg.pinv(unmixing[dirty])
+        keep = np.ones((len(dirty), n_channels))
+        keep[:, :n_components] = ~excluded[dirty]
+        # Residual PCA components beyond n_components are kept, as in ICA.apply
+        proj = Vt[dirty].transpose(0, 2, 1) @ (full_mixing * keep[:, None, :]) @ full_unmixing @ Vt[dirty]
+        scale = pre_whitener[dirty]
+        restored = (proj @ (x[dirty] / scale - pca_mean[dirty]) + pca_mean[dirty]) * scale
+        cleaned[dirty] = restored.astype(cleaned.dtype, copy=False)
+    return cleaned, excluded
@@ -0,0 +1,244 @@
+# Shared EEG preprocessing pipeline used for both training data and live serving
+import argparse
+import json
+
+import numpy as np
+from scipy import signal
+
+from artifact_removal import CH_NAMES, ICA_FILTER_LENGTH, apply_ica, eog_picks, ica_clean_epoch
+from artifact_screening import clean_screened, screen_epochs
+from dtype_policy import DEFAULT_DTYPE, check_dtype
+from filtering import bandpass_filter_dataset, design_bandpass_sos, filtfilt_padlen
+from numpy_ica import eog_band_taps, highpass_taps, ica_clean_batch
+
+# Training settings from preprocess_data; serving overrides the sampling rate
+DEFAULT_CONFIG = {
+    'sampling_rate': 250,
+    'lowcut': 0.5,
+    'highcut': 50,
+    'filter_order': 6,
+    'filter_type': 'butter',
+    'lowcut_ica': 1.0,
+    'n_components': 3,
+    'ica_backend': 'numpy',
+    'random_state': 42,
+    'eog_threshold': 3.0,
+    # Optional FP1/FP2 'peak', 'variance' and 'low_power' thresholds below which
+    # an epoch skips ICA (see artifact_screening.py to calibrate and validate them)
+    'screen_thresholds': None,
+    # Raw windows are z-scored per channel before filtering, as dataset_loading
+    # does to every channel event at ingest (write_dataset normalize=True)
+    'zscore_input': True,
+    'normalize': False,
+    'channel_names': CH_NAMES,
+    'dtype': DEFAULT_DTYPE.name,
+}
+
+FILTER_KEYS = ['sampling_rate', 'lowcut', 'highcut', 'filter_order', 'filter_type', 'dtype']
+ICA_KEYS = ['sampling_rate', 'lowcut_ica', 'n_components', 'ica_backend', 'random_state', 'eog_threshold',
+            'screen_thresholds', 'channel_names', 'dtype']
+
+
+def _as_batch(x):
+    """View a (C, T) window as a batch of one; returns (batch, was_single)."""
+    x = np.asarray(x)
+    if x.ndim == 2:
+        return x[None], True
+    if x.ndim != 3:
+        raise ValueError(f"Expected a (C, T) window or an (N, C, T) batch, got shape {x.shape}")
+    return x, False
+
+
+class PreprocessingPipeline:
+    """
+    Band-pass filter, ICA artifact removal and optional z-scoring, built once
+    from a config.
+
+    Filter coefficients, ICA filter taps and EOG channel picks are computed in
+    the constructor, so serving pays for them once per process instead of once
+    per window and channel. Every step accepts a single (C, T) window or an
+    (N, C, T) batch and runs on the whole batch at once; the *_dataset methods
+    run the same steps chunked and in parallel for full training datasets.
+
+    Every step returns config['dtype'] data (float32 by default, see
+    dtype_policy); filtering and ICA compute in float64 internally and round
+    once on output.
+    """
+
+    def __init__(self, config=None, **overrides):
+        config = {**DEFAULT_CONFIG, **(config or {}), **overrides}
+        unknown = sorted(set(config) - set(DEFAULT_CONFIG))
+        if unknown:
+            raise ValueError(f"Unknown pipeline settings: {unknown}")
+        self.config = config
+        self.dtype = np.dtype(config['dtype'])
+
+        fs = config['sampling_rate']
+        self.sos = design_bandpass_sos(config['lowcut'], config['highcut'], fs, config['filter_order'],
+                                       config['filter_type'])
+        self.padlen = filtfilt_padlen(self.sos)
+        self.eog_picks = eog_picks(config['channel_names'])
+        self.highpass = highpass_taps(fs, config['lowcut_ica'], ICA_FILTER_LENGTH)
+        self.eog_band = eog_band_taps(fs)
+
+    @classmethod
+    def from_file(cls, path, **overrides):
+        """Build a pipeline from a JSON config written by save()."""
+        with open(path) as f:
+            return cls(json.load(f), **overrides)
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.config, f, indent=2)
+
+    @property
+    def filter_params(self):
+        """Settings that determine the filter step's output."""
+        return {key: self.config[key] for key in FILTER_KEYS}
+
+    @property
+    def ica_params(self):
+        """Settings that determine the artifact removal step's output."""
+        return {key: self.config[key] for key in ICA_KEYS}
+
+    def filter(self, x):
+        """Zero-phase band-pass filter a window or batch along time."""
+        filtered = signal.sosfiltfilt(self.sos, x, axis=-1, padlen=min(self.padlen, np.shape(x)[-1] - 1))
+        return filtered.astype(self.dtype, copy=False)
+
+    def remove_artifacts(self, x):
+        """
+        Remove EOG components from a window or batch.
+
+        Only epochs that pass screen_epochs are fitted; epochs where ICA
+        cannot remove anything (or that fall below the screening thresholds)
+        are returned unchanged.
+
+        Returns:
+            tuple: (cleaned data with x's shape, number of removed components per epoch)
+        """
+        batch, single = _as_batch(x)
+        c = self.config
+        needs_ica = screen_epochs(batch, c['sampling_rate'], self.eog_picks, c['n_components'], c['eog_threshold'],
+                                  c['screen_thresholds'])
+
+        def clean(idx):
+            if c['ica_backend'] == 'numpy':
+                cleaned, excluded = ica_clean_batch(batch[idx], c['sampling_rate'], self.eog_picks,
+                                                    c['n_components'], c['lowcut_ica'], c['random_state'],
+                                                    c['eog_threshold'], highpass=self.highpass,
+                                                    eog_band=self.eog_band)
+                return cleaned, excluded.sum(axis=1)
+            import mne
+            info = mne.create_info(ch_names=list(c['channel_names'][:batch.shape[1]]), sfreq=c['sampling_rate'],
+                                   ch_types='eeg', verbose=False)
+            cleaned = np.empty_like(batch[idx])
+            n_removed = np.zeros(len(idx), dtype=np.int64)
+            for j, i in enumerate(idx):
+                cleaned[j], excluded = ica_clean_epoch(batch[i], info, c['lowcut_ica'], c['n_components'],
+                                                       c['random_state'], threshold=c['eog_threshold'])
+                n_removed[j] = len(excluded)
+            return cleaned, n_removed
+
+        cleaned, n_removed = clean_screened(clean, batch, needs_ica)
+        return (cleaned[0], n_removed) if single else (cleaned, n_removed)
+
+    def prepare_input(self, x):
+        """
+        Bring a raw (C, T) window or (N, C, T) batch to the scale of the
+        training data: z-scored per channel over the whole window in float64
+        (population std, like dataset_loading at ingest) when zscore_input is
+        set. Training datasets were already prepared at ingest, so the
+        *_dataset methods and __call__ expect prepared input.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        if self.config['zscore_input']:
+            mean = x.mean(axis=-1, keepdims=True)
+            std = x.std(axis=-1, keepdims=True)
+            x = np.where(std > 0, (x - mean) / np.where(std > 0, std, 1), x)
+        return x.astype(self.dtype, copy=False)
+
+    def normalize(self, x):
+        """Z-score every channel of a window or batch; flat channels are left as they are."""
+        x = np.asarray(x)
+        mean = x.mean(axis=-1, keepdims=True)
+        std = x.std(axis=-1, keepdims=True)
+        return np.where(std > 0, (x - mean) / np.where(std > 0, std, 1), x).astype(self.dtype, copy=False)
+
+    def __call__(self, x):
+        """Run every step on a (C, T) window or an (N, C, T) batch."""
+        out, _ = self.remove_artifacts(self.filter(x))
+        if self.config['normalize']:
+            out = self.normalize(out)
+        return check_dtype(out, self.dtype, "PreprocessingPipeline")
+
+    def _output(self, dataset, out):
+        """Output array for a *_dataset step: out, or a new array in the pipeline dtype."""
+        return np.empty(dataset.shape, dtype=self.dtype) if out is None else out
+
+    def filter_dataset(self, dataset, out=None, n_threads=1):
+        """filter() over a full (N, C, T) dataset, in cache-sized chunks across threads."""
+        return bandpass_filter_dataset(dataset, self.sos, n_threads=n_threads, out=self._output(dataset, out))
+
+    def clean_dataset(self, dataset, out=None, n_workers=None, blas_threads=1, checkpoint=None):
+        """
+        remove_artifacts() over a full dataset, in chunks across a process pool,
+        resuming from and saving to checkpoint (a ChunkCheckpoint) if given.
+        """
+        c = self.config
+        cleaned, _ = apply_ica(dataset, c['sampling_rate'], n_components=c['n_components'],
+                               lowcut_ica=c['lowcut_ica'], random_state=c['random_state'], n_workers=n_workers,
+                               blas_threads=blas_threads, ch_names=c['channel_names'],
+                               out=self._output(dataset, out), backend=c['ica_backend'],
+                               threshold=c['eog_threshold'], screen=True,
+                               screen_thresholds=c['screen_thresholds'], checkpoint=checkpoint)
+        return cleaned
+
+    def normalize_dataset(self, dataset, out=None, chunk_size=4096):
+        """normalize() over a full dataset, chunk by chunk."""
+        out = self._output(dataset, out)
+        for start in range(0, len(dataset), chunk_size):
+            out[start:start + chunk_size] = self.normalize(dataset[start:start + chunk_size])
+        return out
+
+    def process_dataset(self, dataset, n_threads=1, n_workers=None, blas_threads=1):
+        """Run every step on a full dataset with the chunked, parallel implementations."""
+        out = self.clean_dataset(self.filter_dataset(dataset, n_threads=n_threads), n_workers=n_workers,
+                                 blas_threads=blas_threads)
+        if self.config['normalize']:
+            out = self.normalize_dataset(out, out=out)
+        return check_dtype(out, self.dtype, "PreprocessingPipeline.process_dataset")
+
+
+def check_parity(pipeline, dataset, n_threads=1, n_workers=1):
+    """
+    Check that the dataset path (training) and the per-window path (serving)
+    of a pipeline produce the same output for the same epochs.
+
+    Returns:
+        dict: epochs, max_abs_diff, and whether the outputs are identical
+    """
+    dataset = np.asarray(dataset)
+    batch = pipeline.process_dataset(dataset, n_threads=n_threads, n_workers=n_workers)
+    windows = np.stack([pipeline(window) for window in dataset])
+    diff = np.abs(batch - windows)
+    return {
+        'epochs': len(dataset),
+        'max_abs_diff': float(diff.max()) if diff.size else 0.0,
+        'identical': bool(np.array_equal(batch, windows)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check training/serving parity of the preprocessing pipeline")
+    parser.add_argument("input", help="Tensor store directory or parquet file with raw epochs")
+    parser.add_argument("--config", help="JSON pipeline config (default: the training settings)")
+    parser.add_argument("--epochs", type=int, default=100)
+    args = parser.parse_args()
+
+    from tensor_store import open_dataset
+
+    pipeline = PreprocessingPipeline.from_file(args.config) if args.config else PreprocessingPipeline()
+    dataset, _ = open_dataset(args.input)
+    report = check_parity(pipeline, dataset[:args.epochs])
+    print(json.dumps(report, indent=2))
@@ -9,6 +9,9 @@ from mne.preprocessing import ICA
 import mne
 import matplotlib.pyplot as plt
 import scipy.stats
+import atexit
+import os
+import sys
 import warnings
 
 # Silence all warnings
@@ -25,13 +28,20 @@ with open("eeg_dataset.pkl", 'rb') as f:
     data = pickle.load(f)
 """
 
-from convert_parquet_to_np import convert_parquet_to_np
+from checkpoint import ChunkCheckpoint
+from dtype_policy import check_dtype, resolve_dtype
+from pipeline import PreprocessingPipeline
+from run_report import RunReport
+from stage_cache import StageCache
+from stream_preprocess import preprocessed_attrs, stream_preprocess
+from tensor_parquet import write_tensor_parquet
+from tensor_store import is_store, open_dataset, parquet_to_store
 
-# Extract dataset and labels
-dataset, labels = convert_parquet_to_np("processed_parquet_delta.parquet")
+input_file = "processed_parquet_delta.parquet"
 
-print(f"Dataset shape: {dataset.shape}")
-print(f"Labels shape: {labels.shape}")
+# Every stage stores float32 unless EEG_DTYPE overrides the dtype policy;
+# each stage's output is checked so nothing silently upcasts to float64
+dtype = resolve_dtype()
 
 # Define preprocessing parameters
 sampling_rate = 250  # Hz (adjust based on your actual sampling rate)
@@ -40,137 +50,147 @@ highcut = 50  # Hz
 filter_order = 6
 # New parameter for ICA-specific filtering
 lowcut_ica = 1.0  # Hz - higher cutoff specifically for ICA
+n_components = 3
+# The 'numpy' ICA backend fits a whole chunk at once (validated against MNE with
+# `python artifact_removal.py <dataset>`); 'mne' fits one MNE ICA per epoch
+ica_backend = 'numpy'
+# dataset_loading z-scores every channel event at ingest (normalize=True); recorded in
+# the pipeline config so serving prepares raw windows the same way
+input_zscored = True
+# Threads for the band-pass filter (scipy releases the GIL while filtering): every core
+filter_threads = os.cpu_count()
+
+# The same pipeline (filter design, ICA taps, settings) is used by the serving
+# backend; `python pipeline.py <dataset>` checks both paths give identical output
+pipeline = PreprocessingPipeline(sampling_rate=sampling_rate, lowcut=lowcut_general, highcut=highcut,
+                                 filter_order=filter_order, lowcut_ica=lowcut_ica, n_components=n_components,
+                                 ica_backend=ica_backend, zscore_input=input_zscored, dtype=dtype.name)
+output_file = "processed_parquet.parquet"
+output_attrs = preprocessed_attrs(pipeline)
+
+# Streaming mode reads one row group at a time, runs every step on it and appends
+# it to the output, so memory stays flat however large the input is. It skips the
+# stage cache and the visualization (rows keep the input order).
+streaming = False
+# In both modes finished chunks of the ICA step are checkpointed here with a
+# manifest of their sample ranges, so rerunning after a failure resumes where it
+# stopped; the checkpoint is removed once the stage's result is complete
+checkpoint_dir = ".preprocess_checkpoints"
+
+# Every run writes a JSON report with each stage's wall and CPU time, samples/s,
+# peak RSS and bytes read/written to run_reports/ (also when it fails); compare two
+# runs with `python run_report.py old.json new.json`. Set profile_stage to a stage
+# name ('filter', 'ica', ...) to save a cProfile of that stage next to the report
+profile_stage = None
+report = RunReport('preprocess_data', params={'input_file': input_file, 'streaming': streaming,
+                                              'pipeline': pipeline.config}, profile_stage=profile_stage)
+atexit.register(report.save)
+
+if streaming:
+    with report.stage('stream', bytes_read=os.path.getsize(input_file)) as record:
+        stats = stream_preprocess(input_file, output_file, pipeline, output_attrs,
+                                  checkpoint_dir=os.path.join(checkpoint_dir, 'stream'))
+        record.update(samples=stats['computed'], bytes_written=os.path.getsize(output_file))
+    print(f"Preprocessed dataset saved to {output_file}")
+    sys.exit(0)
+
+# Every stage's output is cached under a key built from its input and its
+# parameters, so a rerun starts at the first stage whose parameters changed
+# (a failure while writing or plotting keeps the finished filter and ICA stages)
+stages = StageCache(cache_dir=".preprocess_cache", max_bytes=50 * 1024 ** 3)
+source_key = stages.source_key(input_file)
+
+# Extract dataset and labels (a tensor store directory is memory-mapped instead of decoded)
+with report.stage('load') as record:
+    if is_store(input_file):
+        load_key = source_key
+        dataset, labels = open_dataset(input_file)
+    else:
+        load_key, loaded = stages.array_stage('load', source_key, {'dtype': dtype.name},
+                                              lambda staging: parquet_to_store(input_file, staging, dtype=dtype))
+        dataset, labels = loaded.data, loaded.labels
+        record.update(cached=stages.hits['load'], bytes_read=os.path.getsize(input_file))
+    record.update(samples=len(dataset), bytes_written=dataset.nbytes)
+
+print(f"Dataset shape: {dataset.shape}")
+print(f"Labels shape: {labels.shape}")
 
 # Step 1: Band-Pass Filtering
 print("\nApplying band-pass filtering...")
 
-def butter_bandpass(lowcut, highcut, fs, order=5):
-    nyq = 0.5 * fs
-    low = lowcut / nyq
-    high = highcut / nyq
-    b, a = signal.butter(order, [low, high], btype='band')
-    return b, a
-
-def apply_bandpass_filter(data, lowcut, highcut, fs, order=5):
-    b, a = butter_bandpass(lowcut, highcut, fs, order=order)
-    y = signal.filtfilt(b, a, data)
-    return y
-
-# Apply general filtering to each sample and channel
-filtered_dataset = np.zeros_like(dataset)
-for i in tqdm(range(len(dataset)), desc="Filtering"):
-    for ch in range(dataset[i].shape[0]):
-        filtered_dataset[i, ch] = apply_bandpass_filter(
-            dataset[i, ch], lowcut_general, highcut, sampling_rate, filter_order)
+# The filter is designed once (SOS form) and whole (chunk, C, T) blocks are filtered
+# along the time axis; matches the old per-channel filtfilt within ~1e-3 on z-scored data
+with report.stage('filter', samples=len(dataset), bytes_read=dataset.nbytes) as record:
+    filter_key, filtered = stages.transform_stage(
+        'filter', load_key, pipeline.filter_params, dataset, labels,
+        lambda data, out: pipeline.filter_dataset(data, out=out, n_threads=filter_threads), dtype=dtype)
+    filtered_dataset = check_dtype(filtered.data, dtype, "filter stage")
+    record.update(cached=stages.hits['filter'], bytes_written=filtered_dataset.nbytes)
 
 # Step 2: Artifact Removal using ICA
 print("\nPerforming artifact removal with ICA...")
 
-def apply_ica(data, n_components=3):
-    """Apply ICA to remove artifacts from EEG data using MNE's built-in detection"""
-    # Create an MNE-compatible data structure
-    ch_names = ['TP9', 'FP1', 'FP2', 'TP10']
-    info = mne.create_info(ch_names=ch_names, sfreq=sampling_rate, ch_types='eeg')
-    
-    # Process each sample
-    cleaned_data = np.zeros_like(data)
-    for i in tqdm(range(data.shape[0]), desc="ICA processing"):
-        # Create an MNE Raw object
-        raw = mne.io.RawArray(data[i], info)
-        
-        # Apply 1 Hz high-pass filter specifically for ICA
-        raw_ica = raw.copy()
-        raw_ica.filter(l_freq=lowcut_ica, h_freq=None, filter_length=825)
-        
-        # Apply ICA with fixed number of components and reduced verbosity
-        ica = ICA(n_components=n_components, random_state=42, method='fastica', verbose=False)
-        
-        # Fit ICA on the high-pass filtered data with reduced verbosity
-        ica.fit(raw_ica, verbose=False)
-        
-        # Use MNE's built-in method to find artifacts with reduced verbosity
-        eog_indices, scores = ica.find_bads_eog(raw_ica, ch_name=['FP1', 'FP2'], verbose=False)
-        
-        # Remove the artifacts
-        if eog_indices:
-            if i % 10000 == 0:  # Print occasionally
-                print(f"Sample {i}: Removing {len(eog_indices)} artifact components")
-            ica.exclude = eog_indices
-            cleaned = ica.apply(raw.copy(), verbose=False)  # Add verbose=False here
-            cleaned_data[i] = cleaned.get_data()
-        else:
-            # If no artifacts found, keep original
-            cleaned_data[i] = raw.get_data()
-    
-    return cleaned_data
+# Epochs are cleaned in chunks across a process pool; every epoch uses the same
+# seed as the serial run, and each worker is limited to ica_blas_threads BLAS threads
+ica_workers = None  # None = all cores
+ica_blas_threads = 1
+
+
+def clean_with_checkpoint(data, out):
+    # Keyed on the filter stage's key, so chunks are only reused for the same filtered data
+    checkpoint = ChunkCheckpoint(os.path.join(checkpoint_dir, 'ica'),
+                                 {'upstream': filter_key, 'ica': pipeline.ica_params})
+    pipeline.clean_dataset(data, out=out, n_workers=ica_workers, blas_threads=ica_blas_threads,
+                           checkpoint=checkpoint)
+    checkpoint.clear()
+
 
 # Apply ICA to remove artifacts
 try:
-    cleaned_dataset = apply_ica(filtered_dataset)
+    with report.stage('ica', samples=len(filtered_dataset), bytes_read=filtered_dataset.nbytes) as record:
+        cleaned_key, cleaned = stages.transform_stage(
+            'ica', filter_key, pipeline.ica_params, filtered_dataset, labels, clean_with_checkpoint, dtype=dtype)
+        cleaned_dataset = check_dtype(cleaned.data, dtype, "ica stage")
+        record.update(cached=stages.hits['ica'], bytes_written=cleaned_dataset.nbytes)
 except Exception as e:
     print(f"ICA failed with error: {e}")
     print("Continuing without artifact removal")
-    cleaned_dataset = filtered_dataset
+    cleaned_key, cleaned_dataset = filter_key, filtered_dataset
 
-# Plot a sample before and after preprocessing for verification
-plt.figure(figsize=(15, 8))
+# Save the preprocessed dataset to parquet
+print("\nSaving preprocessed dataset to parquet...")
 
-# Original sample
-plt.subplot(3, 1, 1)
-plt.title("Original Signal (First Sample, First Channel)")
-plt.plot(dataset[0, 0])
+# Store the (N, C, T) tensor in one fixed-size list column, with the shape and
+# preprocessing settings in the file metadata
+with report.stage('write', samples=len(cleaned_dataset), bytes_read=cleaned_dataset.nbytes) as record:
+    stages.file_stage('write', cleaned_key, {'attrs': output_attrs, 'compression': 'snappy'}, output_file,
+                      lambda path: write_tensor_parquet(path, cleaned_dataset, labels, attrs=output_attrs,
+                                                        compression='snappy'))
+    record.update(cached=stages.hits['write'], bytes_written=os.path.getsize(output_file))
 
-# Filtered sample
-plt.subplot(3, 1, 2)
-plt.title("After Filtering")
-plt.plot(filtered_dataset[0, 0])
+print(f"Preprocessed dataset saved to {output_file}")
 
-# Final preprocessed sample
-plt.subplot(3, 1, 3)
-plt.title("After ICA Artifact Removal")
-plt.plot(cleaned_dataset[0, 0])
+# Plot a sample before and after preprocessing for verification
+with report.stage('plot'):
+    plt.figure(figsize=(15, 8))
 
-plt.tight_layout()
-plt.savefig("preprocessing_visualization.png")
-plt.close()
+    # Original sample
+    plt.subplot(3, 1, 1)
+    plt.title("Original Signal (First Sample, First Channel)")
+    plt.plot(dataset[0, 0])
 
-# Save the preprocessed dataset to parquet
-print("\nSaving preprocessed dataset to parquet...")
+    # Filtered sample
+    plt.subplot(3, 1, 2)
+    plt.title("After Filtering")
+    plt.plot(filtered_dataset[0, 0])
 
-# Create a dictionary to hold all data
-data_dict = {'label': labels}
-
-# Pre-create all column names
-column_names = []
-for ch_idx in range(cleaned_dataset[0].shape[0]):
-    for ts_idx in range(cleaned_dataset[0].shape[1]):
-        column_names.append(f'ch{ch_idx}_ts{ts_idx}')
-
-# Initialize empty arrays for each column
-for col in column_names:
-    data_dict[col] = np.zeros(len(cleaned_dataset))
-
-# Fill in the data
-for i in tqdm(range(len(cleaned_dataset)), desc="Flattening data for parquet"):
-    sample = cleaned_dataset[i]
-    
-    # Flatten the sample into columns
-    for ch_idx in range(sample.shape[0]):
-        for ts_idx in range(sample.shape[1]):
-            col_name = f'ch{ch_idx}_ts{ts_idx}'
-            data_dict[col_name][i] = sample[ch_idx, ts_idx]
-
-# Create DataFrame all at once (no fragmentation)
-processed_df = pd.DataFrame(data_dict)
-
-# Add preprocessing metadata
-processed_df['preprocessing'] = 'bandpass_ica'
-processed_df['lowcut'] = lowcut_general
-processed_df['highcut'] = highcut
-
-# Write to parquet
-output_file = "processed_parquet.parquet"
-processed_df.to_parquet(output_file, compression='snappy')
+    # Final preprocessed sample
+    plt.subplot(3, 1, 3)
+    plt.title("After ICA Artifact Removal")
+    plt.plot(cleaned_dataset[0, 0])
+
+    plt.tight_layout()
+    plt.savefig("preprocessing_visualization.png")
+    plt.close()
 
-print(f"Preprocessed dataset saved to {output_file}")
 print("\nPreprocessing complete! Visualization saved to preprocessing_visualization.png")
\ No newline at end of file
@@ -0,0 +1,289 @@
+# Per-stage timing, throughput, memory and I/O instrumentation with JSON run reports
+import argparse
+import cProfile
+import io
+import json
+import multiprocessing as mp
+import os
+import platform
+import pstats
+import resource
+import shutil
+import signal
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+DEFAULT_REPORT_DIR = "run_reports"
+PROFILERS = ('cprofile', 'py-spy')
+
+
+def reset_peak_rss():
+    """Reset this process's peak RSS (Linux only); returns whether it worked."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """Peak RSS since the last reset (Linux), else since the process started."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_child(target, args):
+    """
+    Run target(*args, queue) in a fresh spawned process and return what it put
+    on the queue, so peak RSS measured inside belongs to that step only.
+    """
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=target, args=args + (queue,))
+    proc.start()
+    proc.join()
+    if proc.exitcode != 0:
+        raise RuntimeError(f"{target.__name__} exited with code {proc.exitcode}")
+    return queue.get()
+
+
+def _io_counters():
+    """Bytes this process read and wrote through syscalls and from/to storage, where the OS reports them."""
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+    except OSError:
+        return None
+    return {
+        'read_syscall_bytes': int(fields['rchar']),
+        'written_syscall_bytes': int(fields['wchar']),
+        'read_storage_bytes': int(fields['read_bytes']),
+        'written_storage_bytes': int(fields['write_bytes']),
+    }
+
+
+def _snapshot():
+    times = os.times()
+    return {
+        'wall': time.perf_counter(),
+        'cpu': times.user + times.system,
+        'children_cpu': times.children_user + times.children_system,
+        'io': _io_counters(),
+    }
+
+
+class RunReport:
+    """
+    Collects per-stage measurements for one run and writes them as JSON.
+
+    Wrap each stage in `with report.stage(name, samples=...) as record:` to
+    record its wall time, CPU time (own and of worker processes it waited
+    for), samples per second, peak RSS and bytes read and written. Callers set
+    the logical bytes (input file size, array bytes) and any extra fields on
+    record inside the block; OS-level I/O counters are added where available.
+    One stage can be profiled with cProfile or py-spy (sampling).
+    """
+
+    def __init__(self, name, report_dir=DEFAULT_REPORT_DIR, params=None, profile_stage=None,
+                 profiler='cprofile'):
+        if profiler not in PROFILERS:
+            raise ValueError(f"Unknown profiler {profiler!r}; expected one of {PROFILERS}")
+        self.name = name
+        self.report_dir = report_dir
+        self.params = dict(params or {})
+        self.profile_stage = profile_stage
+        self.profiler = profiler
+        self.stages = []
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._run_id = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))
+
+    def _profile_path(self, stage, suffix):
+        os.makedirs(self.report_dir, exist_ok=True)
+        return os.path.join(self.report_dir, f"{self.name}_{self._run_id}_{stage}.{suffix}")
+
+    @contextmanager
+    def _profile(self, stage, record):
+        if stage != self.profile_stage:
+            yield
+            return
+        if self.profiler == 'cprofile':
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                path = self._profile_path(stage, "prof")
+                profile.dump_stats(path)
+                summary = io.StringIO()
+                pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(25)
+                with open(self._profile_path(stage, "txt"), "w") as f:
+                    f.write(summary.getvalue())
+                record['profile'] = path
+            return
+
+        if shutil.which("py-spy") is None:
+            raise RuntimeError("py-spy is not installed (pip install py-spy)")
+        path = self._profile_path(stage, "speedscope.json")
+        spy = subprocess.Popen(["py-spy", "record", "--pid", str(os.getpid()), "--subprocesses",
+                                "--format", "speedscope", "--output", path],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            yield
+        finally:
+            spy.send_signal(signal.SIGINT)
+            spy.wait()
+            record['profile'] = path
+
+    @contextmanager
+    def stage(self, name, samples=None, bytes_read=0, bytes_written=0):
+        """
+        Measure one stage.
+
+        Args:
+            name (str): Stage name
+            samples (int): Samples processed, for samples_per_s
+            bytes_read, bytes_written (int): Logical bytes consumed and produced
+
+        Yields:
+            dict: The stage's record, which the block may update
+        """
+        record = {'name': name, 'samples': samples, 'bytes_read': bytes_read, 'bytes_written': bytes_written}
+        stage_peak = reset_peak_rss()
+        before = _snapshot()
+        try:
+            with self._profile(name, record):
+                yield record
+        except BaseException as e:
+            record['error'] = repr(e)
+            raise
+        finally:
+            after = _snapshot()
+            wall = after['wall'] - before['wall']
+            record.update({
+                'wall_s': wall,
+                'cpu_s': after['cpu'] - before['cpu'],
+                'children_cpu_s': after['children_cpu'] - before['children_cpu'],
+                'samples_per_s': record['samples'] / wall if record['samples'] and wall > 0 else None,
+                'peak_rss_mb': peak_rss_mb(),
+                'peak_rss_scope': 'stage' if stage_peak else 'process',
+                'children_peak_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+            })
+            if before['io'] is not None and after['io'] is not None:
+                record['os_io'] = {key: after['io'][key] - before['io'][key] for key in after['io']}
+            self.stages.append(record)
+            rate = f", {record['samples_per_s']:.0f} samples/s" if record['samples_per_s'] else ""
+            cached = " (cached)" if record.get('cached') else ""
+            print(f"[{self.name}] stage '{name}'{cached}: {wall:.2f} s wall, {record['cpu_s']:.2f} s CPU"
+                  f"{rate}, peak RSS {record['peak_rss_mb']:.0f} MB")
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'run_id': self._run_id,
+            'started': self.started,
+            'wall_s': time.perf_counter() - self._start,
+            'argv': sys.argv,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'params': self.params,
+            'stages': self.stages,
+        }
+
+    def save(self, path=None):
+        """Write the report (default: <report_dir>/<name>_<run id>.json) and return its path."""
+        if path is None:
+            os.makedirs(self.report_dir, exist_ok=True)
+            path = os.path.join(self.report_dir, f"{self.name}_{self._run_id}.json")
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
+        print(f"Run report written to {path}")
+        return path
+
+
+def add_report_arguments(parser):
+    """Add the --report-dir, --profile-stage and --profiler options to a CLI."""
+    parser.add_argument("--report-dir", default=DEFAULT_REPORT_DIR, help="Where to write the JSON run report")
+    parser.add_argument("--profile-stage", default=None, help="Profile this stage")
+    parser.add_argument("--profiler", choices=PROFILERS, default='cprofile')
+
+
+def report_from_args(name, args, params=None):
+    """RunReport configured from the options added by add_report_arguments."""
+    return RunReport(name, args.report_dir, params, args.profile_stage, args.profiler)
+
+
+def compare_reports(baseline, current, tolerance=0.2):
+    """
+    Compare the stages two run reports have in common.
+
+    A stage regresses when its wall time grew, or its peak RSS grew, by more
+    than tolerance (a fraction) over the baseline. Stages served from a cache
+    in one run but not the other are listed but never flagged.
+
+    Returns:
+        list: One dict per common stage with baseline/current values and a regressed flag
+    """
+    base_stages = {s['name']: s for s in baseline['stages']}
+    rows = []
+    for stage in current['stages']:
+        base = base_stages.get(stage['name'])
+        if base is None:
+            continue
+        wall_ratio = stage['wall_s'] / base['wall_s'] if base['wall_s'] > 0 else float('inf')
+        rss_ratio = stage['peak_rss_mb'] / base['peak_rss_mb'] if base['peak_rss_mb'] > 0 else float('inf')
+        rows.append({
+            'stage': stage['name'],
+            'baseline_wall_s': base['wall_s'],
+            'current_wall_s': stage['wall_s'],
+            'wall_ratio': wall_ratio,
+            'baseline_peak_rss_mb': base['peak_rss_mb'],
+            'current_peak_rss_mb': stage['peak_rss_mb'],
+            'rss_ratio': rss_ratio,
+            'cache_differs': bool(base.get('cached')) != bool(stage.get('cached')),
+        })
+        rows[-1]['regressed'] = not rows[-1]['cache_differs'] and (wall_ratio > 1 + tolerance
+                                                                   or rss_ratio > 1 + tolerance)
+    return rows
+
+
+def format_comparison(rows):
+    header = f"{'stage':<12} {'base s':>9} {'now s':>9} {'ratio':>7} {'base MB':>9} {'now MB':>9} {'ratio':>7}"
+    lines = [header, "-" * len(header)]
+    for r in rows:
+        flag = "  REGRESSED" if r['regressed'] else "  (cache state differs)" if r['cache_differs'] else ""
+        lines.append(f"{r['stage']:<12} {r['baseline_wall_s']:>9.2f} {r['current_wall_s']:>9.2f} "
+                     f"{r['wall_ratio']:>7.2f} {r['baseline_peak_rss_mb']:>9.0f} {r['current_peak_rss_mb']:>9.0f} "
+                     f"{r['rss_ratio']:>7.2f}{flag}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two run reports and flag per-stage regressions")
+    parser.add_argument("baseline", help="Run report JSON of the reference run")
+    parser.add_argument("current", help="Run report JSON of the run to check")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed fractional growth of wall time and peak RSS per stage")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    rows = compare_reports(baseline, current, args.tolerance)
+    print(format_comparison(rows))
+    if any(r['regressed'] for r in rows):
+        sys.exit(1)
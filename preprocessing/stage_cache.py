@@ -0,0 +1,115 @@
+# Per-stage result cache for the preprocessing pipeline
+import os
+import time
+
+import numpy as np
+
+from artifact_cache import ArtifactCache, copy_file, make_key
+from tensor_store import DATA_NAME, INDEX_NAME, LABELS_NAME, TensorStore, is_store
+
+# Bump when a stage's output format or semantics change, to invalidate old entries
+STAGE_CACHE_VERSION = 2
+
+
+class StageCache:
+    """
+    Content-addressed cache for a chain of pipeline stages.
+
+    Each stage's key combines the key of the stage before it with the stage's
+    own parameters, so a key changes whenever anything upstream changes. A run
+    therefore reuses every stage up to the first one whose inputs or
+    parameters changed and recomputes from there. Array stages are stored as
+    TensorStores and reopened memory-mapped; entries share the ArtifactCache
+    size limit and are evicted least recently used first.
+    """
+
+    def __init__(self, cache_dir=".preprocess_cache", max_bytes=50 * 1024 ** 3):
+        self.cache = ArtifactCache(cache_dir, max_bytes)
+        # Stage name -> whether its last run was served from the cache
+        self.hits = {}
+
+    def source_key(self, path):
+        """Content fingerprint of an input parquet file or TensorStore directory."""
+        if is_store(path):
+            parts = {name: self.cache.file_fingerprint(os.path.join(path, name))
+                     for name in (INDEX_NAME, DATA_NAME, LABELS_NAME)}
+        else:
+            parts = {'file': self.cache.file_fingerprint(path)}
+        return make_key(source=parts, version=STAGE_CACHE_VERSION)
+
+    def _stage_key(self, name, upstream, params):
+        return make_key(stage=name, upstream=upstream, params=params, version=STAGE_CACHE_VERSION)
+
+    def _run(self, name, upstream, params, build):
+        """Return the key of a stage, building its entry with build(staging_dir) on a miss."""
+        key = self._stage_key(name, upstream, params)
+        manifest = self.cache.lookup(key)
+        self.hits[name] = manifest is not None
+        if manifest is not None:
+            built = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(manifest['created']))
+            print(f"Stage '{name}': reusing cached result {key[:12]} (built {built}, params {params})")
+            return key
+
+        print(f"Stage '{name}': computing with params {params}")
+        staging = self.cache.staging_dir()
+        try:
+            build(staging)
+            self.cache.commit(key, staging, {'stage': name, 'upstream': upstream, 'params': params})
+        except BaseException:
+            self.cache.discard(staging)
+            raise
+        return key
+
+    def array_stage(self, name, upstream, params, build):
+        """
+        Cached stage whose result is a TensorStore.
+
+        Args:
+            name (str): Stage name
+            upstream (str): Key of the previous stage (or source_key)
+            params (dict): JSON-serializable parameters that affect the result
+            build (callable): build(staging_dir) writes a TensorStore into staging_dir
+
+        Returns:
+            tuple: (stage key, TensorStore opened read-only)
+        """
+        key = self._run(name, upstream, params, build)
+        return key, TensorStore(self.cache.entry_dir(key))
+
+    def transform_stage(self, name, upstream, params, dataset, labels, transform, dtype=None):
+        """
+        Cached stage mapping an (N, C, T) dataset to a new one of the same shape.
+
+        Args:
+            dataset, labels: Stage input
+            transform (callable): transform(dataset, out) fills the memory-mapped out array
+            dtype: Output dtype (default: dataset's dtype)
+
+        See array_stage for the other arguments and the return value.
+        """
+        def build(staging):
+            store = TensorStore.create(staging, *dataset.shape,
+                                       dtype=dtype or dataset.dtype,
+                                       label_dtype=np.asarray(labels).dtype, attrs={'stage': name, 'params': params})
+            transform(dataset, store.data)
+            store.labels[:] = labels
+            store.flush()
+
+        return self.array_stage(name, upstream, params, build)
+
+    def file_stage(self, name, upstream, params, output_path, build):
+        """
+        Cached stage producing a single file, copied to output_path so later
+        writes to output_path never reach the cache entry.
+
+        Args:
+            output_path (str): Where the stage's file should end up
+            build (callable): build(path) writes the file to path
+
+        Returns:
+            str: The stage key
+        """
+        filename = os.path.basename(output_path)
+        key = self._run(name, upstream, params, lambda staging: build(os.path.join(staging, filename)))
+        copy_file(os.path.join(self.cache.entry_dir(key), filename), output_path)
+        return key
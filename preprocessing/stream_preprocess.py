@@ -0,0 +1,232 @@
+# Out-of-core preprocessing: parquet row groups in, processed row groups appended to the output
+import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from tqdm import tqdm
+
+from artifact_removal import _limit_worker_threads
+from checkpoint import ChunkCheckpoint, source_fingerprint
+from pipeline import PreprocessingPipeline
+from run_report import add_report_arguments, report_from_args
+from tensor_parquet import to_tensor_table
+from tensor_store import batch_decoder
+
+# Epochs processed (and held in memory) per task; matches the numpy ICA chunk size
+DEFAULT_BATCH_SIZE = 512
+
+
+def preprocessed_attrs(pipeline):
+    """Attributes stored with preprocessed parquet files."""
+    c = pipeline.config
+    return {
+        'preprocessing': 'bandpass_ica',
+        'sampling_rate': c['sampling_rate'],
+        'lowcut': c['lowcut'],
+        'highcut': c['highcut'],
+        'filter_order': c['filter_order'],
+        'lowcut_ica': c['lowcut_ica'],
+        'channel_names': list(c['channel_names']),
+        'pipeline': c,
+    }
+
+
+def iter_batches(parquet_file, batch_size=DEFAULT_BATCH_SIZE, skip=None):
+    """
+    Yield decoded (start, dataset, labels) batches, reading one row group at a time.
+
+    Only the current row group is held in memory; it is cut into batches of at
+    most batch_size rows before decoding. Batches for which skip(start, stop)
+    is true are not decoded, and row groups made only of them are not read.
+    """
+    pf = pq.ParquetFile(parquet_file)
+    schema = pf.schema_arrow
+    decode = batch_decoder(schema)
+    if decode is None:
+        raise ValueError(f"{parquet_file} uses a layout that cannot be read in row groups; "
+                         "convert it with convert_pkl_to_parquet.py first")
+    group_start = 0
+    for i in range(pf.num_row_groups):
+        n_group = pf.metadata.row_group(i).num_rows
+        starts = range(group_start, group_start + n_group, batch_size)
+        wanted = [start for start in starts
+                  if skip is None or not skip(start, min(start + batch_size, group_start + n_group))]
+        if wanted:
+            table = pf.read_row_group(i)
+            for start in wanted:
+                batch = table.slice(start - group_start, batch_size)
+                decoded = decode(batch.combine_chunks())
+                if decoded is None:
+                    raise ValueError(f"{parquet_file} has ragged samples in row group {i}")
+                yield (start, *decoded)
+        group_start += n_group
+
+
+def process_batch(pipeline, dataset, labels):
+    """
+    Run every pipeline step on one batch.
+
+    As in preprocess_data, a batch whose ICA fails keeps its filtered data.
+
+    Returns:
+        tuple: (processed batch, labels, per-epoch number of removed components)
+    """
+    out = pipeline.filter(dataset)
+    try:
+        out, n_removed = pipeline.remove_artifacts(out)
+    except Exception as e:
+        print(f"ICA failed on a batch of {len(out)} epochs with error: {e}; keeping the filtered data")
+        n_removed = np.zeros(len(out), dtype=np.int64)
+    if pipeline.config['normalize']:
+        out = pipeline.normalize(out)
+    return out, labels, n_removed
+
+
+def _ordered_results(pipeline, batches, n_workers, blas_threads):
+    """
+    Yield (start, process_batch result) in input order, keeping at most two
+    batches per worker in flight so memory does not grow with the dataset.
+    """
+    if n_workers == 1:
+        for start, dataset, labels in batches:
+            yield start, process_batch(pipeline, dataset, labels)
+        return
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_limit_worker_threads,
+                             initargs=(blas_threads, pipeline.config['ica_backend'])) as pool:
+        pending = deque()
+        for start, dataset, labels in batches:
+            pending.append((start, pool.submit(process_batch, pipeline, dataset, labels)))
+            if len(pending) >= 2 * n_workers:
+                start, future = pending.popleft()
+                yield start, future.result()
+        while pending:
+            start, future = pending.popleft()
+            yield start, future.result()
+
+
+def stream_preprocess(input_file, output_file, pipeline, attrs=None, batch_size=DEFAULT_BATCH_SIZE,
+                      n_workers=None, blas_threads=1, compression='snappy', checkpoint_dir=None,
+                      keep_checkpoint=False):
+    """
+    Preprocess a parquet dataset without ever holding all of it in memory.
+
+    Row groups are read one at a time and cut into batches; each batch is
+    filtered, cleaned and (if configured) normalized, then appended to the
+    output as its own row group. Peak memory depends on the input row group
+    size, batch_size and n_workers, not on the number of samples. Rows keep
+    the input order (write_tensor_parquet sorts by label instead). The output
+    is written to a temporary file and renamed when complete, so an
+    interrupted run never leaves a truncated file behind.
+
+    With checkpoint_dir, every finished batch is saved there first (see
+    ChunkCheckpoint). Rerunning with the same input and settings skips the
+    batches already done, and the output is assembled from the saved chunks.
+
+    Args:
+        input_file (str): Raw parquet dataset (blob, delta or tensor layout)
+        output_file (str): Tensor-column parquet file to write
+        pipeline (PreprocessingPipeline): Steps to run
+        attrs (dict): File attributes (default: preprocessed_attrs(pipeline))
+        batch_size (int): Epochs per batch and output row group
+        n_workers (int): Worker processes (default: all cores; 1 runs serially)
+        blas_threads (int): BLAS/OpenMP threads per worker
+        compression (str): Parquet codec
+        checkpoint_dir (str): Directory for resumable chunk checkpoints
+        keep_checkpoint (bool): Keep the chunks after the output is assembled
+
+    Returns:
+        dict: samples, computed (samples not taken from a checkpoint), epochs_with_artifacts,
+            seconds and samples_per_s
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    attrs = preprocessed_attrs(pipeline) if attrs is None else attrs
+    n_rows = pq.ParquetFile(input_file).metadata.num_rows
+    if n_rows == 0:
+        raise ValueError(f"{input_file} has no rows")
+    partial = output_file + ".partial"
+
+    checkpoint = None
+    if checkpoint_dir is not None:
+        checkpoint = ChunkCheckpoint(checkpoint_dir, {
+            'source': source_fingerprint(input_file),
+            'pipeline': pipeline.config,
+            'attrs': attrs,
+            'batch_size': batch_size,
+        })
+
+    writer = None
+    n_written = 0
+    n_with_artifacts = 0
+    if checkpoint is not None:
+        n_written = checkpoint.rows_done(checkpoint.manifest)
+        n_with_artifacts = sum(c['with_artifacts'] for c in checkpoint.chunks)
+    n_computed = 0
+    skip = checkpoint.is_done if checkpoint is not None else None
+    start_time = time.perf_counter()
+    try:
+        with tqdm(total=n_rows, initial=n_written, desc="Streaming preprocessing", unit="samples") as progress:
+            batches = iter_batches(input_file, batch_size, skip)
+            for start, (processed, labels, n_removed) in _ordered_results(pipeline, batches, n_workers,
+                                                                          blas_threads):
+                table = to_tensor_table(processed, labels, attrs)
+                with_artifacts = int((n_removed > 0).sum())
+                if checkpoint is not None:
+                    checkpoint.save(start, start + len(processed), table, with_artifacts=with_artifacts)
+                else:
+                    if writer is None:
+                        writer = pq.ParquetWriter(partial, table.schema, compression=compression,
+                                                  write_statistics=True)
+                    writer.write_table(table, row_group_size=len(processed))
+                n_written += len(processed)
+                n_computed += len(processed)
+                n_with_artifacts += with_artifacts
+                progress.update(len(processed))
+                progress.set_postfix(with_artifacts=n_with_artifacts)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if checkpoint is not None:
+        checkpoint.assemble(output_file, n_rows, compression)
+        if not keep_checkpoint:
+            checkpoint.clear()
+    else:
+        os.replace(partial, output_file)
+
+    seconds = time.perf_counter() - start_time
+    rate = n_computed / seconds if seconds > 0 else 0.0
+    print(f"Preprocessed {n_written} samples ({n_computed} computed in this run) in {seconds:.2f} s "
+          f"({rate:.0f} samples/s), removed artifact components from {n_with_artifacts}")
+    return {'samples': n_written, 'computed': n_computed, 'epochs_with_artifacts': n_with_artifacts,
+            'seconds': seconds, 'samples_per_s': rate}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Preprocess a parquet EEG dataset one row group at a time")
+    parser.add_argument("input", help="Raw parquet dataset")
+    parser.add_argument("output", help="Preprocessed tensor-column parquet file")
+    parser.add_argument("--config", help="JSON pipeline config (default: the training settings)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--blas-threads", type=int, default=1)
+    parser.add_argument("--compression", default="snappy")
+    parser.add_argument("--checkpoint-dir", default=None,
+                        help="Save finished batches here so an interrupted run can resume")
+    parser.add_argument("--keep-checkpoint", action="store_true")
+    add_report_arguments(parser)
+    args = parser.parse_args()
+
+    pipeline = PreprocessingPipeline.from_file(args.config) if args.config else PreprocessingPipeline()
+    report = report_from_args("stream_preprocess", args, {**vars(args), 'pipeline': pipeline.config})
+    with report.stage('stream', bytes_read=os.path.getsize(args.input)) as record:
+        stats = stream_preprocess(args.input, args.output, pipeline, batch_size=args.batch_size,
+                                  n_workers=args.workers, blas_threads=args.blas_threads,
+                                  compression=args.compression, checkpoint_dir=args.checkpoint_dir,
+                                  keep_checkpoint=args.keep_checkpoint)
+        record.update(samples=stats['computed'], bytes_written=os.path.getsize(args.output))
+    report.save()
@@ -0,0 +1,131 @@
+# Tensor-column parquet layout: one fixed-size list column holding each (C, T) sample
+import json
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import label_partition
+
+METADATA_KEY = b"eeg_tensor"
+TENSOR_COLUMN = "eeg"
+
+
+def to_tensor_table(dataset, labels, attrs=None):
+    """
+    Build an Arrow table with one fixed-size list column of C * T values per row.
+
+    The (C, T) shape, dtype and any attributes (sampling rate, filter settings,
+    ...) are stored in the schema metadata instead of as per-row columns.
+
+    Args:
+        dataset (np.ndarray): Array of shape (N, C, T)
+        labels (np.ndarray): Array of shape (N,)
+        attrs (dict): JSON-serializable attributes to store with the file
+
+    Returns:
+        pa.Table: Table with 'label' and 'eeg' columns
+    """
+    dataset = np.ascontiguousarray(dataset)
+    n_samples, n_channels, n_times = dataset.shape
+    values = pa.array(dataset.reshape(-1))
+    table = pa.table({
+        'label': pa.array(np.asarray(labels)),
+        TENSOR_COLUMN: pa.FixedSizeListArray.from_arrays(values, n_channels * n_times),
+    })
+    metadata = {
+        'shape': [n_channels, n_times],
+        'dtype': dataset.dtype.name,
+        'attrs': attrs or {},
+    }
+    return table.replace_schema_metadata({METADATA_KEY: json.dumps(metadata).encode()})
+
+
+def is_tensor_table(schema):
+    """Whether a parquet/Arrow schema was written by to_tensor_table."""
+    return schema.metadata is not None and METADATA_KEY in schema.metadata
+
+
+def tensor_metadata(schema):
+    """Decode the shape/dtype/attrs metadata stored by to_tensor_table."""
+    return json.loads(schema.metadata[METADATA_KEY])
+
+
+def from_tensor_table(table):
+    """
+    Decode a table written by to_tensor_table.
+
+    Single-chunk columns come back as zero-copy views of the Arrow buffers.
+
+    Returns:
+        tuple: (dataset, labels) as numpy arrays
+    """
+    meta = tensor_metadata(table.schema)
+    column = table.column(TENSOR_COLUMN)
+    if column.num_chunks == 1:
+        column = column.chunk(0)
+    else:
+        column = column.combine_chunks()
+    values = column.flatten().to_numpy(zero_copy_only=False)
+    dataset = values.reshape(table.num_rows, *meta['shape'])
+    labels = table.column('label').to_numpy()
+    return dataset, labels
+
+
+def wide_column_names(column_names):
+    """
+    Channel/timestep columns of a legacy wide file, in (channel, timestep)
+    order, plus the detected number of channels and timesteps.
+    """
+    names = [col for col in column_names if col.startswith('ch') and '_ts' in col]
+    n_channels = len({col.split('_')[0] for col in names})
+    n_times = len({col.split('_')[1] for col in names})
+    ordered = [f'ch{ch_idx}_ts{ts_idx}' for ch_idx in range(n_channels) for ts_idx in range(n_times)]
+    return ordered, n_channels, n_times
+
+
+def from_wide_table(table):
+    """
+    Decode a legacy wide table with one column per channel and timestep.
+
+    Returns:
+        tuple: (dataset, labels, extra) where extra holds the remaining
+        per-row metadata columns
+    """
+    ordered, n_channels, n_times = wide_column_names(table.column_names)
+    flat = np.empty((table.num_rows, len(ordered)))
+    for i, name in enumerate(ordered):
+        flat[:, i] = table.column(name).to_numpy()
+    dataset = flat.reshape(table.num_rows, n_channels, n_times)
+    labels = table.column('label').to_numpy()
+    wide = set(ordered)
+    extra = {col: table.column(col).to_numpy(zero_copy_only=False)
+             for col in table.column_names if col not in wide and col != 'label'}
+    return dataset, labels, extra
+
+
+def write_tensor_parquet(path, dataset, labels, attrs=None, compression='zstd', compression_level=None,
+                         row_group_size=label_partition.DEFAULT_ROW_GROUP_SIZE):
+    """Write a dataset in the tensor-column layout, sorted by label."""
+    label_partition.write_label_sorted(
+        path, dataset, labels, lambda d, l: to_tensor_table(d, l, attrs),
+        row_group_size=row_group_size, compression=compression, compression_level=compression_level)
+
+
+def read_tensor_parquet(path, labels=None):
+    """
+    Read a preprocessed parquet file in either the tensor-column or the legacy
+    wide layout, optionally keeping only some labels.
+
+    Returns:
+        tuple: (dataset, labels, attrs). For wide files, attrs holds the
+        first value of each per-row metadata column (preprocessing, lowcut, ...)
+    """
+    table = label_partition.read_table(path, labels=labels)
+    if is_tensor_table(table.schema):
+        dataset, labels = from_tensor_table(table)
+        return dataset, labels, tensor_metadata(table.schema)['attrs']
+
+    dataset, labels, extra = from_wide_table(table)
+    attrs = {col: values[0].item() if hasattr(values[0], 'item') else values[0]
+             for col, values in extra.items() if len(values)}
+    return dataset, labels, attrs
@@ -0,0 +1,270 @@
+# Memory-mapped on-disk store for (N, C, T) EEG tensors with labels and metadata
+import argparse
+import json
+import os
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from tqdm import tqdm
+
+from dtype_policy import resolve_dtype
+from run_report import add_report_arguments, report_from_args
+
+try:
+    import torch
+    from torch.utils.data import Dataset
+except ImportError:  # torch is only needed for EEGTensorDataset
+    torch = None
+    Dataset = object
+
+STORE_VERSION = 1
+INDEX_NAME = "index.json"
+DATA_NAME = "data.npy"
+LABELS_NAME = "labels.npy"
+
+
+def is_store(path):
+    """Whether path is a directory written by TensorStore."""
+    return os.path.isfile(os.path.join(path, INDEX_NAME))
+
+
+class TensorStore:
+    """
+    Directory holding a memory-mapped (N, C, T) float array, an (N,) label
+    array and optional per-sample metadata arrays, described by index.json.
+
+    Every array is a plain .npy file, so samples and slices are read straight
+    from the page cache with O(1) indexing and without unpickling, and several
+    processes opening the same store share the same pages.
+    """
+
+    def __init__(self, path, mode='r'):
+        self.path = path
+        with open(os.path.join(path, INDEX_NAME)) as f:
+            self.index = json.load(f)
+        self.data = np.load(os.path.join(path, DATA_NAME), mmap_mode=mode, allow_pickle=False)
+        self.labels = np.load(os.path.join(path, LABELS_NAME), mmap_mode=mode, allow_pickle=False)
+        self.meta = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode, allow_pickle=False)
+            for name in self.index['arrays']
+        }
+
+    @classmethod
+    def create(cls, path, n_samples, n_channels, n_times, dtype=None, label_dtype=np.int64,
+               channel_names=None, arrays=None, attrs=None):
+        """
+        Preallocate a new store on disk and open it for writing.
+
+        Args:
+            path (str): Store directory (created if needed)
+            n_samples, n_channels, n_times (int): Shape of the data array
+            dtype: Floating point dtype of the data array (default: the dtype policy)
+            label_dtype: Dtype of the labels array
+            channel_names (list): Optional channel names, in array order
+            arrays (dict): Extra per-sample arrays to allocate (name -> dtype)
+            attrs (dict): JSON-serializable attributes (sampling rate, source, ...)
+
+        Returns:
+            TensorStore: Store opened in 'r+' mode, zero-filled
+        """
+        os.makedirs(path, exist_ok=True)
+        dtype = resolve_dtype(dtype)
+        shape = (n_samples, n_channels, n_times)
+        np.lib.format.open_memmap(os.path.join(path, DATA_NAME), mode='w+', dtype=dtype, shape=shape).flush()
+        np.lib.format.open_memmap(
+            os.path.join(path, LABELS_NAME), mode='w+', dtype=label_dtype, shape=(n_samples,)).flush()
+        for name, array_dtype in (arrays or {}).items():
+            np.lib.format.open_memmap(
+                os.path.join(path, f"{name}.npy"), mode='w+', dtype=array_dtype, shape=(n_samples,)).flush()
+
+        index = {
+            'version': STORE_VERSION,
+            'shape': list(shape),
+            'dtype': np.dtype(dtype).name,
+            'channel_names': list(channel_names) if channel_names is not None else None,
+            'arrays': sorted(arrays or {}),
+            'attrs': attrs or {},
+        }
+        with open(os.path.join(path, INDEX_NAME), "w") as f:
+            json.dump(index, f, indent=2)
+        return cls(path, mode='r+')
+
+    @classmethod
+    def from_arrays(cls, path, dataset, labels, chunk_size=4096, **kwargs):
+        """Write in-memory (or memory-mapped) arrays to a new store in chunks."""
+        store = cls.create(path, *dataset.shape, dtype=dataset.dtype, label_dtype=np.asarray(labels).dtype,
+                           **kwargs)
+        for start in range(0, len(dataset), chunk_size):
+            store.data[start:start + chunk_size] = dataset[start:start + chunk_size]
+        store.labels[:] = labels
+        store.flush()
+        return store
+
+    def flush(self):
+        for array in [self.data, self.labels, *self.meta.values()]:
+            if isinstance(array, np.memmap):
+                array.flush()
+
+    @property
+    def shape(self):
+        return tuple(self.index['shape'])
+
+    @property
+    def attrs(self):
+        return self.index['attrs']
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, idx):
+        """(data, label) for an index, slice or index array."""
+        return self.data[idx], self.labels[idx]
+
+
+def open_dataset(path, labels=None):
+    """
+    Open a dataset for reading: memory-mapped if path is a TensorStore,
+    otherwise decoded from parquet with convert_parquet_to_np.
+
+    Args:
+        path (str): TensorStore directory or parquet file
+        labels (list): Only return samples with these labels
+
+    Returns:
+        tuple: (dataset, labels)
+    """
+    if is_store(path):
+        store = TensorStore(path)
+        if labels is None:
+            return store.data, store.labels
+        keep = np.flatnonzero(np.isin(store.labels, labels))
+        return store.data[keep], store.labels[keep]
+    from convert_parquet_to_np import convert_parquet_to_np
+    return convert_parquet_to_np(path, labels=labels)
+
+
+def batch_decoder(schema):
+    """
+    Function decoding one record batch (as a pa.Table) of a parquet file to
+    (dataset, labels), or None for layouts that can only be decoded whole.
+    """
+    # Local imports keep tensor_store importable without the converters
+    import delta_codec
+    import tensor_parquet
+    from convert_parquet_to_np import load_binary_blobs
+
+    if delta_codec.is_delta_table(schema):
+        return delta_codec.from_arrow_table
+    if tensor_parquet.is_tensor_table(schema):
+        return tensor_parquet.from_tensor_table
+    if 'data' in schema.names:
+        return load_binary_blobs
+    return None
+
+
+def parquet_to_store(parquet_file, store_dir, batch_size=4096, dtype=None):
+    """
+    Convert a parquet dataset into a TensorStore, one record batch at a time.
+
+    The binary blob, integer delta and tensor column formats are decoded batch
+    by batch, so memory stays bounded; other layouts are decoded in one go.
+    Data is stored as dtype (default: the dtype policy) whatever the file holds.
+
+    Returns:
+        TensorStore: The new store, opened read-only
+    """
+    import tensor_parquet
+    from convert_parquet_to_np import convert_parquet_to_np
+
+    pf = pq.ParquetFile(parquet_file)
+    schema = pf.schema_arrow
+    dtype = resolve_dtype(dtype)
+    decode = batch_decoder(schema)
+    if decode is None:
+        dataset, labels = convert_parquet_to_np(parquet_file, dtype=dtype)
+        TensorStore.from_arrays(store_dir, dataset, labels, attrs={'source': os.path.abspath(parquet_file)})
+        return TensorStore(store_dir)
+
+    attrs = {'source': os.path.abspath(parquet_file)}
+    if tensor_parquet.is_tensor_table(schema):
+        attrs.update(tensor_parquet.tensor_metadata(schema)['attrs'])
+
+    store = None
+    position = 0
+    n_rows = pf.metadata.num_rows
+    with tqdm(total=n_rows, desc="Writing tensor store") as progress:
+        for batch in pf.iter_batches(batch_size=batch_size):
+            decoded = decode(pa.Table.from_batches([batch], schema=schema))
+            if decoded is None:
+                raise ValueError(f"{parquet_file} has ragged samples and cannot be stored as one tensor")
+            dataset, labels = decoded
+            if store is None:
+                store = TensorStore.create(store_dir, n_rows, dataset.shape[1], dataset.shape[2],
+                                           dtype=dtype, label_dtype=labels.dtype, attrs=attrs)
+            store.data[position:position + len(dataset)] = dataset
+            store.labels[position:position + len(dataset)] = labels
+            position += len(dataset)
+            progress.update(len(dataset))
+
+    if store is None:
+        raise ValueError(f"{parquet_file} has no rows")
+    store.flush()
+    return TensorStore(store_dir)
+
+
+class EEGTensorDataset(Dataset):
+    """
+    PyTorch Dataset over a TensorStore.
+
+    The store is opened lazily in each process, so DataLoader workers map the
+    same files (and share page-cache pages) rather than receiving pickled
+    copies of the arrays.
+    """
+
+    def __init__(self, path, indices=None, dtype=None, transform=None):
+        if torch is None:
+            raise ImportError("EEGTensorDataset requires torch")
+        self.path = path
+        self.indices = None if indices is None else np.asarray(indices)
+        self.dtype = resolve_dtype(dtype)
+        self.transform = transform
+        self._store = None
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = TensorStore(self.path)
+        return self._store
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_store'] = None
+        return state
+
+    def __len__(self):
+        return len(self.store) if self.indices is None else len(self.indices)
+
+    def __getitem__(self, idx):
+        if self.indices is not None:
+            idx = self.indices[idx]
+        x = np.array(self.store.data[idx], dtype=self.dtype)
+        if self.transform is not None:
+            x = self.transform(x)
+        return torch.from_numpy(x), int(self.store.labels[idx])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a parquet EEG dataset to a memory-mapped tensor store")
+    parser.add_argument("parquet_file")
+    parser.add_argument("store_dir")
+    parser.add_argument("--batch-size", type=int, default=4096)
+    parser.add_argument("--dtype", default=None, help="Stored data dtype (default: the dtype policy)")
+    add_report_arguments(parser)
+    args = parser.parse_args()
+
+    report = report_from_args("parquet_to_store", args, vars(args))
+    with report.stage('convert', bytes_read=os.path.getsize(args.parquet_file)) as record:
+        store = parquet_to_store(args.parquet_file, args.store_dir, args.batch_size, args.dtype)
+        record.update(samples=len(store), bytes_written=store.data.nbytes)
+    report.save()
+    print(f"Tensor store written to {args.store_dir} with shape {store.shape}")
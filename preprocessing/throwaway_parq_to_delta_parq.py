@@ -1,93 +1,45 @@
 # new file to convert parquet to delta parquet
-import pandas as pd
 import numpy as np
 import os
 import pyarrow as pa
 import pyarrow.parquet as pq
-from tqdm import tqdm
 
-def convert_flattened_to_delta_parquet(input_parquet, output_parquet="eeg_dataset_delta.parquet"):
+import delta_codec
+from label_partition import write_label_sorted
+from tensor_parquet import read_tensor_parquet
+
+def convert_flattened_to_delta_parquet(input_parquet, output_parquet="eeg_dataset_delta.parquet",
+                                       scale=delta_codec.DEFAULT_SCALE):
     """
-    Convert a flattened columnar parquet file to delta-encoded parquet format.
+    Convert a preprocessed parquet file to delta-encoded parquet format.
     
     Args:
-        input_parquet (str): Path to the input parquet file (flattened format)
+        input_parquet (str): Path to the input parquet file (tensor-column or flattened format)
         output_parquet (str): Path to save the delta-encoded parquet file
+        scale (float): Fixed-point scale for the delta codec
     """
     print(f"Converting {input_parquet} to delta-encoded format...")
     
-    # Read the input parquet file
+    # Read the input parquet file (tensor-column or legacy wide layout)
     try:
-        df = pd.read_parquet(input_parquet)
-        print(f"Successfully loaded parquet with {len(df)} rows")
-        print(f"Number of columns: {len(df.columns)}")
+        dataset, labels, attrs = read_tensor_parquet(input_parquet)
+        print(f"Successfully loaded parquet with {len(dataset)} rows")
     except Exception as e:
         print(f"Error reading parquet file: {e}")
         return
     
-    # Extract labels
-    labels = df['label'].values
-    
-    # Determine the structure of the data
-    channel_cols = [col for col in df.columns if col.startswith('ch') and '_ts' in col]
-    
-    # Find the number of channels and time points
-    ch_pattern = set()
-    ts_pattern = set()
-    
-    for col in channel_cols:
-        parts = col.split('_')
-        ch_pattern.add(parts[0])
-        ts_pattern.add(parts[1])
-    
-    n_channels = len(ch_pattern)
-    n_timepoints = len(ts_pattern)
-    
+    n_channels, n_timepoints = dataset.shape[1:]
     print(f"Detected {n_channels} channels and {n_timepoints} time points")
     
-    # Reconstruct the original 3D dataset
-    print("Reconstructing original dataset...")
-    dataset = np.zeros((len(df), n_channels, n_timepoints))
-    
-    for ch_idx in range(n_channels):
-        for ts_idx in range(n_timepoints):
-            col_name = f'ch{ch_idx}_ts{ts_idx}'
-            if col_name in df.columns:
-                dataset[:, ch_idx, ts_idx] = df[col_name].values
+    # Delta-encode as fixed-point integers in typed list columns, keeping the
+    # preprocessing settings in the file metadata
+    print(f"Max round-trip error: {delta_codec.max_abs_error(scale, float(np.abs(dataset).max()))}")
     
-    # Create a dataframe with delta-encoded values
-    print("Creating delta-encoded dataframe...")
-    delta_df = pd.DataFrame()
-    delta_df['label'] = labels
-    
-    for i in tqdm(range(len(dataset)), desc="Delta encoding"):
-        sample = dataset[i]
-        
-        # For each channel, store the first value and then differences
-        for ch_idx in range(sample.shape[0]):
-            channel_data = sample[ch_idx]
-            
-            # Store first value
-            delta_df.loc[i, f'ch{ch_idx}_start'] = channel_data[0]
-            
-            # Store differences (delta encoding)
-            diffs = np.diff(channel_data)
-            
-            # Quantize differences to reduce unique values (improves compression)
-            # Round to 3 decimal places
-            diffs = np.round(diffs, 3)
-            
-            # Store as comma-separated string (more compressible than separate columns)
-            delta_df.loc[i, f'ch{ch_idx}_deltas'] = ','.join(map(str, diffs))
-    
-    # Copy over any metadata columns
-    metadata_cols = [col for col in df.columns if col not in channel_cols and col != 'label']
-    for col in metadata_cols:
-        delta_df[col] = df[col]
-    
-    # Save delta-encoded version
+    # Save delta-encoded version, sorted by label with one label per row group
     print(f"Saving delta-encoded parquet to {output_parquet}...")
-    delta_df.to_parquet(output_parquet, compression='zstd', compression_level=22)
+    write_label_sorted(output_parquet, dataset, labels,
+                       lambda d, l: delta_codec.to_arrow_table(d, l, scale=scale, attrs=attrs),
+                       compression='zstd', compression_level=22)
     
     # Print file size comparison
     input_size = os.path.getsize(input_parquet) / (1024 * 1024)  # MB
@@ -110,31 +62,6 @@ if __name__ == "__main__":
     print("\nTo load the delta-encoded data:")
     print("""
 # For delta-encoded format:
-import pandas as pd
-import numpy as np
-from tqdm import tqdm
-
-df = pd.read_parquet('eeg_dataset_delta.parquet')
-dataset = []
-ch_count = sum(1 for col in df.columns if col.startswith('ch') and col.endswith('_start'))
-
-for i in tqdm(range(len(df)), desc="Reconstructing samples"):
-    # Get the shape of the first sample's deltas to determine time dimension
-    first_deltas = df.loc[i, 'ch0_deltas'].split(',')
-    time_dim = len(first_deltas) + 1  # +1 because deltas are differences
-    
-    sample = np.zeros((ch_count, time_dim))
-    for ch_idx in range(ch_count):
-        # Get starting value
-        start = df.loc[i, f'ch{ch_idx}_start']
-        # Get deltas and convert back to array
-        deltas = np.array([float(x) for x in df.loc[i, f'ch{ch_idx}_deltas'].split(',')])
-        # Reconstruct the channel data
-        channel_data = np.zeros(len(deltas) + 1)
-        channel_data[0] = start
-        channel_data[1:] = start + np.cumsum(deltas)
-        sample[ch_idx, :] = channel_data
-    dataset.append(sample)
-dataset = np.array(dataset)
-labels = df['label'].values
-""")
\ No newline at end of file
+from convert_parquet_to_np import convert_parquet_to_np
+dataset, labels = convert_parquet_to_np('processed_parquet_delta.parquet')
+""")
@@ -0,0 +1,40 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The backend has its own main.py, so backend tests add website/backend themselves
+for directory in ("preprocessing", "eeg_conformer"):
+    sys.path.insert(0, os.path.join(ROOT, directory))
+
+CHANNELS = ["TP9", "FP1", "FP2", "TP10"]
+
+
+def write_raw_dump(path, n_samples=24, length=300, seed=0, codes=(0, 1, 2)):
+    """
+    Write a small MindBigData-style dump: one line per channel event, every
+    event of a sample the same length.
+
+    Returns:
+        np.ndarray: (n_samples, n_channels, length) raw values, in file order
+    """
+    rng = np.random.default_rng(seed)
+    raw = np.round(rng.normal(500.0, 40.0, size=(n_samples, len(CHANNELS), length)), 3)
+    lines = []
+    for i in range(n_samples):
+        code = codes[i % len(codes)]
+        for ch, name in enumerate(CHANNELS):
+            values = ",".join(f"{v:.3f}" for v in raw[i, ch])
+            lines.append(f"{len(lines)}\t{i}\tMU\t{name}\t{code}\t{length}\t{values}")
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return raw
+
+
+@pytest.fixture
+def raw_dump(tmp_path):
+    path = str(tmp_path / "dump.txt")
+    raw = write_raw_dump(path)
+    return path, raw
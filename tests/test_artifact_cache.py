@@ -0,0 +1,51 @@
+import os
+
+import numpy as np
+
+from artifact_cache import FINGERPRINTS_NAME, MANIFEST_NAME, ArtifactCache
+from conftest import write_raw_dump
+from dataset_loading import cached_write_dataset, write_dataset
+
+
+def _entry_files(cache_dir):
+    files = {}
+    for key in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, key)
+        if key.startswith(".") or not os.path.isdir(entry):
+            continue
+        for name in os.listdir(entry):
+            if name != MANIFEST_NAME:
+                with open(os.path.join(entry, name), "rb") as f:
+                    files[(key, name)] = f.read()
+    return files
+
+
+def test_writes_to_output_dir_leave_cache_intact(tmp_path, raw_dump):
+    path, _ = raw_dump
+    output_dir = str(tmp_path / "eeg_dataset")
+    cache_dir = str(tmp_path / "cache")
+    dataset, labels = cached_write_dataset(path, output_dir, cache_dir=cache_dir, n_workers=1)
+    expected = np.array(dataset)
+    before = _entry_files(cache_dir)
+    assert before
+
+    # A plain rebuild of output_dir from another dump rewrites its files in place
+    other = str(tmp_path / "other.txt")
+    write_raw_dump(other, n_samples=12, seed=1)
+    write_dataset(other, output_dir, n_workers=1)
+
+    assert _entry_files(cache_dir) == before
+    dataset, _ = cached_write_dataset(path, output_dir, cache_dir=cache_dir, n_workers=1)
+    np.testing.assert_array_equal(dataset, expected)
+
+
+def test_truncated_fingerprint_memo_is_rebuilt(tmp_path, raw_dump):
+    path, _ = raw_dump
+    cache = ArtifactCache(str(tmp_path / "cache"))
+    digest = cache.file_fingerprint(path)
+    memo_path = os.path.join(cache.root, FINGERPRINTS_NAME)
+    with open(memo_path, "r+") as f:
+        f.truncate(10)
+    assert cache.file_fingerprint(path) == digest
+    assert ArtifactCache(cache.root).file_fingerprint(path) == digest
+    assert not [name for name in os.listdir(cache.root) if ".tmp-" in name]
@@ -0,0 +1,78 @@
+import importlib.util
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+torch = pytest.importorskip("torch")
+
+from fastapi.testclient import TestClient
+
+from artifact import MODEL_FILES, MODEL_INFO, PIPELINE_CONFIG
+from conftest import ROOT, write_raw_dump
+from dataset_loading import write_dataset
+from pipeline import PreprocessingPipeline
+
+BACKEND = os.path.join(ROOT, "website", "backend")
+N_CHANS, N_TIMES = 4, 612
+
+
+def load_app(monkeypatch, model_dir):
+    """Import the backend app fresh, so its module-level pipeline and model see the environment."""
+    monkeypatch.setenv("EEG_MODEL_DIR", model_dir)
+    monkeypatch.delenv("EEG_PIPELINE_CONFIG", raising=False)
+    monkeypatch.syspath_prepend(BACKEND)
+    for name in list(sys.modules):
+        if name.split(".")[0] in ("models", "routers", "services"):
+            monkeypatch.delitem(sys.modules, name)
+    spec = importlib.util.spec_from_file_location("backend_main", os.path.join(BACKEND, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.app
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    """A small TorchScript artifact in the layout export.py writes."""
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(torch.nn.Flatten(), torch.nn.Linear(N_CHANS * N_TIMES, 3)).eval()
+    with torch.no_grad():
+        traced = torch.jit.trace(model, torch.zeros(1, N_CHANS, N_TIMES))
+    torch.jit.save(traced, str(tmp_path / MODEL_FILES['torchscript']))
+    PreprocessingPipeline().save(str(tmp_path / PIPELINE_CONFIG))
+    with open(tmp_path / MODEL_INFO, "w") as f:
+        json.dump({'format': 'torchscript', 'quantized': False, 'classes': [2, 5, 7], 'n_chans': N_CHANS,
+                   'n_times': N_TIMES, 'sampling_rate': 250}, f)
+    return str(tmp_path)
+
+
+def test_predict_returns_model_prediction(monkeypatch, model_dir):
+    client = TestClient(load_app(monkeypatch, model_dir))
+    window = 400 + np.random.default_rng(0).random((N_CHANS, 700)) * 100
+
+    response = client.post("/inference/predict", json={'channels': window.tolist()})
+
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body['prediction'] in (2, 5, 7)
+    assert 1 / 3 <= body['confidence'] <= 1
+    assert client.get("/prediction").json() == {'predicted_number': body['prediction']}
+
+
+def test_served_windows_match_training_tensors(monkeypatch, model_dir, tmp_path):
+    dump = str(tmp_path / "dump.txt")
+    raw = write_raw_dump(dump, n_samples=6, length=N_TIMES)
+    dataset, labels = write_dataset(dump, str(tmp_path / "eeg_dataset"), n_workers=1)
+    load_app(monkeypatch, model_dir)
+    eeg_processor = sys.modules["services.eeg_processor"]
+    # Training data goes through ingest (z-scored per event), then the dataset path of
+    # the exported pipeline at the serving sampling rate
+    training = eeg_processor.PIPELINE.process_dataset(np.asarray(dataset), n_workers=1)
+
+    for event, expected in zip(raw, training):
+        served = eeg_processor.process_eeg_data(eeg_processor.EEGData(channels=event.tolist()))
+        np.testing.assert_allclose(np.asarray(served["processed_channels"]), expected, rtol=0, atol=1e-5)
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("braindecode")
+
+from benchmark_models import measure_model, recommend
+
+
+def test_measure_model_smoke():
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(torch.nn.Flatten(), torch.nn.Linear(4 * 32, 3))
+    rng = np.random.default_rng(0)
+    windows = rng.normal(size=(20, 4, 32)).astype(np.float32)
+    targets = rng.integers(0, 3, size=20)
+    settings = {'threads': 1, 'inference_batch': 8, 'windows': 5, 'batches': 3}
+
+    result = measure_model(model, windows, targets, settings)
+
+    assert result['params'] == 4 * 32 * 3 + 3
+    assert result['valid_windows'] == 20
+    assert 0.0 <= result['accuracy'] <= 1.0
+    assert result['single_ms']['p50'] > 0
+    assert result['batch_ms'] is not None and result['batch_windows_per_s'] > 0
+    assert recommend([{**result, 'model': 'tiny'}], budget_ms=1e6)['model'] == 'tiny'
@@ -0,0 +1,45 @@
+import numpy as np
+
+import artifact_removal
+from artifact_removal import apply_ica
+from checkpoint import ChunkCheckpoint
+
+
+def _blink_epochs(n_epochs=12, n_times=500, sfreq=250.0, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_times) / sfreq
+    data = rng.normal(0, 1, size=(n_epochs, 4, n_times))
+    data += np.sin(2 * np.pi * 10 * t)
+    blink = np.exp(-((t - 1.0) ** 2) / 0.01) * 8
+    data[::2, 1] += blink
+    data[::2, 2] += blink
+    return data.astype(np.float32)
+
+
+def test_apply_ica_resumes_from_chunk_checkpoint(tmp_path, monkeypatch):
+    data = _blink_epochs()
+    kwargs = dict(sampling_rate=250.0, n_workers=1, chunk_size=4, threshold=1.3)
+    expected, expected_removed = apply_ica(data, **kwargs)
+
+    params = {'test': 1}
+    first, removed = apply_ica(data, checkpoint=ChunkCheckpoint(str(tmp_path), params), **kwargs)
+    np.testing.assert_array_equal(first, expected)
+    np.testing.assert_array_equal(removed, expected_removed)
+
+    # Forget the middle chunk, as if the run had died while cleaning it
+    checkpoint = ChunkCheckpoint(str(tmp_path), params)
+    checkpoint.manifest['chunks'] = [c for c in checkpoint.manifest['chunks'] if c['start'] != 4]
+    checkpoint._done = {(c['start'], c['stop']) for c in checkpoint.manifest['chunks']}
+
+    cleaned_starts = []
+    clean_chunk = artifact_removal._clean_chunk
+
+    def counting(args):
+        cleaned_starts.append(args[1])
+        return clean_chunk(args)
+
+    monkeypatch.setattr(artifact_removal, "_clean_chunk", counting)
+    resumed, removed = apply_ica(data, checkpoint=checkpoint, **kwargs)
+    assert cleaned_starts == [4]
+    np.testing.assert_array_equal(resumed, expected)
+    np.testing.assert_array_equal(removed, expected_removed)
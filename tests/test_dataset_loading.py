@@ -0,0 +1,38 @@
+import numpy as np
+
+import dataset_loading
+from conftest import write_raw_dump
+from dataset_loading import parse_chunk, scan_events, write_dataset
+
+
+def _z(x):
+    return (x - x.mean(axis=-1, keepdims=True)) / x.std(axis=-1, keepdims=True)
+
+
+def test_scan_pass_does_not_parse_values(raw_dump, monkeypatch):
+    path, raw = raw_dump
+
+    def fail(*args):
+        raise AssertionError("scan pass parsed values")
+
+    monkeypatch.setattr(dataset_loading, "_parse_values", fail)
+    result = parse_chunk((path, 0, len(open(path, "rb").read()), ["TP9", "FP1", "FP2", "TP10"], "MU", True, False))
+    assert len(result['codes']) == raw.shape[0] * raw.shape[1]
+    assert (result['lengths'] == raw.shape[2]).all()
+
+
+def test_unparseable_values_are_zeroed_in_place(tmp_path):
+    path = str(tmp_path / "dump.txt")
+    raw = write_raw_dump(path, n_samples=6, length=50)
+    lines = open(path).read().split("\n")
+    fields = lines[5].split("\t")
+    lines[5] = "\t".join(fields[:6] + [fields[6].replace(",", ",x", 1)])
+    with open(path, "w") as f:
+        f.write("\n".join(lines))
+
+    plan = scan_events(path, n_workers=1)
+    assert len(plan['labels']) == 6
+    dataset, _ = write_dataset(path, str(tmp_path / "out"), n_workers=1, dtype="float64")
+    expected = _z(raw)
+    expected[1, 1] = 0.0
+    np.testing.assert_allclose(dataset, expected, atol=1e-9)
@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+import delta_codec
+from dtype_policy import resolve_dtype
+
+
+@pytest.mark.parametrize("scale", [delta_codec.DEFAULT_SCALE, 10])
+@pytest.mark.parametrize("loc, spread", [(0.0, 1.0), (500.0, 40.0)])
+def test_round_trip_within_bound_at_policy_dtype(scale, loc, spread):
+    rng = np.random.default_rng(0)
+    dataset = rng.normal(loc, spread, size=(64, 4, 612)).astype(resolve_dtype())
+    starts, deltas = delta_codec.encode(dataset, scale)
+    decoded = delta_codec.decode(starts, deltas, scale)
+
+    assert decoded.dtype == resolve_dtype()
+    error = np.abs(decoded.astype(np.float64) - dataset.astype(np.float64)).max()
+    assert error <= delta_codec.max_abs_error(scale, float(np.abs(dataset).max()))
@@ -0,0 +1,26 @@
+import numpy as np
+
+from artifact_removal import VALIDATION_THRESHOLD, compare_backends
+from pipeline import PreprocessingPipeline
+
+
+def _blink_epochs(n_epochs=16, n_times=612, sfreq=250.0, seed=1):
+    rng = np.random.RandomState(seed)
+    t = np.arange(n_times) / sfreq
+    data = rng.randn(n_epochs, 4, n_times) * 10
+    for epoch in data:
+        epoch += np.sin(2 * np.pi * 10 * t) * rng.uniform(0, 20)
+    for epoch in data[::3]:
+        blink = np.exp(-((t - rng.uniform(0.5, 2)) ** 2) / 0.01) * rng.uniform(30, 200)
+        epoch[1] += blink
+        epoch[2] += 0.8 * blink
+    return PreprocessingPipeline().filter(data).astype(np.float64)
+
+
+def test_numpy_backend_matches_mne_where_components_are_removed():
+    report = compare_backends(_blink_epochs(), 250.0, threshold=VALIDATION_THRESHOLD)
+    assert report['mne_components_removed'] > 0
+    assert report['numpy_components_removed'] == report['mne_components_removed']
+    assert report['removal_agreement'] == 1.0
+    assert report['output_match'] == 1.0
+    assert report['max_rel_diff'] < 1e-9
@@ -0,0 +1,23 @@
+import os
+
+from stage_cache import StageCache
+
+
+def test_file_stage_output_does_not_alias_cache(tmp_path):
+    stages = StageCache(cache_dir=str(tmp_path / "cache"))
+    output_path = str(tmp_path / "out.bin")
+
+    def build(path):
+        with open(path, "wb") as f:
+            f.write(b"cached result")
+
+    key = stages.file_stage('write', 'upstream', {}, output_path, build)
+    with open(output_path, "r+b") as f:
+        f.write(b"OVERWRITTEN")
+
+    with open(os.path.join(stages.cache.entry_dir(key), "out.bin"), "rb") as f:
+        assert f.read() == b"cached result"
+    stages.file_stage('write', 'upstream', {}, output_path, build)
+    assert stages.hits['write']
+    with open(output_path, "rb") as f:
+        assert f.read() == b"cached result"
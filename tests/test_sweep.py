@@ -0,0 +1,28 @@
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("braindecode")
+
+from sweep import rank_results, sweep_settings_key, trial_id
+
+
+def test_trial_id_depends_on_sweep_settings(tmp_path):
+    data_path = tmp_path / "data.parquet"
+    data_path.write_bytes(b"data")
+    params = {'lr': 1e-3, 'weight_decay': 0.01, 'batch_size': 32, 'depth': 2}
+    base = dict(max_epochs=20, seed=0, valid_fraction=0.2, precision="auto")
+    key = sweep_settings_key(str(data_path), **base)
+
+    assert trial_id(params, key) == trial_id(params, sweep_settings_key(str(data_path), **base))
+    for name, value in (('max_epochs', 5), ('seed', 1), ('valid_fraction', 0.3), ('precision', "fp32")):
+        assert trial_id(params, sweep_settings_key(str(data_path), **{**base, name: value})) != trial_id(params, key)
+
+    data_path.write_bytes(b"other data")
+    assert trial_id(params, sweep_settings_key(str(data_path), **base)) != trial_id(params, key)
+
+
+def test_failed_trials_rank_below_zero_accuracy():
+    records = [{'trial': 'failed', 'best_valid_accuracy': None},
+               {'trial': 'zero', 'best_valid_accuracy': 0.0},
+               {'trial': 'best', 'best_valid_accuracy': 0.4}]
+    assert [r['trial'] for r in rank_results(records)] == ['best', 'zero', 'failed']
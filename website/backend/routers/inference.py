@@ -1,7 +1,7 @@
 from fastapi import APIRouter, HTTPException, Request
 from models.eeg_data import EEGData, InferenceResult
 from services.eeg_processor import process_eeg_data
-from services.model_predictor import get_prediction
+from services.model_predictor import predict as predict_digit
 
 router = APIRouter(prefix="/inference", tags=["Model Inference"])
 
@@ -21,13 +21,11 @@ async def predict(data: EEGData, request: Request):
                 processed_data["processed_channels"][i] = processed_data["processed_channels"][i][-612:]
         
         # Step 2: Get prediction from the model
-        prediction = get_prediction(processed_data)
+        prediction, confidence = predict_digit(processed_data)
         
         # Step 3: Update the app state
-        # Assuming prediction is a number or can be converted to one
-        prediction_value = int(prediction) if hasattr(prediction, "__len__") else int(prediction.max())
-        request.app.state.predicted_number = prediction_value
+        request.app.state.predicted_number = int(prediction)
         
-        return {"prediction": prediction, "confidence": float(prediction.max())}
+        return {"prediction": prediction, "confidence": confidence}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error during inference: {str(e)}") 
\ No newline at end of file
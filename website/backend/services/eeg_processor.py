@@ -3,82 +3,49 @@ import os
 
 # Add the parent directory to the Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Shared preprocessing modules (pipeline, numpy_ica) live in the repository's preprocessing directory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'preprocessing'))
 
 import numpy as np
 from models.eeg_data import EEGData
-from scipy import signal
-import mne
-from mne.preprocessing import ICA
+from pipeline import PreprocessingPipeline
 import warnings
 
 # Silence warnings
 warnings.filterwarnings('ignore')
-mne.set_log_level('ERROR')
 
-def apply_bandpass_filter(data, lowcut, highcut, fs, order=6):
-    """
-    Apply a Chebyshev Type II bandpass filter to the data
-    
-    Args:
-        data: Input signal
-        lowcut: Lower cutoff frequency
-        highcut: Higher cutoff frequency
-        fs: Sampling frequency
-        order: Filter order
-        
-    Returns:
-        Filtered signal
-    """
-    nyq = 0.5 * fs
-    low = lowcut / nyq
-    high = highcut / nyq
-    
-    # Use Chebyshev Type II filter (matches preprocessing.py)
-    sos = signal.cheby2(order, 40, [low, high], btype='band', output='sos')
-    filtered_data = signal.sosfiltfilt(sos, data)
-    
-    return filtered_data
+# Muse 2 sampling rate
+SAMPLING_RATE = 256
+
 
-def apply_ica(data, sampling_rate, n_components=3):
+def load_pipeline():
     """
-    Apply ICA to remove artifacts from EEG data
-    
-    Args:
-        data: EEG data with shape (channels, samples)
-        sampling_rate: Sampling rate in Hz
-        n_components: Number of ICA components
-        
-    Returns:
-        Cleaned data
+    Build the preprocessing pipeline once per process.
+
+    Uses the training settings (the same filter design and ICA settings as
+    preprocess_data) at the Muse 2 sampling rate, with z-scoring at the end.
+    EEG_PIPELINE_CONFIG can point to a JSON config saved with
+    PreprocessingPipeline.save, and EEG_ICA_BACKEND selects 'numpy' or 'mne'.
+    Otherwise, when EEG_MODEL_DIR points to an exported model, the config
+    saved with it is used as is (only the sampling rate is the device's), so
+    windows are preprocessed exactly like the model's training data,
+    including the per-channel z-scoring of the raw input done at ingest.
     """
-    # Create MNE-compatible data structure
-    ch_names = ['TP9', 'FP1', 'FP2', 'TP10']  # Adjust based on your channel names
-    info = mne.create_info(ch_names=ch_names[:data.shape[0]], sfreq=sampling_rate, ch_types='eeg')
-    
-    # Create an MNE Raw object
-    raw = mne.io.RawArray(data, info)
-    
-    # Apply 1 Hz high-pass filter specifically for ICA (as in preprocessing.py)
-    raw_ica = raw.copy()
-    raw_ica.filter(l_freq=1.0, h_freq=None, verbose=False)
-    
-    # Apply ICA
-    try:
-        ica = ICA(n_components=n_components, random_state=42, method='fastica', verbose=False)
-        ica.fit(raw_ica, verbose=False)
-        
-        # Find and remove EOG artifacts
-        eog_indices, _ = ica.find_bads_eog(raw_ica, ch_name=['FP1', 'FP2'], verbose=False)
-        
-        if eog_indices:
-            ica.exclude = eog_indices
-            cleaned = ica.apply(raw.copy(), verbose=False)
-            return cleaned.get_data()
-        else:
-            return raw.get_data()
-    except Exception as e:
-        print(f"ICA failed with error: {e}")
-        return data  # Return original data if ICA fails
+    overrides = {'sampling_rate': SAMPLING_RATE, 'normalize': True}
+    if 'EEG_ICA_BACKEND' in os.environ:
+        overrides['ica_backend'] = os.environ['EEG_ICA_BACKEND']
+    config_path = os.environ.get('EEG_PIPELINE_CONFIG')
+    if config_path:
+        return PreprocessingPipeline.from_file(config_path, **overrides)
+    model_config = os.path.join(os.environ.get('EEG_MODEL_DIR', ''), 'preprocessing.json')
+    if 'EEG_MODEL_DIR' in os.environ and os.path.exists(model_config):
+        overrides.pop('normalize')
+        return PreprocessingPipeline.from_file(model_config, **overrides)
+    return PreprocessingPipeline(**overrides)
+
+
+PIPELINE = load_pipeline()
+
 
 def process_eeg_data(data: EEGData) -> dict:
     """
@@ -90,37 +57,23 @@ def process_eeg_data(data: EEGData) -> dict:
     Returns:
         Processed data ready for inference
     """
-    # Convert to numpy array for processing
-    channels_data = np.array(data.channels)
+    # Convert to numpy array, z-scored per channel like the training data was at ingest
+    channels_data = PIPELINE.prepare_input(data.channels)
     
-    # Step 1: Apply bandpass filtering (Chebyshev Type II, 6th order)
-    filtered_channels = np.zeros_like(channels_data, dtype=np.float32)
-    for i in range(len(channels_data)):
-        filtered_channels[i] = apply_bandpass_filter(
-            channels_data[i], 
-            lowcut=0.5, 
-            highcut=50.0, 
-            fs=256,  # Muse 2 sampling rate
-            order=6   # 6th order as requested
-        )
+    # Step 1: Apply bandpass filtering (coefficients are designed once in PIPELINE)
+    filtered_channels = PIPELINE.filter(channels_data)
     
     # Step 2: Apply ICA for artifact removal
     try:
-        cleaned_channels = apply_ica(filtered_channels, sampling_rate=256)
+        cleaned_channels, _ = PIPELINE.remove_artifacts(filtered_channels)
     except Exception as e:
         print(f"Error in ICA processing: {e}")
         cleaned_channels = filtered_channels  # Fallback to filtered data
     
     # Step 3: Z-score normalization
-    normalized_channels = np.zeros_like(cleaned_channels, dtype=np.float32)
-    for i in range(len(cleaned_channels)):
-        channel = cleaned_channels[i]
-        mean = np.mean(channel)
-        std = np.std(channel)
-        if std > 0:  # Avoid division by zero
-            normalized_channels[i] = (channel - mean) / std
-        else:
-            normalized_channels[i] = channel  # Keep original if std is 0
+    if PIPELINE.config['normalize']:
+        cleaned_channels = PIPELINE.normalize(cleaned_channels)
+    normalized_channels = cleaned_channels.astype(np.float32)
     
     # Return processed data
     return {
@@ -1,11 +1,55 @@
-import numpy as np
+import os
+import sys
 import itertools
+
+import numpy as np
+
+# Exported model loader lives with the training code in the repository's eeg_conformer directory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'eeg_conformer'))
+
+# Placeholder predictions used when no model artifact is configured
 SEQUENCE = [8, 7, 6, 5, 4, 2, 0]
 sequence_iterator = itertools.cycle(SEQUENCE)
 
-def get_prediction(processed_data):
-    return next(sequence_iterator)
 
+def load_model():
+    """
+    Load the artifact written by eeg_conformer/export.py from EEG_MODEL_DIR,
+    once per process. Returns None when no model is configured.
+    """
+    model_dir = os.environ.get('EEG_MODEL_DIR')
+    if not model_dir:
+        return None
+    from artifact import ExportedModel
+    threads = int(os.environ.get('EEG_MODEL_THREADS', '1'))
+    return ExportedModel(model_dir, threads=threads)
+
+
+MODEL = load_model()
+
+
+def predict(processed_data):
+    """
+    Classify the most recent window of processed EEG.
+
+    Args:
+        processed_data: Output of process_eeg_data
+
+    Returns:
+        tuple: (predicted label, confidence)
+    """
+    if MODEL is None:
+        # No model configured: cycle through the demo sequence
+        return next(sequence_iterator), 0.0
+    window = np.asarray(processed_data["processed_channels"], dtype=np.float32)
+    if window.shape[-1] < MODEL.n_times:
+        raise ValueError(f"Need {MODEL.n_times} samples per channel, got {window.shape[-1]}")
+    labels, probabilities = MODEL.predict(window[:, -MODEL.n_times:])
+    return int(labels[0]), float(probabilities[0].max())
+
+
+def get_prediction(processed_data):
+    return predict(processed_data)[0]
 
 
 if __name__ == "__main__":